@@ -1,5 +1,5 @@
 import graphene
-from crm.schema import Query as CRMQuery, Mutation as CRMMutation
+from crm.schema import AsyncQuery as CRMAsyncQuery, Query as CRMQuery, Mutation as CRMMutation
 
 
 class Query(CRMQuery, graphene.ObjectType):
@@ -8,4 +8,11 @@ class Query(CRMQuery, graphene.ObjectType):
 class Mutation(CRMMutation, graphene.ObjectType):
     pass
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+schema = graphene.Schema(query=Query, mutation=Mutation)
+
+class AsyncQuery(CRMAsyncQuery, graphene.ObjectType):
+    class Meta:
+        name = "Query"
+
+# Served by the ASGI view (crm.views.AsyncCRMGraphQLView)
+async_schema = graphene.Schema(query=AsyncQuery, mutation=Mutation)
@@ -131,6 +131,51 @@ GRAPHENE = {
     "SCHEMA": "alx_backend_graphql.schema.schema"
 }
 
+# Largest page the plain list fields (customers, products, orders) will return
+CRM_LIST_MAX_PAGE_SIZE = 100
+
+# Automatic persisted queries and parsed document cache (crm/persisted.py)
+CRM_PERSISTED_QUERIES = {
+    "CACHE_SIZE": 500,          # parsed + validated documents kept in memory (LRU)
+    "ALLOW_LIST_ONLY": False,   # True: only run the documents of ALLOW_LIST
+    "ALLOW_LIST": None,         # JSON file mapping sha256 -> query text
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every process, use it when running several workers
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    },
+}
+
+# Cache of GraphQL query responses (crm/response_cache.py), opt-in: it is OFF as
+# shipped. The backend must be shared by the web workers, the Celery worker and
+# the management commands, all of which invalidate entries, so the cache stays
+# off on the per-process 'default' backend. Set ALIAS to 'redis' to turn it on.
+CRM_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "ALIAS": "default",
+    "TIMEOUT": 300,             # seconds, entries also go stale when their models change
+    "ALLOW_LOCAL": False,       # True to use a LocMemCache alias, when everything runs in one process
+}
+
+# Query depth and cost budget (crm/cost.py), the cost estimates the objects a query resolves
+CRM_QUERY_COST = {
+    "MAX_DEPTH": 10,
+    "MAX_COST": 200000,
+    "LIST_SIZE": 10,            # assumed length of lists without first/last (order products)
+}
+
+# Resolver/SQL timings (crm/tracing.py): extensions.tracing on request, histograms at /metrics
+CRM_TRACING = {
+    "ENABLED": True,
+    "HEADER": "X-CRM-Tracing",  # requests sending it get extensions.tracing, None: never
+}
+
 CRONJOBS = [
     ('*/5 * * * *', 'crm.cron.log_crm_heartbeat'),
     ('0 */12 * * *', 'crm.cron.update_low_stock'),
@@ -142,9 +187,17 @@ CELERY_TIMEZONE = 'UTC'
 
 from celery.schedules import crontab
 
+# generate_crm_report aggregates in the worker instead of calling /graphql
+CRM_REPORT_IN_PROCESS = True
+
 CELERY_BEAT_SCHEDULE = {
     'generate-crm-report': {
         'task': 'crm.tasks.generate_crm_report',
         'schedule': crontab(day_of_week='mon', hour=6, minute=0),
     },
+    # salesByDay / topProducts read the rollup, this is how stale they can get
+    'refresh-daily-sales': {
+        'task': 'crm.tasks.refresh_daily_sales',
+        'schedule': crontab(minute='*/10'),
+    },
 }
\ No newline at end of file
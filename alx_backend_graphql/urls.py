@@ -1,9 +1,16 @@
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from crm.views import AsyncCRMGraphQLView, CRMGraphQLView, export, metrics, response_cache_stats
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql', csrf_exempt(CRMGraphQLView.as_view(graphiql=True))),
+    # Same API executed asynchronously, for ASGI servers (asgi.py)
+    path('graphql/async', csrf_exempt(AsyncCRMGraphQLView.as_view(graphiql=True))),
+    path('graphql/cache-stats', response_cache_stats),
+    path('metrics', metrics),
+    # Whole tables as NDJSON or CSV, streamed (crm.exports)
+    path('export/<str:resource>', export),
 ]
@@ -0,0 +1,6 @@
+"""Benchmarks for the CRM backend
+
+Each benchmark is a script run from the project root, for example:
+    python -m benchmarks.order_concurrency
+They run against a throwaway SQLite database (see benchmarks.utils), never db.sqlite3.
+"""
@@ -0,0 +1,24 @@
+import os
+import time
+
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def add_latency(connection, **kwargs):
+    """Sleeps before every statement, like the round trip to a networked database"""
+    latency = float(os.environ.get("CRM_BENCH_DB_LATENCY_MS", 0)) / 1000
+
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(latency)
+        return execute(sql, params, many, context)
+
+    if latency and wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(wrapper)
+
+
+class BenchmarksConfig(AppConfig):
+    name = "benchmarks"
+
+    def ready(self):
+        connection_created.connect(add_latency)
@@ -0,0 +1,217 @@
+"""Synthetic CRM data at production scale
+
+Fills a benchmark database with customers, products and orders through
+bulk_create, one transaction per chunk, with explicit ids so the order items
+of a chunk are inserted right after its orders without reading them back.
+The data is shaped like a real shop and is the same for the same --seed:
+    - order dates spread over two years, customers signed up before their orders
+    - a few customers place most orders, a few products are in most orders
+    - 1 to 6 products per order, mostly one unit of each, total_amount is the
+      sum of the items at their price
+    - a tail of products on low stock (lowStock filter, restock mutation)
+
+    python -m benchmarks.datagen --database crm-bench.sqlite3 --scale full
+    python -m benchmarks.datagen --database crm-bench.sqlite3 --customers 5000 --orders 20000
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.utils import setup_django
+
+
+# customers, products, orders
+SCALES = {
+    "small": (2_000, 200, 10_000),
+    "medium": (100_000, 10_000, 500_000),
+    "full": (1_000_000, 100_000, 5_000_000),
+}
+
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Amara", "Chinedu",
+    "Wanjiru", "Kwame", "Fatima", "Omar", "Aisha", "Yusuf", "Zanele", "Thabo", "Mei", "Hiroshi",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Okafor", "Mensah", "Kamau", "Diallo", "Nkosi", "Haddad", "Tanaka", "Chen", "Kowalski", "Novak",
+)
+ADJECTIVES = (
+    "Wireless", "Ergonomic", "Compact", "Premium", "Portable", "Smart", "Rugged", "Silent", "Ultra", "Classic",
+)
+NOUNS = (
+    "Laptop", "Mouse", "Keyboard", "Monitor", "Headset", "Webcam", "Speaker", "Charger", "Dock", "Router",
+    "Tablet", "Printer", "Microphone", "Drive", "Cable",
+)
+
+HISTORY = timedelta(days=730)
+CHUNK_SIZE = 10_000
+
+
+def skewed_index(rng, size, skew):
+    """Index in [0, size), low indexes are more likely the larger skew is
+    With skew 3 the first 1% of the range gets about 21% of the draws, the first 20% about 58%."""
+    return int(size * rng.random() ** skew)
+
+
+def chunks(total, size=CHUNK_SIZE):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def next_id(model):
+    from django.db.models import Max
+
+    return (model.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+
+def generate_customers(count, rng, now):
+    from django.db import transaction
+    from crm.models import Customer
+
+    first_id = next_id(Customer)
+    for start, size in chunks(count):
+        rows = []
+        for i in range(first_id + start, first_id + start + size):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            kind = rng.random()
+            phone = (
+                None if kind < 0.3
+                else f"+1{rng.randrange(10**9, 10**10)}" if kind < 0.8
+                else f"{rng.randrange(100, 1000)}-{rng.randrange(100, 1000)}-{rng.randrange(1000, 10000)}"
+            )
+            rows.append(Customer(
+                id=i,
+                name=f"{first} {last}",
+                email=f"{first.lower()}.{last.lower()}.{i}@example.com",
+                phone=phone,
+                # Signed up before the first possible order
+                created_at=now - HISTORY - timedelta(days=rng.randrange(365), seconds=rng.randrange(86400)),
+            ))
+        with transaction.atomic():
+            Customer.objects.bulk_create(rows)
+    return list(range(first_id, first_id + count))
+
+
+def generate_products(count, rng):
+    from django.db import transaction
+    from crm.models import Product
+
+    first_id = next_id(Product)
+    prices = {}
+    for start, size in chunks(count):
+        rows = []
+        for i in range(first_id + start, first_id + start + size):
+            price = Decimal(min(rng.lognormvariate(3.5, 1.0), 5000)).quantize(Decimal("0.01")) + Decimal("0.99")
+            prices[i] = price
+            rows.append(Product(
+                id=i,
+                name=f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+                price=price,
+                # About 5% on low stock
+                stock=rng.randrange(10) if rng.random() < 0.05 else rng.randrange(10, 500),
+            ))
+        with transaction.atomic():
+            Product.objects.bulk_create(rows)
+    return prices
+
+
+def generate_orders(count, customer_ids, prices, rng, now):
+    from django.db import transaction
+    from crm.models import Order, OrderItem
+
+    product_ids = list(prices)
+    # The popular customers and products are spread over the id range
+    rng.shuffle(customer_ids)
+    rng.shuffle(product_ids)
+    first_id = next_id(Order)
+    history_seconds = int(HISTORY.total_seconds())
+    links = 0
+    for start, size in chunks(count):
+        orders, items = [], []
+        for order_id in range(first_id + start, first_id + start + size):
+            fan_out = min(1 + int(rng.expovariate(0.6)), 6, len(product_ids))
+            picked = set()
+            while len(picked) < fan_out:
+                picked.add(product_ids[skewed_index(rng, len(product_ids), skew=2)])
+            lines = [
+                OrderItem(
+                    order_id=order_id, product_id=product_id, unit_price=prices[product_id],
+                    # About 1 in 5 lines with more than one unit
+                    quantity=1 if rng.random() < 0.8 else rng.randrange(2, 6),
+                )
+                for product_id in picked
+            ]
+            orders.append(Order(
+                id=order_id,
+                customer_id=customer_ids[skewed_index(rng, len(customer_ids), skew=3)],
+                order_date=now - timedelta(seconds=rng.randrange(history_seconds)),
+                total_amount=sum(line.unit_price * line.quantity for line in lines),
+            ))
+            items.extend(lines)
+        with transaction.atomic():
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create(items)
+        links += len(items)
+    return links
+
+
+def generate(customers, products, orders, seed=0, log=print):
+    """Adds the rows to the configured database, returns {"customers", "products", "orders", "links"}"""
+    from django.utils import timezone
+    from crm.models import Customer, Order, Product
+    from crm.response_cache import invalidate
+    from crm.rollup import refresh_sales_rollup
+    from crm.stats import rebuild_customer_stats
+
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    start = time.perf_counter()
+    customer_ids = generate_customers(customers, rng, now)
+    log(f"{customers} customers in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    prices = generate_products(products, rng)
+    log(f"{products} products in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    links = generate_orders(orders, customer_ids, prices, rng, now) if customer_ids and prices else 0
+    log(f"{orders} orders with {links} order items in {time.perf_counter() - start:.1f}s")
+
+    # bulk_create sends no signals
+    start = time.perf_counter()
+    rebuild_customer_stats()
+    log(f"customer stats in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    refresh_sales_rollup()
+    log(f"sales rollup in {time.perf_counter() - start:.1f}s")
+    invalidate(Customer, Product, Order)
+    return {"customers": customers, "products": products, "orders": orders, "links": links}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="SQLite file to fill (temporary by default)")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--customers", type=int, help="overrides the scale")
+    parser.add_argument("--products", type=int, help="overrides the scale")
+    parser.add_argument("--orders", type=int, help="overrides the scale")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database = setup_django(args.database)
+    customers, products, orders = SCALES[args.scale]
+    generate(
+        args.customers if args.customers is not None else customers,
+        args.products if args.products is not None else products,
+        args.orders if args.orders is not None else orders,
+        seed=args.seed,
+    )
+    print(f"Database: {database}")
+
+
+if __name__ == "__main__":
+    main()
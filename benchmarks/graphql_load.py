@@ -0,0 +1,154 @@
+"""Load benchmark: sync GraphQL under WSGI against async GraphQL under ASGI
+
+Seeds a throwaway database, then for each server
+    - gunicorn with threaded workers serving the sync view (/graphql)
+    - uvicorn serving the async view (/graphql/async)
+fires the same query from many concurrent clients and reports the throughput
+and the latency percentiles. Needs gunicorn and uvicorn (pip install gunicorn uvicorn).
+
+SQLite answers in microseconds, so the servers are CPU bound and the event loop
+has nothing to overlap. --db-latency adds a sleep before every SQL statement to
+stand in for the round trip to a networked database.
+
+    python -m benchmarks.graphql_load --concurrency 64 --requests 2000 --workers 2
+    python -m benchmarks.graphql_load --concurrency 256 --db-latency 5
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+import httpx
+
+from benchmarks.utils import percentile, setup_django
+
+
+# Sibling root fields: resolved one after the other by the sync view,
+# concurrently by the async one
+QUERY = """
+    query {
+        customers(first: 50) { name email }
+        products(first: 50) { name price stock }
+        orders(first: 50) { totalAmount customer { name } products { name } }
+        crmStats { customerCount orderCount revenue }
+    }
+"""
+
+
+def seed(customers, products, orders_per_customer):
+    from crm.models import Customer, Order, OrderItem, Product
+
+    product_rows = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal("9.99") + i, stock=100) for i in range(products)
+    )
+    customer_rows = Customer.objects.bulk_create(
+        Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(customers)
+    )
+    order_rows = Order.objects.bulk_create(
+        Order(customer=customer, total_amount=Decimal("19.98"))
+        for customer in customer_rows
+        for _ in range(orders_per_customer)
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order_id=order.id, product_id=product.id, unit_price=product.price)
+        for n, order in enumerate(order_rows)
+        for product in (product_rows[n % products], product_rows[(n + 1) % products])
+    )
+
+
+def server_command(kind, port, workers, threads):
+    if kind == "wsgi":
+        return [
+            sys.executable, "-m", "gunicorn", "alx_backend_graphql.wsgi:application",
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--threads", str(threads),
+            "--log-level", "warning",
+        ]
+    return [
+        sys.executable, "-m", "uvicorn", "alx_backend_graphql.asgi:application",
+        "--port", str(port), "--workers", str(workers), "--no-access-log", "--log-level", "warning",
+    ]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.post(url, json={"query": "{ hello }"}, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def fire(url, concurrency, total):
+    """Latencies (seconds) of total requests sent by concurrency clients, and the wall time"""
+    latencies = []
+    pending = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def client_loop():
+            for _ in pending:
+                start = time.perf_counter()
+                response = await client.post(url, json={"query": QUERY})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200 or "errors" in response.json():
+                    raise RuntimeError(response.text[:500])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2, help="server processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per WSGI worker")
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--orders-per-customer", type=int, default=5)
+    parser.add_argument("--db-latency", type=float, default=0, help="milliseconds added to every SQL statement")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--database", help="SQLite file to use (temporary by default)")
+    args = parser.parse_args()
+
+    database = setup_django(args.database)
+    seed(args.customers, args.products, args.orders_per_customer)
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "benchmarks.settings",
+        "CRM_BENCH_DATABASE": database,
+        "CRM_BENCH_RESPONSE_CACHE": "1" if args.response_cache else "0",
+        "CRM_BENCH_DB_LATENCY_MS": str(args.db_latency),
+    }
+
+    print(
+        f"{args.requests} requests, {args.concurrency} concurrent clients, {args.workers} workers, "
+        f"{args.db_latency} ms per SQL statement"
+    )
+    for kind, path, port in (("wsgi", "/graphql", 8701), ("asgi", "/graphql/async", 8702)):
+        server = subprocess.Popen(server_command(kind, port, args.workers, args.threads), env=env)
+        try:
+            url = f"http://127.0.0.1:{port}{path}"
+            wait_until_up(url)
+            asyncio.run(fire(url, args.concurrency, args.concurrency))  # warm up
+            latencies, elapsed = asyncio.run(fire(url, args.concurrency, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(
+            f"{kind}: {len(latencies) / elapsed:8.1f} req/s   "
+            f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   "
+            f"p95 {percentile(latencies, 95) * 1000:7.1f} ms   "
+            f"p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
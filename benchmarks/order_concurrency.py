@@ -0,0 +1,87 @@
+"""Concurrency benchmark for the createOrder mutation
+
+Runs many threads placing orders for one shared product and checks that
+stock never oversells: successful orders == initial stock - final stock.
+
+    python -m benchmarks.order_concurrency --threads 16 --orders 50 --stock 300
+"""
+import argparse
+import threading
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from benchmarks.utils import setup_django
+
+
+MUTATION = """
+    mutation ($input: CreateOrderInput!) {
+        createOrder(input: $input) { order { id } }
+    }
+"""
+
+
+def place_orders(schema, customer_id, product_id, count, results):
+    from django.db import connection
+
+    succeeded = failed = 0
+    for _ in range(count):
+        result = schema.execute(
+            MUTATION,
+            variables={"input": {"customerId": customer_id, "productIds": [product_id]}},
+            context_value=SimpleNamespace(),
+        )
+        if result.errors:
+            failed += 1
+        else:
+            succeeded += 1
+    connection.close()
+    results.append((succeeded, failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--orders", type=int, default=50, help="orders placed by each thread")
+    parser.add_argument("--stock", type=int, default=300, help="initial stock of the shared product")
+    parser.add_argument("--database", help="SQLite file to use (temporary by default)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from alx_backend_graphql.schema import schema
+    from crm.models import Customer, Order, Product
+
+    customer = Customer.objects.create(name="Bench", email=f"bench-{time.time()}@example.com")
+    product = Product.objects.create(name="Shared product", price=Decimal("9.99"), stock=args.stock)
+    orders_before = Order.objects.count()
+
+    results = []
+    threads = [
+        threading.Thread(target=place_orders, args=(schema, customer.id, product.id, args.orders, results))
+        for _ in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    product.refresh_from_db()
+    created = Order.objects.count() - orders_before
+    attempts = args.threads * args.orders
+
+    print(f"{attempts} orders attempted by {args.threads} threads in {elapsed:.2f}s "
+          f"({attempts / elapsed:.0f} orders/s)")
+    print(f"succeeded: {succeeded}, rejected: {failed}, orders created: {created}")
+    print(f"stock: {args.stock} -> {product.stock}")
+
+    oversold = succeeded != args.stock - product.stock or created != succeeded
+    print("FAIL: stock and orders disagree" if oversold else "OK: no overselling")
+    return 1 if oversold else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
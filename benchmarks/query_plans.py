@@ -0,0 +1,100 @@
+"""EXPLAIN QUERY PLAN of every CRM filter and ordering, before and after the indexes
+
+Migrates a throwaway database to the state before the filter indexes, prints
+the plans, applies the index migration and prints them again.
+
+    python -m benchmarks.query_plans
+"""
+import argparse
+from datetime import date
+
+from benchmarks.utils import setup_django
+
+
+BEFORE_INDEXES = "0003_customer_created_at"
+
+# Sample arguments for every filter of the FilterSets, keyed by FilterSet name
+FILTER_SAMPLES = {
+    "CustomerFilter": {
+        "name": {"name": "smith"},
+        "email": {"email": "example"},
+        "createdAtGte": {"createdAtGte": date(2025, 1, 1)},
+        "createdAtLte": {"createdAtLte": date(2025, 1, 1)},
+        "phone_starts_with": {"phone_starts_with": "+1"},
+    },
+    "ProductFilter": {
+        "name": {"name": "laptop"},
+        "price": {"price_min": 10, "price_max": 100},
+        "stock": {"stock_min": 1, "stock_max": 5},
+        "lowStock": {"lowStock": True},
+    },
+    "OrderFilter": {
+        "totalAmountGte": {"totalAmountGte": 100},
+        "totalAmountLte": {"totalAmountLte": 100},
+        "orderDateAfter": {"orderDateAfter": date(2025, 1, 1)},
+        "orderDateBefore": {"orderDateBefore": date(2025, 1, 1)},
+        "customerName": {"customerName": "smith"},
+        "productName": {"productName": "laptop"},
+        "product_id": {"product_id": 1},
+    },
+}
+
+# orderBy values accepted by the connections, keyed by FilterSet name
+ORDERINGS = {
+    "CustomerFilter": ["name", "-created_at"],
+    "ProductFilter": ["price", "stock"],
+    "OrderFilter": ["-order_date", "total_amount"],
+}
+
+
+def columns_before_indexes(model):
+    """Names of the columns model had at BEFORE_INDEXES, the only ones both runs can select"""
+    from django.db import connection
+    from django.db.migrations.loader import MigrationLoader
+
+    state = MigrationLoader(connection).project_state(("crm", BEFORE_INDEXES))
+    historical = state.apps.get_model(model._meta.app_label, model._meta.model_name)
+    return [field.name for field in historical._meta.concrete_fields]
+
+
+def collect_plans():
+    from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+
+    plans = {}
+    for filterset_class in (CustomerFilter, ProductFilter, OrderFilter):
+        model = filterset_class._meta.model
+        name = filterset_class.__name__
+        # The current model has columns added after BEFORE_INDEXES
+        rows = model.objects.only(*columns_before_indexes(model))
+        for filter_name, data in FILTER_SAMPLES[name].items():
+            qs = filterset_class(data, queryset=rows).qs
+            plans[f"{name}.{filter_name}"] = qs.explain()
+        for ordering in ORDERINGS[name]:
+            # Keyset pages are ordered by the key plus the id in the same direction
+            tie_breaker = "-pk" if ordering.startswith("-") else "pk"
+            qs = rows.order_by(ordering, tie_breaker)[:100]
+            plans[f"{name} orderBy {ordering}"] = qs.explain()
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="SQLite file to use (temporary by default)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.core.management import call_command
+
+    call_command("migrate", "crm", BEFORE_INDEXES, verbosity=0)
+    before = collect_plans()
+    call_command("migrate", "crm", verbosity=0)
+    after = collect_plans()
+
+    for access_path, plan in before.items():
+        print(f"── {access_path}")
+        print(f"   before: {plan.replace(chr(10), chr(10) + '           ')}")
+        print(f"   after:  {after[access_path].replace(chr(10), chr(10) + '           ')}")
+
+
+if __name__ == "__main__":
+    main()
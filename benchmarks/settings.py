@@ -0,0 +1,27 @@
+"""Settings for the servers started by the benchmarks
+
+The project settings, on the database given by CRM_BENCH_DATABASE and with
+DEBUG off (DEBUG keeps every SQL statement in memory and turns on the
+graphene debug middleware).
+"""
+import os
+
+from alx_backend_graphql.settings import *  # noqa: F401,F403
+from alx_backend_graphql.settings import CRM_RESPONSE_CACHE, DATABASES, INSTALLED_APPS
+
+
+DEBUG = False
+# CRM_BENCH_DB_LATENCY_MS: simulated database round trip (benchmarks/apps.py)
+INSTALLED_APPS = [*INSTALLED_APPS, "benchmarks"]
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+DATABASES["default"]["NAME"] = os.environ["CRM_BENCH_DATABASE"]
+DATABASES["default"]["OPTIONS"] = {"timeout": 60}
+
+# Measure execution, not the response cache, unless asked to. The load test
+# only reads, the per-process backend of each server never serves stale data
+CRM_RESPONSE_CACHE = {
+    **CRM_RESPONSE_CACHE,
+    "ENABLED": os.environ.get("CRM_BENCH_RESPONSE_CACHE") == "1",
+    "ALLOW_LOCAL": True,
+}
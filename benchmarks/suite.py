@@ -0,0 +1,369 @@
+"""Benchmark suite of the CRM operations, compared against a stored baseline
+
+Times every root query, every filter of crm/filters.py, every mutation and the
+scheduled jobs, and reports the p50/p95 latency and the SQL queries of each.
+Queries and mutations go through the /graphql view (persisted documents, cost
+limits, tracing) with the response cache off, so every run executes. Mutations
+and jobs that write run in a transaction that is rolled back: the data is the
+same for every run and every repeat. The jobs that call /graphql over HTTP
+(crm.cron, the order reminders script) are timed as their GraphQL documents.
+
+    python -m benchmarks.datagen --database crm-bench.sqlite3 --scale medium
+    python -m benchmarks.suite --database crm-bench.sqlite3 --save-baseline baseline.json
+    python -m benchmarks.suite --database crm-bench.sqlite3 --baseline baseline.json
+
+Without --database the suite runs on a fresh "small" database from
+benchmarks.datagen, the one benchmarks/baseline.json was measured on:
+
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+
+The exit code is 1 when an operation got slower than the baseline by more than
+--tolerance, or sends more SQL queries. Timings depend on the machine, the SQL
+query counts do not.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks import query_plans
+from benchmarks.utils import percentile, setup_django
+
+
+# The samples of query_plans, plus the filters on columns added after its "before" migration
+FILTER_SAMPLES = {
+    **query_plans.FILTER_SAMPLES,
+    "CustomerFilter": {
+        **query_plans.FILTER_SAMPLES["CustomerFilter"],
+        "orderCount": {"orderCountGte": 5},
+        "lifetimeRevenue": {"lifetimeRevenueGte": 1000},
+        "lastOrder": {"lastOrderBefore": date(2025, 1, 1)},
+    },
+}
+
+# Root fields of the query, as the clients ask for them
+ROOT_QUERIES = {
+    "hello": "query { hello }",
+    "customers": """
+        query { customers(first: 50) { name email phone orders { totalCount } } }
+    """,
+    "products": """
+        query { products(first: 50) { name price stock } }
+    """,
+    "orders": """
+        query { orders(first: 50) { orderDate totalAmount customer { name email } products { name price } } }
+    """,
+    "crmStats": """
+        query { crmStats { customerCount orderCount revenue averageOrderValue daily { date orderCount revenue } } }
+    """,
+    "salesByDay": """
+        query { salesByDay { date units orderCount revenue } }
+    """,
+    "topProducts": """
+        query { topProducts(first: 20) { product { name price } units orderCount revenue } }
+    """,
+    "allCustomers": """
+        query {
+            allCustomers(first: 50, orderBy: ["-created_at"]) {
+                totalCount edges { node { name email createdAt } } pageInfo { endCursor hasNextPage }
+            }
+        }
+    """,
+    "allProducts": """
+        query {
+            allProducts(first: 50, lowStock: true) {
+                totalCount edges { node { name price stock } } pageInfo { endCursor hasNextPage }
+            }
+        }
+    """,
+    "allOrders": """
+        query {
+            allOrders(first: 50, orderBy: ["-order_date"]) {
+                totalCount
+                edges { node { orderDate totalAmount customer { name } products { name } } }
+                pageInfo { endCursor hasNextPage }
+            }
+        }
+    """,
+}
+
+# Mutations with their variables, built from the sample rows and a run counter
+MUTATIONS = {
+    "createCustomer": (
+        """mutation ($input: CreateCustomerInput!) { createCustomer(input: $input) { customer { id } } }""",
+        lambda samples, n: {"input": {"name": "Bench", "email": f"bench-{n}@example.com", "phone": "+15550100000"}},
+    ),
+    "bulkCreateCustomers": (
+        """mutation ($input: [BulkCreateCustomersInput]!) { bulkCreateCustomers(input: $input) { errors } }""",
+        lambda samples, n: {"input": [
+            {"name": f"Bench {i}", "email": f"bench-{n}-{i}@example.com"} for i in range(100)
+        ]},
+    ),
+    "createProduct": (
+        """mutation ($input: CreateProductInput!) { createProduct(input: $input) { product { id } } }""",
+        lambda samples, n: {"input": {"name": f"Bench product {n}", "price": 19.99, "stock": 10}},
+    ),
+    "createOrder": (
+        """mutation ($input: CreateOrderInput!) {
+            createOrder(input: $input) { order { totalAmount products { name } } }
+        }""",
+        lambda samples, n: {"input": {"customerId": samples["customer"], "productIds": samples["products"]}},
+    ),
+    "bulkCreateOrders": (
+        """mutation ($input: [BulkCreateOrdersInput]!) { bulkCreateOrders(input: $input) { errors } }""",
+        lambda samples, n: {"input": [
+            {"customerId": samples["customer"], "orderDate": "2024-01-01T12:00:00+00:00",
+             "items": [{"productId": product, "quantity": 1 + i % 3} for product in samples["products"]]}
+            for i in range(100)
+        ]},
+    ),
+    "updateLowStockProducts": (
+        """mutation { updateLowStockProducts { products { name stock } } }""",
+        lambda samples, n: None,
+    ),
+}
+
+
+class Runner:
+    """Runs the operations and collects their measures"""
+
+    def __init__(self, repeat, only=None):
+        from django.test import Client
+
+        self.repeat = repeat
+        self.only = only
+        self.client = Client()
+        self.results = {}
+
+    def graphql(self, document, variables=None):
+        response = self.client.post(
+            "/graphql", json.dumps({"query": document, "variables": variables}),
+            content_type="application/json",
+        )
+        payload = response.json()
+        if payload.get("errors"):
+            raise RuntimeError(payload["errors"])
+        return payload
+
+    def measure(self, name, operation, rollback=False):
+        """Times operation (one warm-up run, then repeat runs)"""
+        from django.db import connection, transaction
+        from django.test.utils import CaptureQueriesContext
+
+        if self.only and self.only not in name:
+            return
+
+        def run():
+            if not rollback:
+                return operation()
+            with transaction.atomic():
+                operation()
+                transaction.set_rollback(True)
+
+        run()
+        timings, queries = [], 0
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(captured))
+        self.results[name] = {
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "queries": queries,
+        }
+        print(format_row(name, self.results[name]), flush=True)
+
+
+def sample_rows():
+    """Ids the mutations work on: the most active customer, products with stock"""
+    from django.db.models import Count
+    from crm.models import Customer, Product
+
+    customer = Customer.objects.annotate(n=Count("orders")).order_by("-n").values_list("id", flat=True).first()
+    products = list(Product.objects.filter(stock__gte=100).order_by("id").values_list("id", flat=True)[:3])
+    if customer is None or len(products) < 3:
+        raise SystemExit("The database has no data, fill it with benchmarks.datagen first")
+    return {"customer": customer, "products": products}
+
+
+def check_coverage(schema):
+    """Root fields the suite does not time yet"""
+    graphql_schema = schema.graphql_schema
+    missing = set(graphql_schema.query_type.fields) - set(ROOT_QUERIES)
+    missing |= set(graphql_schema.mutation_type.fields) - set(MUTATIONS)
+    for name in sorted(missing):
+        print(f"warning: {name} is not benchmarked")
+
+
+def run_suite(runner):
+    from django.core.management import call_command
+    from graphql import print_ast
+
+    from alx_backend_graphql.schema import schema
+    from crm import cron
+    from crm.cron_jobs import send_order_reminders
+    from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+    from crm.rollup import refresh_sales_rollup
+    from crm.tasks import compute_report_stats
+
+    check_coverage(schema)
+    samples = sample_rows()
+    counter = itertools.count()
+
+    for field, document in ROOT_QUERIES.items():
+        runner.measure(f"query {field}", lambda document=document: runner.graphql(document))
+
+    for filterset_class in (CustomerFilter, ProductFilter, OrderFilter):
+        model = filterset_class._meta.model
+        for filter_name, data in FILTER_SAMPLES[filterset_class.__name__].items():
+            runner.measure(
+                f"filter {filterset_class.__name__}.{filter_name}",
+                lambda f=filterset_class, m=model, data=data: list(f(data, queryset=m.objects.all()).qs[:50]),
+            )
+
+    for field, (document, variables) in MUTATIONS.items():
+        runner.measure(
+            f"mutation {field}",
+            lambda document=document, variables=variables: runner.graphql(
+                document, variables(samples, next(counter))
+            ),
+            rollback=True,
+        )
+
+    for url in ("/export/customers", "/export/orders?format=csv"):
+        runner.measure(
+            f"export {url[len('/export/'):]}",
+            lambda url=url: sum(len(chunk) for chunk in runner.client.get(url).streaming_content),
+        )
+
+    runner.measure("job cron.log_crm_heartbeat", lambda: runner.graphql(print_ast(cron.query.document)))
+    week_ago = (date.today() - timedelta(days=7)).isoformat()
+    runner.measure(
+        "job send_order_reminders (one page)",
+        lambda: runner.graphql(
+            print_ast(send_order_reminders.query.document),
+            {"weekAgo": week_ago, "first": send_order_reminders.PAGE_SIZE, "after": None},
+        ),
+    )
+    runner.measure("job tasks.generate_crm_report", compute_report_stats)
+    runner.measure("job refresh_sales_rollup --full", lambda: refresh_sales_rollup(full=True), rollback=True)
+    log_file = os.path.join(tempfile.mkdtemp(prefix="crm-bench-"), "cleanup.log")
+    runner.measure(
+        "job clean_inactive_customers",
+        lambda: call_command("clean_inactive_customers", log_file=log_file, stdout=io.StringIO()),
+        rollback=True,
+    )
+
+
+# ────────────── REPORT ──────────────
+
+def format_row(name, result, baseline=None, tolerance=None):
+    row = f"{name:<52} p50 {result['p50_ms']:>9.2f} ms   p95 {result['p95_ms']:>9.2f} ms   {result['queries']:>4} queries"
+    if baseline is None:
+        return row
+    change = (result["p50_ms"] - baseline["p50_ms"]) / baseline["p50_ms"] * 100 if baseline["p50_ms"] else 0
+    row += f"   p50 {change:+6.1f}%"
+    if result["queries"] != baseline["queries"]:
+        row += f"   queries {baseline['queries']} -> {result['queries']}"
+    if is_regression(result, baseline, tolerance):
+        row += "   REGRESSION"
+    return row
+
+
+def is_regression(result, baseline, tolerance):
+    # Sub-millisecond differences are noise whatever the ratio
+    slower = result["p50_ms"] > baseline["p50_ms"] * (1 + tolerance) and result["p50_ms"] - baseline["p50_ms"] > 1
+    return slower or result["queries"] > baseline["queries"]
+
+
+def database_size():
+    from crm.models import Customer, Order, Product
+
+    return {
+        "customers": Customer.objects.count(),
+        "products": Product.objects.count(),
+        "orders": Order.objects.count(),
+        "links": Order.products.through.objects.count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the comparison, returns the names of the regressions"""
+    print(f"\nCompared with the baseline of {baseline['meta']['date']} (tolerance {tolerance:.0%}):")
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            print(f"{name:<52} new")
+            continue
+        print(format_row(name, result, baseline["results"][name], tolerance))
+        if is_regression(result, baseline["results"][name], tolerance):
+            regressions.append(name)
+    for name in baseline["results"].keys() - results.keys():
+        print(f"{name:<52} not run")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="SQLite file filled by benchmarks.datagen (fresh small one by default)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs of each operation")
+    parser.add_argument("--only", help="only run the operations whose name contains this")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="p50 slowdown allowed (default 0.3)")
+    args = parser.parse_args()
+
+    # Before django.setup(): DEBUG adds graphene's debug middleware
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql.settings")
+    from django.conf import settings
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["testserver"]
+    database = setup_django(args.database)
+    settings.CRM_RESPONSE_CACHE = {**settings.CRM_RESPONSE_CACHE, "ENABLED": False}
+
+    if args.database is None:
+        from benchmarks.datagen import SCALES, generate
+        generate(*SCALES["small"])
+
+    size = database_size()
+    print(f"Database {database}: " + ", ".join(f"{count} {name}" for name, count in size.items()))
+    runner = Runner(args.repeat, args.only)
+    run_suite(runner)
+
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "database": size,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": runner.results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["meta"]["database"] != size:
+            print("warning: the baseline was measured on a database of another size")
+        regressions = compare(runner.results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,29 @@
+import os
+import statistics
+import tempfile
+
+import django
+
+
+def setup_django(database=None):
+    """Configures Django on a separate benchmark database and migrates it
+        database: path of the SQLite file to use, a temporary file by default
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql.settings")
+    from django.conf import settings
+
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(prefix="crm-bench-"), "bench.sqlite3")
+    settings.DATABASES["default"]["NAME"] = database
+    # Wait for the write lock instead of failing when threads contend for it
+    settings.DATABASES["default"]["OPTIONS"] = {"timeout": 60, "transaction_mode": "IMMEDIATE"}
+    django.setup()
+
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+    return database
+
+
+def percentile(values, p):
+    """p-th percentile (1-99) of a list of measures"""
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else values[0]
@@ -2,4 +2,14 @@ from django.apps import AppConfig
 
 
 class CrmConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        # Connects the response cache invalidation receivers
+        from . import signals  # noqa: F401
+        from . import tracing
+
+        connection_created.connect(tracing.install)
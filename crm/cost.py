@@ -0,0 +1,181 @@
+"""Query depth and cost limits
+
+QueryCostRule is a graphql-core validation rule: documents deeper than
+CRM_QUERY_COST["MAX_DEPTH"] or more expensive than ["MAX_COST"] are rejected
+before anything is executed.
+
+The cost estimates how many objects a query may resolve. Every field with a
+selection set costs 1 per parent object, times its multiplier:
+    - fields with first/last (connections, paginated lists): the value asked for,
+      or the largest page the server would return when it is missing
+    - other list fields: ["LIST_SIZE"], except the edges of a connection
+    - other fields: 1
+Arguments given as variables count with the default of the variable, or the
+largest page when there is none. The cost does not depend on the variable
+values, so it is computed once per document like the rest of the validation.
+"""
+import graphene
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode, IntValueNode, ValidationRule, VariableNode,
+    get_named_type, get_nullable_type, is_list_type, specified_rules,
+)
+
+from .pagination import get_max_page_size
+
+
+DEFAULTS = {
+    "MAX_DEPTH": 10,
+    "MAX_COST": 200000,
+    "LIST_SIZE": 10,
+}
+
+
+def get_setting(name):
+    return getattr(settings, "CRM_QUERY_COST", {}).get(name, DEFAULTS[name])
+
+
+def get_fragments(document):
+    return {
+        definition.name.value: definition
+        for definition in document.definitions
+        if definition.kind == "fragment_definition"
+    }
+
+
+def is_connection(graphql_type):
+    graphene_type = getattr(get_named_type(graphql_type), "graphene_type", None)
+    return isinstance(graphene_type, type) and issubclass(graphene_type, graphene.relay.Connection)
+
+
+class QueryCost:
+    """Depth and estimated cost of the operations of a document"""
+
+    def __init__(self, schema, fragments, list_size=None):
+        self.schema = schema
+        self.fragments = fragments
+        self.list_size = get_setting("LIST_SIZE") if list_size is None else list_size
+        self.variable_defaults = {}
+
+    def operation(self, operation):
+        """(depth, cost) of an OperationDefinitionNode"""
+        self.variable_defaults = {
+            definition.variable.name.value: definition.default_value
+            for definition in operation.variable_definitions or ()
+        }
+        root_type = self.schema.get_root_type(operation.operation)
+        if root_type is None:
+            return 0, 0
+        return self.selection_set(operation.selection_set, root_type, 0, frozenset())
+
+    def selection_set(self, selection_set, parent_type, depth, fragments_seen):
+        max_depth, cost = depth, 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = getattr(parent_type, "fields", {}).get(selection.name.value)
+                if field is None or selection.name.value.startswith("__"):
+                    continue
+                if selection.selection_set is None:
+                    max_depth = max(max_depth, depth + 1)
+                    continue
+                child_depth, child_cost = self.selection_set(
+                    selection.selection_set, get_named_type(field.type), depth + 1, fragments_seen
+                )
+                max_depth = max(max_depth, child_depth)
+                cost += self.multiplier(parent_type, field, selection) * (1 + child_cost)
+                continue
+
+            if isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                selections, seen = selection.selection_set, fragments_seen
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                # Cycles are reported by NoFragmentCyclesRule
+                if fragment is None or name in fragments_seen:
+                    continue
+                seen = fragments_seen | {name}
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                selections = fragment.selection_set
+            else:
+                continue
+            if fragment_type is None:
+                continue
+            fragment_depth, fragment_cost = self.selection_set(selections, fragment_type, depth, seen)
+            max_depth = max(max_depth, fragment_depth)
+            cost += fragment_cost
+        return max_depth, cost
+
+    def multiplier(self, parent_type, field, node):
+        if "first" in field.args or "last" in field.args:
+            largest = (
+                graphene_settings.RELAY_CONNECTION_MAX_LIMIT if is_connection(field.type)
+                else get_max_page_size()
+            )
+            arguments = {argument.name.value: argument.value for argument in node.arguments}
+            sizes = [
+                self.int_value(arguments[name]) for name in ("first", "last") if name in arguments
+            ]
+            sizes = [size for size in sizes if size is not None]
+            return min([largest, *sizes]) if sizes else largest
+        if is_list_type(get_nullable_type(field.type)):
+            return 1 if is_connection(parent_type) else self.list_size
+        return 1
+
+    def int_value(self, value):
+        if isinstance(value, VariableNode):
+            value = self.variable_defaults.get(value.name.value)
+        if isinstance(value, IntValueNode):
+            return max(int(value.value), 0)
+        return None
+
+
+class QueryCostRule(ValidationRule):
+    """Rejects operations deeper than MAX_DEPTH or costlier than MAX_COST"""
+
+    def enter_document(self, node, *args):
+        query_cost = QueryCost(self.context.schema, get_fragments(node))
+        max_depth, max_cost = get_setting("MAX_DEPTH"), get_setting("MAX_COST")
+        for definition in node.definitions:
+            if definition.kind != "operation_definition":
+                continue
+            depth, cost = query_cost.operation(definition)
+            name = definition.name.value if definition.name else "anonymous"
+            extensions = {"code": "QUERY_TOO_EXPENSIVE", "cost": {"depth": depth, "estimated": cost}}
+            if depth > max_depth:
+                self.report_error(GraphQLError(
+                    f"Operation '{name}' is {depth} levels deep, the maximum is {max_depth}.",
+                    definition, extensions=extensions,
+                ))
+            if cost > max_cost:
+                self.report_error(GraphQLError(
+                    f"Operation '{name}' has an estimated cost of {cost}, the maximum is {max_cost}.",
+                    definition, extensions=extensions,
+                ))
+
+
+# The rules GraphQLView validates with: the standard ones plus the cost limits
+validation_rules = (*specified_rules, QueryCostRule)
+
+
+def get_cost(prepared, schema, operation_name=None):
+    """{"depth", "estimated"} of the operation that runs, computed once per document"""
+    memo = prepared.memo.setdefault("cost", {})
+    if operation_name not in memo:
+        document = prepared.document
+        operations = [
+            definition for definition in document.definitions
+            if definition.kind == "operation_definition"
+            and (operation_name is None or (definition.name and definition.name.value == operation_name))
+        ]
+        depth, cost = QueryCost(schema, get_fragments(document)).operation(operations[0]) if operations else (0, 0)
+        memo[operation_name] = {
+            "depth": depth,
+            "estimated": cost,
+            "maxDepth": get_setting("MAX_DEPTH"),
+            "maxCost": get_setting("MAX_COST"),
+        }
+    return memo[operation_name]
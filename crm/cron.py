@@ -1,9 +1,11 @@
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from datetime import datetime
 
+from .persisted import PersistedQueryTransport
 
-transport = RequestsHTTPTransport(
+
+# Sends the query hashes, the server runs its cached documents
+transport = PersistedQueryTransport(
     url="http://localhost:8000/graphql",
     verify=True,
     retries=3,
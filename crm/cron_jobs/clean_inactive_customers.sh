@@ -1,9 +1,9 @@
 #!/bin/bash
-# A script that uses manage.py shell to execute a Python command that deletes customers with no orders since a year ago
+# A script that runs the clean_inactive_customers management command to delete customers with no orders since a year ago
 
 # Move from the directory of this script to the project root where manage.py is located
 cd "$(dirname "$0")/../.."
 
-# Execute the Python script using Django's manage.py shell to delete customers
-# with no orders in the last 365 days, print progress, and count deletions
-python manage.py shell -c "exec(open('crm/cron_jobs/clean_inactive_customers.py').read())"
\ No newline at end of file
+# Delete customers with no orders in the last 365 days, in chunked transactions,
+# and log the number of deletions and the throughput
+python manage.py clean_inactive_customers --days 365
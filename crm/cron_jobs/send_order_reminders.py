@@ -1,26 +1,28 @@
 """Python script that uses a GraphQL query to find pending orders (order_date within the last week)
     and logs reminders, scheduled to run daily using a cron job
+
+The orders are streamed page by page through the allOrders connection and
+written through a single buffered log handle, so memory stays flat. The
+cursor of the last processed order is kept as a high-water mark: each run
+resumes after it and only handles the orders created since the previous run.
 """
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import json
+import os
 from datetime import datetime, timedelta
 
-
-transport = RequestsHTTPTransport(
-    url="http://localhost:8000/graphql",
-    verify=True,
-    retries=3,
-)
-
-client = Client(transport=transport)
+from gql import gql, Client
+from gql.transport.requests import RequestsHTTPTransport
 
 
-week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
+LOG_PATH = "tmp/order_reminders_log.txt"
+STATE_PATH = "tmp/order_reminders_state.json"
+PAGE_SIZE = 100
 
 query = gql("""
-    query ($weekAgo: Date!) {
-        allOrders(orderDateAfter: $weekAgo) {
+    query ($weekAgo: Date!, $first: Int!, $after: String) {
+        allOrders(orderDateAfter: $weekAgo, first: $first, after: $after) {
             edges {
+                cursor
                 node {
                     id
                     customer {
@@ -28,20 +30,76 @@ query = gql("""
                     }
                 }
             }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
         }
     }
 """)
 
-result = client.execute(query, variable_values={"weekAgo": week_ago})
 
-for edge in result["allOrders"]["edges"]:
-    order = edge["node"]
-    customer_email = order["customer"]["email"]
-    order_id = order["id"]
+def load_state():
+    """Returns the high-water mark left by the previous run (empty on the first run)"""
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as state_file:
+        return json.load(state_file)
+
+
+def save_state(state):
+    # Write then rename so a crash never leaves a truncated state file
+    tmp_path = f"{STATE_PATH}.tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def fetch_pages(client, week_ago, after=None):
+    """Yields the allOrders pages one at a time, following the end cursor"""
+    while True:
+        page = client.execute(
+            query, variable_values={"weekAgo": week_ago, "first": PAGE_SIZE, "after": after}
+        )["allOrders"]
+        yield page
+        if not page["pageInfo"]["hasNextPage"]:
+            break
+        after = page["pageInfo"]["endCursor"]
+
+
+def iter_edges(pages):
+    for page in pages:
+        yield from page["edges"]
+
+
+def main():
+    transport = RequestsHTTPTransport(
+        url="http://localhost:8000/graphql",
+        verify=True,
+        retries=3,
+    )
+    client = Client(transport=transport)
+
+    week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
+    state = load_state()
+
+    processed = 0
+    # One buffered handle for the whole run, log to /tmp/order_reminders_log.txt
+    with open(LOG_PATH, "a", buffering=1 << 16) as log_file:
+        for edge in iter_edges(fetch_pages(client, week_ago, state.get("cursor"))):
+            order = edge["node"]
+            timestamp = datetime.now()
+            log_file.write(
+                f"[{timestamp}] - Order ID: {order['id']}, Customer Email: {order['customer']['email']}\n"
+            )
+            state = {"cursor": edge["cursor"]}
+            processed += 1
+
+    if processed:
+        save_state(state)
+
+    print(f"Order reminders processed! ({processed} new orders)")
 
-    # Log to /tmp/order_reminders_log.txt
-    with open("tmp/order_reminders_log.txt", "a") as log_file:
-        timestamp = datetime.now()
-        log_file.write(f"[{timestamp}] - Order ID: {order['id']}, Customer Email: {customer_email}\n")
 
-print("Order reminders processed!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from django.db.models import F, QuerySet
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+
+from .loaders import get_loaders
+from .pagination import decode_cursor, encode_cursor, get_sort_keys, nullable_keys, order_by_keys, seek
+
+
+class BatchedFilterConnectionField(DjangoFilterConnectionField):
+    """DjangoFilterConnectionField that cooperates with the batch loaders
+        - lists returned by a loader are already filtered, so they are paginated as is
+        - every page of nodes primes the loaders so nested fields load in one query
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if isinstance(iterable, list):
+            return iterable
+        return super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args,
+    ):
+        result = super().connection_resolver(
+            resolver,
+            connection,
+            default_manager,
+            queryset_resolver,
+            max_limit,
+            enforce_first_or_last,
+            root,
+            info,
+            **args,
+        )
+        get_loaders(info).prime(edge.node for edge in result.edges)
+        return result
+
+
+class KeysetFilterConnectionField(BatchedFilterConnectionField):
+    """Connection paginated by seeking on the sort key instead of OFFSET slicing
+        - the cursor encodes the orderBy key values plus the id of the row
+        - after/before turn into WHERE (key, id) > (...) / < (...)
+        - NULL counts as greater than every value of a nullable key
+        - no COUNT(*) is run, totalCount counts lazily when it is selected
+    """
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        queryset = maybe_queryset(iterable)
+        if not isinstance(queryset, QuerySet):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        first, last = args.get("first"), args.get("last")
+        after, before = args.get("after"), args.get("before")
+        offset = args.get("offset")
+        if first is None and last is None:
+            first = max_limit
+
+        sort_keys = get_sort_keys(queryset)
+        nullable = nullable_keys(queryset, sort_keys)
+        page = queryset.annotate(
+            **{f"cursor_key_{i}": F(path) for i, (path, _) in enumerate(sort_keys)}
+        ).order_by(*order_by_keys(sort_keys, nullable))
+        if after:
+            page = page.filter(seek(sort_keys, decode_cursor(after, sort_keys), forward=True, nullable=nullable))
+        if before:
+            page = page.filter(seek(sort_keys, decode_cursor(before, sort_keys), forward=False, nullable=nullable))
+
+        has_previous_page = bool(after)
+        has_next_page = bool(before)
+        if first is not None:
+            rows = list(page[offset or 0:(offset or 0) + first + 1])
+            has_next_page = len(rows) > first
+            rows = rows[:first]
+            if last is not None and len(rows) > last:
+                has_previous_page = True
+                rows = rows[-last:]
+        else:
+            # Read backwards from before (or the end) and restore the order
+            reverse = order_by_keys(sort_keys, nullable, reverse=True)
+            rows = list(page.order_by(*reverse)[offset or 0:(offset or 0) + last + 1])
+            has_previous_page = len(rows) > last
+            rows = rows[:last][::-1]
+
+        edges = [
+            connection.Edge(
+                node=row,
+                cursor=encode_cursor(
+                    [getattr(row, f"cursor_key_{i}") for i in range(len(sort_keys))]
+                ),
+            )
+            for row in rows
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+        result.iterable = queryset
+        return result
@@ -1,4 +1,6 @@
 import django_filters
+from django.db import connections
+from django.db.models import Exists, OuterRef
 from .models import Customer, Product, Order
 
 
@@ -8,14 +10,44 @@ class CustomerFilter(django_filters.FilterSet):
     email = django_filters.CharFilter(field_name="email", lookup_expr="icontains")
     createdAtGte = django_filters.DateFilter(field_name="created_at", lookup_expr="gte")
     createdAtLte = django_filters.DateFilter(field_name="created_at", lookup_expr="lte")
+    # Order aggregates stored on the customer (crm/stats.py), served by their indexes
+    orderCountGte = django_filters.NumberFilter(field_name="order_count", lookup_expr="gte")
+    orderCountLte = django_filters.NumberFilter(field_name="order_count", lookup_expr="lte")
+    lifetimeRevenueGte = django_filters.NumberFilter(field_name="lifetime_revenue", lookup_expr="gte")
+    lifetimeRevenueLte = django_filters.NumberFilter(field_name="lifetime_revenue", lookup_expr="lte")
+    lastOrderAfter = django_filters.DateFilter(field_name="last_order_at", lookup_expr="gte")
+    lastOrderBefore = django_filters.DateFilter(field_name="last_order_at", lookup_expr="lte")
     phone_starts_with = django_filters.CharFilter(
         field_name="phone",
-        lookup_expr="startswith"
+        method="filter_phone_starts_with"
     )
 
+    def filter_phone_starts_with(self, queryset, name, value):
+        """Prefix match
+        SQLite never uses an index for LIKE 'x%' with an ESCAPE clause, there it
+        is written as a range so the phone index can serve it: the column has
+        SQLite's binary collation, which orders strings by code point. Under the
+        locale collations of other databases a range is not a prefix match,
+        they get LIKE."""
+        if connections[queryset.db].vendor == "sqlite":
+            return queryset.filter(phone__gte=value, phone__lt=value + "\U0010ffff")
+        return queryset.filter(phone__startswith=value)
+
     class Meta:
         model = Customer
-        fields = ["name", "email", "createdAtGte", "createdAtLte", "phone_starts_with"]
+        fields = [
+            "name",
+            "email",
+            "createdAtGte",
+            "createdAtLte",
+            "orderCountGte",
+            "orderCountLte",
+            "lifetimeRevenueGte",
+            "lifetimeRevenueLte",
+            "lastOrderAfter",
+            "lastOrderBefore",
+            "phone_starts_with",
+        ]
 
 
 class ProductFilter(django_filters.FilterSet):
@@ -44,8 +76,24 @@ class OrderFilter(django_filters.FilterSet):
     orderDateAfter = django_filters.DateFilter(field_name="order_date", lookup_expr="gte")
     orderDateBefore = django_filters.DateFilter(field_name="order_date", lookup_expr="lte")
     customerName = django_filters.CharFilter(field_name="customer__name", lookup_expr="icontains")
-    productName = django_filters.CharFilter(field_name="products__name", lookup_expr="icontains")
-    product_id = django_filters.NumberFilter(field_name="products__id", lookup_expr="exact")
+    # The product filters use EXISTS subqueries on the order/product through table:
+    # a join would return an order once per matching product
+    productName = django_filters.CharFilter(field_name="products__name", method="filter_product_name")
+    product_id = django_filters.NumberFilter(field_name="products__id", method="filter_product_id")
+
+    def filter_product_name(self, queryset, name, value):
+        """Orders with at least one product whose name contains value"""
+        return queryset.filter(
+            Exists(Order.products.through.objects.filter(
+                order_id=OuterRef("pk"), product__name__icontains=value
+            ))
+        )
+
+    def filter_product_id(self, queryset, name, value):
+        """Orders that contain the product with id value"""
+        return queryset.filter(
+            Exists(Order.products.through.objects.filter(order_id=OuterRef("pk"), product_id=value))
+        )
 
     class Meta:
         model = Order
@@ -0,0 +1,265 @@
+"""Bulk order import, shared by the bulkCreateOrders mutation and the import_orders command
+
+Rows are read as plain dicts (parsed from NDJSON or CSV by read_rows, or built
+from the mutation input) and processed chunk_size at a time:
+    - the customer and product ids of the chunk are looked up with one
+      id__in query each, the answers are kept for the following chunks
+    - each row is validated in memory, invalid rows are reported with their
+      number and skipped
+    - the orders of the chunk and then their items are inserted with
+      bulk_create, in one transaction per chunk
+bulk_create sends no signals, so each chunk recomputes the stats of its
+customers (crm.stats), marks the days of its orders stale for the sales rollup
+and invalidates the cached responses.
+
+Imported orders record sales that already happened: they keep their
+order_date and do not take stock.
+
+A row holds customer_id, order_date (ISO 8601, optional, defaults to now) and
+either items, a list of {product_id, quantity, unit_price} (quantity defaults
+to 1, unit_price to the current price), or product_ids, one unit of each.
+In CSV, items is written "product_id:quantity:unit_price;..." with the last
+two parts optional, product_ids "id;id;...".
+"""
+import csv
+import json
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Customer, Order, OrderItem, Product
+from .response_cache import invalidate
+from .rollup import day_of, mark_stale
+from .stats import refresh_customer_stats
+
+
+CHUNK_SIZE = 1000
+
+FORMATS = ("ndjson", "csv")
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        # Only filled with keep_orders
+        self.orders = []
+        # [(row number, message)]
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# ────────────── READING ──────────────
+
+def guess_format(path):
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def read_rows(stream, format):
+    """Yields (row number, dict or RowError) from a text stream, one row at a time"""
+    if format == "csv":
+        # The header is line 1
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, RowError(f"Invalid JSON: {e}")
+            continue
+        yield number, row if isinstance(row, dict) else RowError("A row must be a JSON object")
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"Invalid {name}: {value!r}")
+
+
+def _decimal(value, name):
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f"Invalid {name}: {value!r}")
+    if not amount.is_finite() or amount < 0:
+        raise RowError(f"Invalid {name}: {value!r}")
+    return amount
+
+
+def _order_date(value):
+    if value in (None, ""):
+        return timezone.now()
+    moment = value if isinstance(value, datetime) else parse_datetime(str(value))
+    if moment is None:
+        raise RowError(f"Invalid order_date: {value!r}")
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+def _items(row):
+    """[(product id, quantity, unit price or None)] of a row"""
+    items = row.get("items")
+    if isinstance(items, str):
+        # CSV: product_id:quantity:unit_price;...
+        items = [
+            dict(zip(("product_id", "quantity", "unit_price"), part.split(":")))
+            for part in items.split(";") if part.strip()
+        ]
+    product_ids = row.get("product_ids")
+    if isinstance(product_ids, str):
+        product_ids = [part for part in product_ids.split(";") if part.strip()]
+    lines = [{"product_id": product_id} for product_id in product_ids or []] + list(items or [])
+    if not lines:
+        raise RowError("At least one product must be selected")
+
+    parsed = []
+    for line in lines:
+        if not isinstance(line, dict):
+            raise RowError(f"Invalid item: {line!r}")
+        quantity = line.get("quantity")
+        quantity = 1 if quantity in (None, "") else _int(quantity, "quantity")
+        if quantity < 1:
+            raise RowError("Quantities must be positive")
+        unit_price = line.get("unit_price")
+        parsed.append((
+            _int(line.get("product_id"), "product_id"),
+            quantity,
+            None if unit_price in (None, "") else _decimal(unit_price, "unit_price"),
+        ))
+    return parsed
+
+
+# ────────────── IMPORT ──────────────
+
+class OrderImporter:
+    """Validates and inserts rows, keeping the ids already looked up between chunks"""
+
+    def __init__(self, chunk_size=CHUNK_SIZE, log=None):
+        self.chunk_size = chunk_size
+        self.log = log
+        self.customer_ids = set()
+        # {product id: current price}
+        self.prices = {}
+        self.result = ImportResult()
+
+    def _resolve(self, customer_ids, product_ids):
+        missing = customer_ids - self.customer_ids
+        if missing:
+            self.customer_ids.update(Customer.objects.filter(id__in=missing).values_list("id", flat=True))
+        missing = product_ids - self.prices.keys()
+        if missing:
+            self.prices.update(Product.objects.filter(id__in=missing).values_list("id", "price"))
+
+    def _prepare(self, customer_id, lines, order_date):
+        """(Order, [OrderItem]) of a parsed row, its ids resolved"""
+        if customer_id not in self.customer_ids:
+            raise RowError(f"Invalid customer ID {customer_id}")
+        # The lines of a same product are merged, the first unit price given wins
+        merged = {}
+        for product_id, quantity, unit_price in lines:
+            if product_id not in self.prices:
+                raise RowError(f"Invalid product ID {product_id}")
+            known_quantity, known_price = merged.get(product_id, (0, None))
+            merged[product_id] = (known_quantity + quantity, known_price if known_price is not None else unit_price)
+        items = [
+            OrderItem(
+                product_id=product_id, quantity=quantity,
+                unit_price=unit_price if unit_price is not None else self.prices[product_id],
+            )
+            for product_id, (quantity, unit_price) in merged.items()
+        ]
+        order = Order(
+            customer_id=customer_id,
+            order_date=order_date,
+            total_amount=sum(item.quantity * item.unit_price for item in items),
+        )
+        return order, items
+
+    def _import_chunk(self, chunk):
+        parsed = []
+        for number, row in chunk:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                parsed.append((
+                    number,
+                    _int(row.get("customer_id"), "customer_id"),
+                    _items(row),
+                    _order_date(row.get("order_date")),
+                ))
+            except RowError as e:
+                self.result.errors.append((number, str(e)))
+
+        self._resolve(
+            {customer_id for _, customer_id, _, _ in parsed},
+            {product_id for _, _, lines, _ in parsed for product_id, _, _ in lines},
+        )
+
+        prepared = []
+        for number, customer_id, lines, order_date in parsed:
+            try:
+                prepared.append(self._prepare(customer_id, lines, order_date))
+            except RowError as e:
+                self.result.errors.append((number, str(e)))
+        if not prepared:
+            return []
+
+        with transaction.atomic():
+            orders = Order.objects.bulk_create([order for order, _ in prepared])
+            for order, items in prepared:
+                for item in items:
+                    item.order_id = order.pk
+            OrderItem.objects.bulk_create([item for _, items in prepared for item in items])
+            refresh_customer_stats(Customer.objects.filter(id__in={order.customer_id for order in orders}))
+            mark_stale(*{day_of(order.order_date) for order in orders})
+            invalidate(Order, OrderItem)
+        return orders
+
+    def run(self, rows, keep_orders=False):
+        """Imports an iterable of (row number, dict or RowError), returns the ImportResult
+            keep_orders: collect the created orders in result.orders (the mutation returns them)
+        """
+        start = time.perf_counter()
+        chunk = []
+        for numbered in rows:
+            chunk.append(numbered)
+            if len(chunk) == self.chunk_size:
+                self._flush(chunk, keep_orders, start)
+                chunk = []
+        if chunk:
+            self._flush(chunk, keep_orders, start)
+        self.result.seconds = time.perf_counter() - start
+        return self.result
+
+    def _flush(self, chunk, keep_orders, start):
+        orders = self._import_chunk(chunk)
+        self.result.rows += len(chunk)
+        self.result.created += len(orders)
+        if keep_orders:
+            self.result.orders.extend(orders)
+        if self.log:
+            seconds = time.perf_counter() - start
+            self.log(
+                f"{self.result.rows} rows, {self.result.created} orders created, "
+                f"{len(self.result.errors)} errors, {self.result.rows / seconds:.0f} rows/s"
+            )
+
+
+def import_orders(rows, chunk_size=CHUNK_SIZE, log=None, keep_orders=False):
+    """Imports (row number, row) pairs, see OrderImporter"""
+    return OrderImporter(chunk_size=chunk_size, log=log).run(rows, keep_orders=keep_orders)
@@ -0,0 +1,117 @@
+"""Per-request batch loaders for the nested CRM fields
+
+graphene resolves a list depth first, so the nested resolvers of the first
+parent run before the siblings are even visited. The loaders below are
+therefore primed with every parent row as soon as a list/page of rows is
+resolved; the first nested lookup that misses the cache then fetches the
+relation for all queued parents with a single IN (...) query.
+"""
+from collections import defaultdict
+
+from .models import Customer, Order, OrderItem
+from .filters import OrderFilter
+
+
+class BatchLoader:
+    """Caches the values of one relation, keyed by the parent primary key"""
+
+    def __init__(self, batch_load_fn):
+        # batch_load_fn(keys) must return a dict with an entry for every key
+        self.batch_load_fn = batch_load_fn
+        self._cache = {}
+        self._queue = {}  # dict used as an ordered set
+
+    def prime(self, keys):
+        """Queue keys that will be fetched with the next cache miss"""
+        for key in keys:
+            if key not in self._cache:
+                self._queue[key] = None
+
+    def load(self, key):
+        if key not in self._cache:
+            self._queue[key] = None
+            keys = list(self._queue)
+            self._cache.update(self.batch_load_fn(keys))
+            # Only once the batch succeeded: a load retried in a thread
+            # (see crm.middleware) must still batch the queued siblings
+            for batched in keys:
+                self._queue.pop(batched, None)
+        return self._cache[key]
+
+
+class Loaders:
+    """Registry of the batch loaders used while resolving one GraphQL request"""
+
+    def __init__(self):
+        self.customer = BatchLoader(self._load_customers)
+        self.items_by_order = BatchLoader(self._load_items_by_order)
+        # One orders loader per distinct set of nested connection filters
+        self._orders_by_customer = {}
+        self._customers = {}
+
+    def orders_by_customer(self, filters=None):
+        """Loader for Customer.orders, optionally narrowed by OrderFilter arguments"""
+        filters = filters or {}
+        key = tuple(sorted((name, repr(value)) for name, value in filters.items()))
+        loader = self._orders_by_customer.get(key)
+        if loader is None:
+            loader = BatchLoader(lambda keys: self._load_orders_by_customer(keys, filters))
+            # Customers seen before this loader existed are batched too
+            loader.prime(self._customers)
+            self._orders_by_customer[key] = loader
+        return loader
+
+    def prime(self, instances):
+        """Queue the relations of freshly resolved rows so siblings load together"""
+        for instance in instances:
+            if isinstance(instance, Customer):
+                self._customers[instance.pk] = instance
+                for loader in self._orders_by_customer.values():
+                    loader.prime([instance.pk])
+            elif isinstance(instance, Order):
+                if Order.customer.is_cached(instance):
+                    self.prime([instance.customer])
+                else:
+                    self.customer.prime([instance.customer_id])
+                if "items" not in getattr(instance, "_prefetched_objects_cache", {}):
+                    self.items_by_order.prime([instance.pk])
+
+    # ────────────── BATCH FUNCTIONS ──────────────
+
+    def _load_customers(self, keys):
+        customers = {c.pk: c for c in Customer.objects.filter(pk__in=keys)}
+        self.prime(customers.values())
+        return {key: customers.get(key) for key in keys}
+
+    def _load_orders_by_customer(self, keys, filters):
+        qs = Order.objects.filter(customer_id__in=keys).order_by("pk")
+        if filters:
+            qs = OrderFilter(filters, queryset=qs).qs
+        orders = defaultdict(list)
+        for order in qs:
+            # The parent customer is already in memory, no need to load it again
+            if order.customer_id in self._customers:
+                Order.customer.field.set_cached_value(order, self._customers[order.customer_id])
+            orders[order.customer_id].append(order)
+        self.prime(o for rows in orders.values() for o in rows)
+        return {key: orders[key] for key in keys}
+
+    def _load_items_by_order(self, keys):
+        rows = OrderItem.objects.filter(order_id__in=keys).select_related("product").order_by("pk")
+        items = defaultdict(list)
+        for row in rows:
+            items[row.order_id].append(row)
+        return {key: items[key] for key in keys}
+
+
+def get_loaders(info):
+    """Return the loaders of the current request, creating them on first use"""
+    context = info.context
+    if context is None:
+        # No request to hang the loaders off (e.g. a bare schema.execute call)
+        return Loaders()
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+
+from crm.models import Customer
+
+
+def inactive_customers(cutoff):
+    """Customers that have orders, all of them placed before cutoff
+    Reads the last_order_at kept by crm.stats, a range scan of its index."""
+    return Customer.objects.filter(last_order_at__lt=cutoff)
+
+
+class Command(BaseCommand):
+    help = "Deletes customers with no orders since --days days, in bounded chunked transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365, help="inactivity period (default 365)")
+        parser.add_argument("--batch-size", type=int, default=500, help="customers deleted per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+        parser.add_argument(
+            "--log-file",
+            default="crm/cron_jobs/tmp/customer_cleanup_log.txt",
+            help="file the number of deleted customers is appended to",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options["days"])
+        batch_size = options["batch_size"]
+        start = time.perf_counter()
+
+        # One index range scan finds every candidate, the deletes then work on ids
+        ids = list(inactive_customers(cutoff).order_by("id").values_list("id", flat=True))
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {len(ids)} customers inactive since {cutoff:%Y-%m-%d}")
+            return
+
+        deleted_count = 0
+        deleted_rows = 0
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            # Short transactions keep the SQLite write lock for a bounded time.
+            # Candidates are checked again in case they ordered in the meantime.
+            with transaction.atomic():
+                still_inactive = inactive_customers(cutoff).filter(id__in=chunk).values("id")
+                rows, per_model = Customer.objects.filter(id__in=still_inactive).delete()
+            deleted_rows += rows
+            deleted_count += per_model.get(Customer._meta.label, 0)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Deleted {deleted_count} customers ({deleted_rows} rows with their orders) "
+            f"in {elapsed:.2f}s, {deleted_rows / elapsed if elapsed else 0:.0f} rows/s"
+        )
+
+        # Log the number of deleted customers with a timestamp
+        with open(options["log_file"], "a") as log_file:
+            log_file.write(f"{now()}: Deleted {deleted_count} customers\n")
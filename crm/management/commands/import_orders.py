@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.imports import CHUNK_SIZE, FORMATS, guess_format, import_orders, read_rows
+
+
+class Command(BaseCommand):
+    help = "Imports past orders from an NDJSON or CSV file (- for stdin), streamed in chunked transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="file to read, - for stdin")
+        parser.add_argument("--format", choices=FORMATS, help="guessed from the extension by default (ndjson)")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="orders inserted per transaction")
+        parser.add_argument("--max-errors", type=int, default=100, help="row errors printed (all are counted)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or ("ndjson" if path == "-" else guess_format(path))
+        try:
+            stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        with stream:
+            result = import_orders(
+                read_rows(stream, format), chunk_size=options["chunk_size"], log=self.stdout.write
+            )
+
+        for number, message in result.errors[:options["max_errors"]]:
+            self.stderr.write(f"row {number}: {message}")
+        if len(result.errors) > options["max_errors"]:
+            self.stderr.write(f"... {len(result.errors) - options['max_errors']} more errors")
+        self.stdout.write(
+            f"Imported {result.created} of {result.rows} rows in {result.seconds:.2f}s "
+            f"({result.rows_per_second:.0f} rows/s), {len(result.errors)} errors"
+        )
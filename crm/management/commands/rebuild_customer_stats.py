@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.stats import rebuild_customer_stats
+
+
+class Command(BaseCommand):
+    help = "Recomputes the order count, lifetime revenue and last order date of every customer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="customers updated per transaction")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated = rebuild_customer_stats(options["batch_size"], log=self.stdout.write)
+        self.stdout.write(f"Rebuilt the stats of {updated} customers in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.rollup import refresh_sales_rollup
+
+
+class Command(BaseCommand):
+    help = "Recomputes the daily sales rollup for the days whose orders changed since the last refresh"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="recompute every day")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        refresh_sales_rollup(full=options["full"], log=self.stdout.write)
+        self.stdout.write(f"Refreshed the sales rollup in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,57 @@
+"""graphql-core middleware used by the CRM views"""
+from functools import partial
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SynchronousOnlyOperation
+from graphene.types.resolver import get_default_resolver
+
+from . import tracing
+
+
+class SyncResolverMiddleware:
+    """Lets synchronous resolvers run under async execution
+        Most sync resolvers only read data that is already loaded (attributes,
+        prefetched relations, primed loaders) and run inline on the event loop.
+        When one needs the database, Django refuses with SynchronousOnlyOperation
+        before sending the query; the resolver is then run again in a thread
+        with sync_to_async. Async resolvers return their coroutine unchanged.
+    """
+
+    def resolve(self, next, root, info, **args):
+        try:
+            result = next(root, info, **args)
+        except SynchronousOnlyOperation:
+            return sync_to_async(next)(root, info, **args)
+        # graphene-django's connection fields return the error instead of raising it
+        if isinstance(result, SynchronousOnlyOperation):
+            return sync_to_async(next)(root, info, **args)
+        return result
+
+
+class TracingMiddleware:
+    """Times the resolvers of a request traced by crm.tracing
+        The time is the resolver's own (the fields below it are timed on their
+        own), awaitable results are timed until they are resolved. Fields read
+        off their object by graphene's default resolver are not timed: they are
+        most of the fields of a response and only cost an attribute lookup.
+    """
+
+    def __init__(self):
+        self.default_resolver = get_default_resolver()
+
+    def resolve(self, next, root, info, **args):
+        tracer = tracing.current()
+        resolver = info.parent_type.fields[info.field_name].resolve
+        if tracer is None or (type(resolver) is partial and resolver.func is self.default_resolver):
+            return next(root, info, **args)
+        trace = tracer.start_field(info)
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            trace.finish()
+            raise
+        if isawaitable(result):
+            return trace.wait(result)
+        trace.finish()
+        return result
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def install_search(apps, schema_editor):
+    from crm.search import install_search
+    install_search(schema_editor)
+
+
+def uninstall_search(apps, schema_editor):
+    from crm.search import uninstall_search
+    uninstall_search(schema_editor)
+
+
+class Migration(migrations.Migration):
+    """Full-text search structures, see crm/search.py"""
+
+    dependencies = [
+        ('crm', '0004_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
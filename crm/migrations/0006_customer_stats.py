@@ -0,0 +1,62 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+def install_search(apps, schema_editor):
+    # Adding a NOT NULL column rebuilds crm_customer on SQLite, which drops its search triggers
+    from crm.search import install_search
+    install_search(schema_editor)
+
+
+def backfill_customer_stats(apps, schema_editor):
+    schema_editor.execute("""
+        UPDATE crm_customer SET
+            order_count = (SELECT COUNT(*) FROM crm_order WHERE crm_order.customer_id = crm_customer.id),
+            lifetime_revenue = COALESCE(
+                (SELECT SUM(total_amount) FROM crm_order WHERE crm_order.customer_id = crm_customer.id), 0
+            ),
+            last_order_at = (SELECT MAX(order_date) FROM crm_order WHERE crm_order.customer_id = crm_customer.id)
+    """)
+
+
+class Migration(migrations.Migration):
+    """Order aggregates stored on the customer, see crm/stats.py"""
+
+    dependencies = [
+        ('crm', '0005_search'),
+    ]
+
+    operations = [
+        # Run last when migrating backwards, after the columns are dropped
+        migrations.RunPython(migrations.RunPython.noop, install_search),
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='lifetime_revenue',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['order_count', 'id'], name='crm_customer_order_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['lifetime_revenue', 'id'], name='crm_customer_revenue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['last_order_at', 'id'], name='crm_customer_last_order_idx'),
+        ),
+        migrations.RunPython(backfill_customer_stats, migrations.RunPython.noop),
+        migrations.RunPython(install_search, migrations.RunPython.noop),
+    ]
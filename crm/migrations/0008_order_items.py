@@ -0,0 +1,67 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_unit_prices(apps, schema_editor):
+    # What each product was sold for was never stored: its current price is the
+    # best guess, except in single-product orders where the total is that price
+    schema_editor.execute("""
+        UPDATE crm_order_products SET unit_price = (
+            SELECT price FROM crm_product WHERE crm_product.id = crm_order_products.product_id
+        )
+    """)
+    schema_editor.execute("""
+        UPDATE crm_order_products SET unit_price = (
+            SELECT total_amount FROM crm_order WHERE crm_order.id = crm_order_products.order_id
+        )
+        WHERE order_id IN (
+            SELECT order_id FROM crm_order_products GROUP BY order_id HAVING COUNT(*) = 1
+        )
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_daily_sales_rollup'),
+    ]
+
+    operations = [
+        # The through model takes over the table of the implicit one, which
+        # already has the id, order_id and product_id columns and their indexes
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='crm.OrderItem', to='crm.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_unit_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_order_items'),
+    ]
+
+    operations = [
+        # The default is applied by Django, the column does not change: without
+        # this SQLite would copy the whole order table to a new one
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='order',
+                    name='order_date',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.dispatch import Signal
 from django.utils.timezone import now
 
 
@@ -7,6 +8,22 @@ class Customer(models.Model):
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(default=now, editable=False)
+    # Aggregates of the customer's orders, maintained by crm.stats
+    order_count = models.PositiveIntegerField(default=0, editable=False)
+    lifetime_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+    last_order_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # createdAtGte/Lte filters and created_at ordering (id breaks ties for cursors)
+            models.Index(fields=["created_at", "id"], name="crm_customer_created_idx"),
+            # phone_starts_with, matched as a range so the index applies
+            models.Index(fields=["phone"], name="crm_customer_phone_idx"),
+            # Filters and orderings on the order aggregates, and the inactive customer cleanup
+            models.Index(fields=["order_count", "id"], name="crm_customer_order_count_idx"),
+            models.Index(fields=["lifetime_revenue", "id"], name="crm_customer_revenue_idx"),
+            models.Index(fields=["last_order_at", "id"], name="crm_customer_last_order_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -17,15 +34,110 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # lowStock / stock range filters and the low stock restock
+            models.Index(fields=["stock"], name="crm_product_stock_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product, related_name='orders')
-    order_date = models.DateTimeField(auto_now_add=True)
+    products = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
+    # Not auto_now_add: imported and backdated orders keep the date given
+    order_date = models.DateTimeField(default=now)
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            # orderDateAfter/Before filters and order_date ordering
+            models.Index(fields=["order_date", "id"], name="crm_order_date_idx"),
+            # a customer's orders by date (loaders, cleanup job, crmStats)
+            models.Index(fields=["customer", "order_date"], name="crm_order_customer_date_idx"),
+            # totalAmountGte/Lte filters and total_amount ordering
+            models.Index(fields=["total_amount", "id"], name="crm_order_total_idx"),
+        ]
+
+    def __str__(self):
+        return f"Order {self.id} for {self.customer.name}"
+
+
+# Sent after order items are deleted directly, with the ids of the orders that
+# lost items. OrderItem has no post_delete receiver so that deleting orders (or
+# customers, or products) keeps removing their items with a fast delete.
+order_items_deleted = Signal()
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def delete(self):
+        order_ids = list(self.values_list("order_id", flat=True).distinct())
+        deleted = super().delete()
+        order_items_deleted.send(sender=OrderItem, order_ids=order_ids)
+        return deleted
+
+
+class OrderItem(models.Model):
+    """A product of an order, with the quantity bought and the unit price paid
+        The table is the one Order.products used before it had a through model.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_items")
+    quantity = models.PositiveIntegerField(default=1)
+    # Captured at purchase, later price changes leave the order alone
+    unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        db_table = "crm_order_products"
+        unique_together = [("order", "product")]
+
+    @property
+    def line_total(self):
+        return self.quantity * self.unit_price
+
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        order_items_deleted.send(sender=OrderItem, order_ids=[self.order_id])
+        return deleted
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in order {self.order_id}"
+
+
+class DailySalesRollup(models.Model):
+    """Sales of a day, per product, refreshed from the orders by crm.rollup
+        The row with no product holds the totals of the day.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, null=True, on_delete=models.CASCADE, related_name="+")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date", "product"], name="crm_rollup_date_product_uniq"),
+        ]
+        indexes = [
+            # A product's sales over a period
+            models.Index(fields=["product", "date"], name="crm_rollup_product_date_idx"),
+        ]
+
     def __str__(self):
-        return f"Order {self.id} for {self.customer.name}"
\ No newline at end of file
+        return f"{self.date} {self.product or 'all products'}"
+
+
+class SalesRollupState(models.Model):
+    """Progress of the rollup refresh, a single row"""
+    # Orders up to this id are in the rollup
+    last_order_id = models.BigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+
+class StaleSalesDay(models.Model):
+    """Day whose orders changed after they were rolled up, recomputed by the next refresh"""
+    date = models.DateField(primary_key=True)
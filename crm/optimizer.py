@@ -0,0 +1,115 @@
+"""Query-shape-aware queryset optimizer for the root resolvers
+
+Walks the GraphQL selection set of the field being resolved and rewrites the
+queryset so that it only fetches what the client asked for:
+    - .only() the selected columns (plus the primary and foreign keys)
+    - select_related() selected forward foreign keys (Order.customer)
+    - Prefetch() selected many-valued relations (Customer.orders, Order.items),
+      a many-to-many with a through model through its rows (Order.products)
+Relations that are not selected are left alone and fall back to the loaders.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ForeignKey, ManyToManyField, ManyToOneRel, Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+# Connection arguments that only paginate and can be applied to a prefetched list
+PAGINATION_ARGS = {"first", "last", "before", "after", "offset"}
+
+
+def optimize_queryset(queryset, info):
+    """Return queryset narrowed to the selection of the field being resolved"""
+    selections = _collect_fields(info, info.field_nodes)
+    if "edges" in selections:  # Relay connection: the rows live under edges.node
+        selections = _collect_fields(info, selections["edges"]).get("node", [])
+        selections = _collect_fields(info, selections)
+    return _optimize(queryset, info, selections)
+
+
+def _optimize(queryset, info, selections):
+    model = queryset.model
+    only = {model._meta.pk.name}
+    select_related = []
+    prefetches = {}
+
+    # Foreign keys are always needed by the loaders to batch the relation
+    for field in model._meta.concrete_fields:
+        if isinstance(field, ForeignKey):
+            only.add(field.name)
+
+    for name, nodes in selections.items():
+        try:
+            field = model._meta.get_field(to_snake_case(name))
+        except FieldDoesNotExist:
+            continue  # e.g. __typename or a field computed by a resolver
+
+        if isinstance(field, ForeignKey):
+            related = _collect_fields(info, nodes)
+            select_related.append(field.name)
+            only.update(
+                f"{field.name}__{column}"
+                for column in _columns(field.related_model, related)
+            )
+        elif isinstance(field, ManyToManyField) and not field.remote_field.through._meta.auto_created:
+            # Built from the through rows, read them with their whole target row:
+            # it is a superset of what a selection of the rows themselves needs
+            through = field.remote_field.through
+            accessor = through._meta.get_field(field.m2m_field_name()).remote_field.get_accessor_name()
+            related_qs = through.objects.select_related(field.m2m_reverse_field_name()).order_by("pk")
+            prefetches[accessor] = Prefetch(accessor, queryset=related_qs)
+        elif isinstance(field, (ManyToManyField, ManyToOneRel)):
+            if any(
+                arg.name.value not in PAGINATION_ARGS
+                for node in nodes
+                for arg in node.arguments
+            ):
+                continue  # filtered nested connection, batched by the loaders instead
+            related = _collect_fields(info, nodes)
+            if "edges" in related:
+                related = _collect_fields(info, _collect_fields(info, related["edges"]).get("node", []))
+            related_qs = _optimize(field.related_model.objects.order_by("pk"), info, related)
+            accessor = field.name if isinstance(field, ManyToManyField) else field.get_accessor_name()
+            prefetches.setdefault(accessor, Prefetch(accessor, queryset=related_qs))
+        elif field.concrete:
+            only.add(field.name)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches.values())
+    return queryset.only(*only)
+
+
+def _columns(model, selections):
+    """Concrete columns of model named by selections (always with the primary key)"""
+    columns = {model._meta.pk.name}
+    for name in selections:
+        try:
+            field = model._meta.get_field(to_snake_case(name))
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.add(field.attname if isinstance(field, ForeignKey) else field.name)
+    return columns
+
+
+def selected_fields(info):
+    """Snake-case names of the fields selected under the field being resolved"""
+    return {to_snake_case(name) for name in _collect_fields(info, info.field_nodes)}
+
+
+def _collect_fields(info, nodes, fields=None):
+    """Merge the sub-selections of nodes into {field name: [FieldNode, ...]}"""
+    if fields is None:
+        fields = {}
+    for node in nodes:
+        if node.selection_set is None:
+            continue
+        for selection in node.selection_set.selections:
+            if isinstance(selection, FieldNode):
+                fields.setdefault(selection.name.value, []).append(selection)
+            elif isinstance(selection, InlineFragmentNode):
+                _collect_fields(info, [selection], fields)
+            elif isinstance(selection, FragmentSpreadNode):
+                _collect_fields(info, [info.fragments[selection.name.value]], fields)
+    return fields
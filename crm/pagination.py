@@ -0,0 +1,143 @@
+"""Keyset pagination helpers for the CRM list and connection fields"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from graphql_relay import from_global_id
+
+
+def get_max_page_size():
+    return getattr(settings, "CRM_LIST_MAX_PAGE_SIZE", 100)
+
+
+def paginate_by_id(queryset, first=None, after=None):
+    """Returns the page of queryset that follows the row whose global ID is after
+        first: page size, defaults to and may not exceed CRM_LIST_MAX_PAGE_SIZE
+        after: global ID of the last row of the previous page
+    Rows are sorted by primary key and the page seeks with WHERE id > after,
+    so every page costs the same whatever its position in the table.
+    """
+    max_page_size = get_max_page_size()
+    if first is None:
+        first = max_page_size
+    if first <= 0:
+        raise ValidationError("first must be a positive number")
+    if first > max_page_size:
+        raise ValidationError(f"Requesting {first} records exceeds the limit of {max_page_size} records")
+
+    queryset = queryset.order_by("pk")
+    if after:
+        try:
+            _, pk = from_global_id(after)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid after cursor")
+        queryset = queryset.filter(pk__gt=pk)
+    return queryset[:first]
+
+
+# ────────────── KEYSET CURSORS ──────────────
+
+def get_sort_keys(queryset):
+    """Returns the ordering of queryset as [(field path, descending)], ending with the pk"""
+    keys = []
+    for ordering in queryset.query.order_by:
+        if not isinstance(ordering, str) or ordering == "?":
+            raise ValidationError(f"Cannot paginate with cursors over ordering {ordering!r}")
+        descending = ordering.startswith("-")
+        keys.append((ordering.lstrip("-+"), descending))
+    if not keys or keys[-1][0] not in ("pk", "id"):
+        # The tie-breaker follows the last key so a (key, id) index can be
+        # scanned in a single direction
+        keys.append(("pk", keys[-1][1] if keys else False))
+    return keys
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping the microseconds, seeking needs exact values"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Opaque cursor holding the sort key values of a row"""
+    data = json.dumps(values, cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, sort_keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValidationError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise ValidationError("Cursor does not match the requested ordering")
+    return values
+
+
+def nullable_keys(queryset, sort_keys):
+    """Paths of sort_keys that may hold NULL (a nullable field or a nullable relation on the way)
+    Annotations are taken as never NULL"""
+    nullable = set()
+    for path, _ in sort_keys:
+        model = queryset.model
+        for name in path.split("__"):
+            if name == "pk" or model is None:
+                break
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+            if field.null:
+                nullable.add(path)
+                break
+            model = field.related_model
+    return nullable
+
+
+def order_by_keys(sort_keys, nullable=(), reverse=False):
+    """order_by() arguments for sort_keys, reversed for reading backwards
+    NULL sorts after every value (NULLS LAST ascending, NULLS FIRST descending)
+    whatever the database does by default, as seek() expects"""
+    ordering = []
+    for path, descending in sort_keys:
+        descending = descending != reverse
+        if path not in nullable:
+            ordering.append(f"{'-' if descending else ''}{path}")
+        elif descending:
+            ordering.append(F(path).desc(nulls_first=True))
+        else:
+            ordering.append(F(path).asc(nulls_last=True))
+    return ordering
+
+
+def seek(sort_keys, values, forward=True, nullable=()):
+    """Q selecting the rows strictly after (forward) or before the row with values
+    i.e. WHERE (k1, k2, id) > (v1, v2, vid) expanded for mixed sort directions,
+    NULL being greater than every value of the nullable keys"""
+    condition = Q()
+    for i, (path, descending) in enumerate(sort_keys):
+        greater = descending != forward
+        equal = Q()
+        for (prev_path, _), value in zip(sort_keys[:i], values):
+            equal &= Q(**{f"{prev_path}__isnull": True}) if value is None else Q(**{prev_path: value})
+        value = values[i]
+        if value is None:
+            if greater:
+                # Nothing sorts after NULL on this key
+                continue
+            beyond = Q(**{f"{path}__isnull": False})
+        else:
+            beyond = Q(**{f"{path}__{'gt' if greater else 'lt'}": value})
+            if greater and path in nullable:
+                beyond |= Q(**{f"{path}__isnull": True})
+        condition |= equal & beyond
+    return condition
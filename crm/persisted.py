@@ -0,0 +1,194 @@
+"""Automatic persisted queries (APQ)
+
+Clients send {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": ...}}}
+instead of the query text. The server keeps an LRU cache of parsed and
+validated documents keyed by that hash:
+    - hash known: the cached document is executed, no parse/validate
+    - hash unknown, no query: PersistedQueryNotFound, the client retries with the text
+    - hash + query: the text is checked against the hash, parsed, validated and cached
+Plain requests without the extension go through the same cache (keyed by the
+hash of their text), so repeated documents are only parsed and validated once.
+
+In allow-list mode only the documents of the CRM_PERSISTED_QUERIES["ALLOW_LIST"]
+manifest (a JSON file mapping sha256 -> query) can be executed.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from gql.transport.requests import RequestsHTTPTransport
+from graphql import GraphQLError, parse, validate
+
+from .tracing import phase
+
+
+DEFAULTS = {
+    "CACHE_SIZE": 500,
+    "ALLOW_LIST_ONLY": False,
+    "ALLOW_LIST": None,
+}
+
+NOT_FOUND = "PERSISTED_QUERY_NOT_FOUND"
+NOT_ALLOWED = "PERSISTED_QUERY_NOT_ALLOWED"
+
+
+def get_setting(name):
+    return getattr(settings, "CRM_PERSISTED_QUERIES", {}).get(name, DEFAULTS[name])
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def load_allow_list(path):
+    """The {sha256: query} manifest, with every hash checked against its query"""
+    if not path:
+        return {}
+    with open(path) as manifest:
+        queries = json.load(manifest)
+    for sha256, query in queries.items():
+        if query_hash(query) != sha256:
+            raise ValueError(f"Allow-list entry {sha256} does not match its query")
+    return queries
+
+
+# ────────────── CACHE ──────────────
+
+class PreparedDocument:
+    """A parsed document, its validation errors and what was derived from it
+        memo holds per-document data computed once by other layers (e.g. the response cache)
+    """
+    __slots__ = ("sha256", "document", "errors", "memo")
+
+    def __init__(self, sha256, document, errors):
+        self.sha256 = sha256
+        self.document = document
+        self.errors = errors
+        self.memo = {}
+
+
+class DocumentCache:
+    """Thread-safe LRU of PreparedDocuments keyed by (schema, sha256)"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PersistedQueries:
+    """Resolves a request (query text and/or hash) to a parsed, validated document"""
+
+    def __init__(self, cache_size, allow_list_only=False, allow_list=None):
+        self.documents = DocumentCache(cache_size)
+        self.allow_list_only = allow_list_only
+        self.allow_list = allow_list or {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            get_setting("CACHE_SIZE"),
+            allow_list_only=get_setting("ALLOW_LIST_ONLY"),
+            allow_list=load_allow_list(get_setting("ALLOW_LIST")),
+        )
+
+    def get_document(self, schema, query=None, sha256=None, validation_rules=None, max_errors=None):
+        """PreparedDocument for the request, from the cache when possible
+        Raises GraphQLError for unknown/refused hashes and syntax errors."""
+        if sha256 is None:
+            sha256 = query_hash(query)
+        elif query is not None and query_hash(query) != sha256:
+            raise GraphQLError("provided sha does not match query", extensions={"code": "BAD_REQUEST"})
+
+        if self.allow_list_only and sha256 not in self.allow_list:
+            raise GraphQLError("PersistedQueryNotAllowed", extensions={"code": NOT_ALLOWED})
+
+        key = (schema, sha256)
+        entry = self.documents.get(key)
+        if entry is not None:
+            return entry
+
+        query = query or self.allow_list.get(sha256)
+        if query is None:
+            raise GraphQLError("PersistedQueryNotFound", extensions={"code": NOT_FOUND})
+
+        with phase("parse"):
+            document = parse(query)
+        with phase("validate"):
+            errors = validate(schema, document, validation_rules, max_errors)
+        entry = PreparedDocument(sha256, document, errors)
+        self.documents.set(key, entry)
+        return entry
+
+
+_persisted_queries = None
+
+
+def get_persisted_queries():
+    """The process-wide PersistedQueries built from the settings"""
+    global _persisted_queries
+    if _persisted_queries is None:
+        _persisted_queries = PersistedQueries.from_settings()
+    return _persisted_queries
+
+
+def reset_persisted_queries():
+    """Drops the cache so the next request rebuilds it from the settings"""
+    global _persisted_queries
+    _persisted_queries = None
+
+
+# ────────────── CLIENT ──────────────
+
+class PersistedQueryTransport(RequestsHTTPTransport):
+    """RequestsHTTPTransport that sends the sha256 of the query instead of its text
+        The text is only sent again when the server does not know the hash yet
+        (first call, server restart or cache eviction).
+    """
+
+    _send_query = False
+
+    def _prepare_request(self, request, **kwargs):
+        post_args = super()._prepare_request(request, **kwargs)
+        payload = post_args.get("json")
+        if isinstance(payload, dict) and "query" in payload:
+            payload["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": query_hash(payload["query"])}
+            }
+            if not self._send_query:
+                del payload["query"]
+        return post_args
+
+    def execute(self, request, *args, **kwargs):
+        self._send_query = False
+        result = super().execute(request, *args, **kwargs)
+        if any((error.get("extensions") or {}).get("code") == NOT_FOUND for error in result.errors or []):
+            self._send_query = True
+            try:
+                result = super().execute(request, *args, **kwargs)
+            finally:
+                self._send_query = False
+        return result
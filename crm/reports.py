@@ -0,0 +1,107 @@
+"""Database-side aggregations behind the crmStats query and the CRM report"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Avg, Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Customer, Order
+
+
+def to_cents(amount):
+    """Money aggregate as a 2-decimal Decimal (SUM/AVG of no rows is NULL)"""
+    return Decimal(amount or 0).quantize(Decimal("0.01"))
+
+
+class CrmStats:
+    """CRM totals computed with COUNT/SUM/AVG in the database
+        start_date / end_date: optional dates (inclusive) limiting the orders
+        customer_id: optional customer the stats are restricted to
+    Every figure is computed lazily, so unused ones cost no query.
+    Under async execution aload() computes them up front with the async ORM.
+    """
+
+    def __init__(self, start_date=None, end_date=None, customer_id=None):
+        customers = Customer.objects.all()
+        orders = Order.objects.all()
+        # Compare against datetimes rather than order_date__date so the
+        # order_date index stays usable
+        if start_date:
+            orders = orders.filter(order_date__gte=self._start_of(start_date))
+        if end_date:
+            orders = orders.filter(order_date__lt=self._start_of(end_date + timedelta(days=1)))
+        if customer_id:
+            customers = customers.filter(id=customer_id)
+            orders = orders.filter(customer_id=customer_id)
+        self.customers = customers
+        self.orders = orders
+
+    @staticmethod
+    def _start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    @staticmethod
+    def _aggregates():
+        return {
+            "order_count": Count("id"),
+            "revenue": Sum("total_amount"),
+            "average_order_value": Avg("total_amount"),
+        }
+
+    @staticmethod
+    def _rounded(totals):
+        totals["revenue"] = to_cents(totals["revenue"])
+        totals["average_order_value"] = to_cents(totals["average_order_value"])
+        return totals
+
+    @cached_property
+    def customer_count(self):
+        return self.customers.count()
+
+    @cached_property
+    def totals(self):
+        return self._rounded(self.orders.aggregate(**self._aggregates()))
+
+    @property
+    def order_count(self):
+        return self.totals["order_count"]
+
+    @property
+    def revenue(self):
+        return self.totals["revenue"]
+
+    @property
+    def average_order_value(self):
+        return self.totals["average_order_value"]
+
+    def _daily_buckets(self):
+        return (
+            self.orders.annotate(date=TruncDate("order_date"))
+            .values("date")
+            .annotate(order_count=Count("id"), revenue=Sum("total_amount"))
+            .order_by("date")
+        )
+
+    @staticmethod
+    def _rounded_bucket(bucket):
+        bucket["revenue"] = to_cents(bucket["revenue"])
+        return bucket
+
+    @cached_property
+    def daily(self):
+        """Per-day order count and revenue buckets, oldest first"""
+        return [self._rounded_bucket(bucket) for bucket in self._daily_buckets()]
+
+    async def aload(self, fields):
+        """Computes the given figures with the async ORM, reading them then costs no query
+            fields: names of the figures (customer_count, order_count, revenue,
+            average_order_value, daily)
+        """
+        if "customer_count" in fields:
+            self.customer_count = await self.customers.acount()
+        if {"order_count", "revenue", "average_order_value"} & set(fields):
+            self.totals = self._rounded(await self.orders.aaggregate(**self._aggregates()))
+        if "daily" in fields:
+            self.daily = [self._rounded_bucket(bucket) async for bucket in self._daily_buckets()]
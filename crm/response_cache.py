@@ -0,0 +1,213 @@
+"""Response cache for read-only GraphQL queries
+
+A query result is stored under a key made of
+    - the normalized document (print_ast, so whitespace and comments do not matter)
+    - the variables and the operation name
+    - the current version of every model the document reads
+Each model has a version counter in the cache. Saving, deleting or relinking a
+Customer, Product or Order bumps the counter of its model (crm/signals.py), so the
+old entries are never read again and expire on their own. A product edit only
+changes the keys of the documents that read products.
+
+The models a document reads are found by walking it against the schema: every
+DjangoObjectType selected contributes its model, other object types declare
+theirs with @depends_on. Mutations and results with errors are never cached.
+
+The backend is the CRM_RESPONSE_CACHE["ALIAS"] entry of CACHES and must be
+shared by every process that writes to the database (Redis): web workers, the
+Celery worker refreshing the sales rollup, the import_orders,
+rebuild_customer_stats and clean_inactive_customers commands. A per-process
+backend (LocMemCache) only sees the invalidations of its own process and would
+serve stale responses for up to TIMEOUT seconds, so the cache is off on one
+unless ALLOW_LOCAL says the whole deployment is one process (or a test run).
+"""
+import hashlib
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from graphql import (
+    GraphQLObjectType, OperationType, TypeInfo, TypeInfoVisitor, Visitor, get_named_type, print_ast, visit,
+)
+
+
+DEFAULTS = {
+    "ENABLED": True,
+    "ALIAS": "default",
+    "TIMEOUT": 300,
+    "ALLOW_LOCAL": False,
+}
+
+KEY_PREFIX = "crm:graphql"
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name):
+    return getattr(settings, "CRM_RESPONSE_CACHE", {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting("ALIAS")]
+
+
+def is_enabled():
+    """ENABLED, and the backend is shared between processes unless ALLOW_LOCAL"""
+    if not get_setting("ENABLED"):
+        return False
+    return get_setting("ALLOW_LOCAL") or not isinstance(get_cache(), LocMemCache)
+
+
+def depends_on(*models):
+    """Declares the models read by a non-model graphene ObjectType"""
+    def decorator(graphene_type):
+        graphene_type.cache_models = models
+        return graphene_type
+    return decorator
+
+
+# ────────────── VERSIONS ──────────────
+
+def _version_key(label):
+    return f"{KEY_PREFIX}:version:{label}"
+
+
+def get_versions(labels):
+    """{label: version} for the models, 0 for a model that never changed"""
+    versions = get_cache().get_many([_version_key(label) for label in labels])
+    return {label: versions.get(_version_key(label), 0) for label in labels}
+
+
+def bump_versions(labels):
+    """Bumps the versions of the models, a cache outage is logged and never raised
+        It runs after the write committed: failing would only turn a saved change
+        into an error. The entries it leaves current expire after TIMEOUT.
+    """
+    cache = get_cache()
+    try:
+        for label in labels:
+            key = _version_key(label)
+            # add() is a no-op when the key exists, incr() is atomic on every backend
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add() and incr(): any fresh value invalidates too
+                cache.set(key, 1, timeout=None)
+    except Exception:
+        logger.exception("Could not invalidate the cached responses of %s", ", ".join(sorted(labels)))
+
+
+class _PendingInvalidation:
+    """on_commit callback collecting the models changed by the current transaction"""
+
+    def __init__(self, labels):
+        self.labels = set(labels)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        bump_versions(self.labels)
+
+
+def invalidate(*models):
+    """Marks the cached responses reading models as stale
+        Inside a transaction the versions are bumped once, on commit, so a bulk
+        delete costs one cache write per model and a rollback leaves the cache alone.
+    """
+    if not is_enabled():
+        return
+    labels = {model._meta.label_lower for model in models}
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        bump_versions(labels)
+        return
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _PendingInvalidation) and not callback.done:
+            callback.labels |= labels
+            return
+    transaction.on_commit(_PendingInvalidation(labels))
+
+
+# ────────────── DOCUMENTS ──────────────
+
+class _ModelCollector(Visitor):
+    def __init__(self, type_info):
+        super().__init__()
+        self.type_info = type_info
+        self.labels = set()
+
+    def enter_field(self, node, *args):
+        named_type = get_named_type(self.type_info.get_type())
+        if not isinstance(named_type, GraphQLObjectType):
+            return
+        graphene_type = getattr(named_type, "graphene_type", None)
+        model = getattr(getattr(graphene_type, "_meta", None), "model", None)
+        models = (model,) if model is not None else getattr(graphene_type, "cache_models", ())
+        self.labels.update(m._meta.label_lower for m in models)
+
+
+def get_plan(prepared, schema):
+    """(normalized document hash, model labels) for a query document, None if not cacheable
+    Computed once per document and kept in its memo."""
+    if "response_cache" not in prepared.memo:
+        document = prepared.document
+        if any(getattr(definition, "operation", None) not in (None, OperationType.QUERY)
+               for definition in document.definitions):
+            plan = None
+        else:
+            type_info = TypeInfo(schema)
+            collector = _ModelCollector(type_info)
+            visit(document, TypeInfoVisitor(type_info, collector))
+            normalized = hashlib.sha256(print_ast(document).encode("utf-8")).hexdigest()
+            plan = (normalized, sorted(collector.labels))
+        prepared.memo["response_cache"] = plan
+    return prepared.memo["response_cache"]
+
+
+def response_key(plan, variables, operation_name):
+    normalized, labels = plan
+    versions = get_versions(labels)
+    request = json.dumps(
+        [normalized, variables or {}, operation_name, versions],
+        sort_keys=True, cls=DjangoJSONEncoder,
+    )
+    return f"{KEY_PREFIX}:response:{hashlib.sha256(request.encode('utf-8')).hexdigest()}"
+
+
+# ────────────── STATS ──────────────
+
+class CacheStats:
+    """Hit/miss counters of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+stats = CacheStats()
@@ -0,0 +1,222 @@
+"""Daily sales per product, materialized in DailySalesRollup
+
+The salesByDay and topProducts queries read the rollup instead of grouping the
+orders of the period. refresh_sales_rollup (Celery beat, or the
+refresh_sales_rollup command) only recomputes the days that changed:
+    - the days marked stale because an order or item was saved, or deleted,
+      or lost products (mark_stale, from crm/signals.py)
+    - the days of the orders created since the last refresh, found from the
+      highest order id rolled up (SalesRollupState.last_order_id)
+The watermark alone is not enough with concurrent writers: an order can commit
+after a refresh has read a higher id. New orders mark their day stale for that
+reason, the watermark remains a backstop for inserts that send no signals.
+A day is recomputed as a whole, so refreshing it twice changes nothing. Writes
+that send no signals must call mark_stale for the days of the orders they
+create or change. Items added to an order already rolled up without save()
+(bulk_create, Order.products.add) are not tracked, refresh with full=True
+after such edits.
+
+The units and revenue of a product are summed from the order items, at the
+price captured when the order was placed. The row of a day with no product
+holds the totals of the day, its revenue is the sum of the order totals.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailySalesRollup, Order, OrderItem, Product, SalesRollupState, StaleSalesDay
+from .reports import to_cents
+from .response_cache import invalidate
+
+
+# Days recomputed per set of INSERT ... SELECT
+DAYS_PER_BATCH = 31
+
+
+def day_of(moment):
+    """The day a datetime falls on in the current time zone, as TruncDate groups it"""
+    return timezone.localtime(moment).date()
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _insert_stale(days):
+    StaleSalesDay.objects.bulk_create([StaleSalesDay(date=day) for day in days], ignore_conflicts=True)
+
+
+class _PendingStaleDays:
+    """on_commit callback collecting the days marked stale by the current transaction"""
+
+    def __init__(self):
+        self.days = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        if self.days:
+            _insert_stale(self.days)
+
+
+def _pending(connection):
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _PendingStaleDays) and not callback.done:
+            return callback
+    return None
+
+
+def mark_stale(*days):
+    """Has the next refresh recompute days
+        Inside a transaction the days are written once, on commit, so deleting
+        many orders costs one INSERT and a rollback leaves them unmarked. A
+        crash between the commit and that INSERT loses them: refresh with
+        full=True after one.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        _insert_stale(set(days))
+        return
+    pending = _pending(connection)
+    if pending is None:
+        pending = _PendingStaleDays()
+        transaction.on_commit(pending)
+    pending.days.update(days)
+
+
+def _period(days, prefix=""):
+    """Q matching the order dates falling on days, one range per run of consecutive days"""
+    q = Q()
+    days = sorted(days)
+    first = last = days[0]
+    for day in days[1:] + [None]:
+        if day is not None and day == last + timedelta(days=1):
+            last = day
+            continue
+        q |= Q(**{
+            f"{prefix}order_date__gte": _start_of(first),
+            f"{prefix}order_date__lt": _start_of(last + timedelta(days=1)),
+        })
+        first = last = day
+    return q
+
+
+def _insert_select(queryset):
+    """INSERT INTO the rollup the rows of a values() queryset, named like its columns"""
+    compiler = queryset.query.get_compiler(using=queryset.db)
+    sql, params = compiler.as_sql()
+    columns = ", ".join(connection.ops.quote_name(alias) for _, _, alias in compiler.select)
+    table = connection.ops.quote_name(DailySalesRollup._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {table} ({columns}) {sql}", params)
+        return cursor.rowcount
+
+
+def _insert_rollup(days):
+    """Computes the rollup rows of days in the database, returns their number"""
+    links = (
+        OrderItem.objects.filter(_period(days, prefix="order__"))
+        .annotate(date=TruncDate("order__order_date"))
+        .values("date", "product_id")
+        .annotate(units=Sum("quantity"), revenue=Sum(F("quantity") * F("unit_price")), order_count=Count("order_id"))
+        .order_by()
+    )
+    orders = (
+        Order.objects.filter(_period(days))
+        .annotate(date=TruncDate("order_date"))
+        .values("date")
+        .annotate(units=Value(0), revenue=Sum("total_amount"), order_count=Count("pk"))
+        .order_by()
+    )
+    written = _insert_select(links) + _insert_select(orders)
+    # Units of the day: those of its products, the orders above can't count them without summing totals twice
+    product_units = (
+        DailySalesRollup.objects.filter(date=OuterRef("date"), product__isnull=False)
+        .order_by().values("date").annotate(total=Sum("units")).values("total")
+    )
+    DailySalesRollup.objects.filter(date__in=days, product__isnull=True).update(
+        units=Coalesce(Subquery(product_units), 0)
+    )
+    return written
+
+
+def recompute_days(days):
+    """Replaces the rollup rows of days, returns the rows written"""
+    days = sorted(days)
+    written = 0
+    for start in range(0, len(days), DAYS_PER_BATCH):
+        batch = days[start:start + DAYS_PER_BATCH]
+        DailySalesRollup.objects.filter(date__in=batch).delete()
+        written += _insert_rollup(batch)
+    return written
+
+
+def refresh_sales_rollup(full=False, log=None):
+    """Recomputes the days touched since the last refresh, all days when full, returns them"""
+    with transaction.atomic():
+        state = SalesRollupState.objects.select_for_update().first() or SalesRollupState.objects.create()
+        if full:
+            DailySalesRollup.objects.all().delete()
+            state.last_order_id = 0
+        last_order_id = Order.objects.aggregate(last=Max("pk"))["last"] or 0
+        days = set(
+            Order.objects.filter(pk__gt=state.last_order_id, pk__lte=last_order_id).dates("order_date", "day")
+        )
+        stale = StaleSalesDay.objects.all()
+        days.update(stale.values_list("date", flat=True))
+        stale.delete()
+        # Recomputed from the orders as this transaction sees them
+        pending = _pending(transaction.get_connection())
+        if pending is not None:
+            days |= pending.days
+            pending.days.clear()
+        written = recompute_days(days)
+        state.last_order_id = last_order_id
+        state.refreshed_at = timezone.now()
+        state.save()
+        invalidate(DailySalesRollup)
+    if log:
+        log(f"{len(days)} days recomputed, {written} rollup rows, orders up to id {last_order_id}")
+    return sorted(days)
+
+
+# ────────────── READING ──────────────
+
+TOP_PRODUCTS_ORDER = {"revenue": "revenue", "units": "units", "orderCount": "order_count"}
+
+
+def _in_period(rows, start_date=None, end_date=None):
+    if start_date:
+        rows = rows.filter(date__gte=start_date)
+    if end_date:
+        rows = rows.filter(date__lte=end_date)
+    return rows
+
+
+def sales_by_day(start_date=None, end_date=None, product_id=None):
+    """Day by day figures from the rollup, of one product or of all of them"""
+    rows = DailySalesRollup.objects.filter(product_id=product_id) if product_id else (
+        DailySalesRollup.objects.filter(product__isnull=True)
+    )
+    return _in_period(rows, start_date, end_date).values("date", "units", "order_count", "revenue").order_by("date")
+
+
+def top_products(start_date=None, end_date=None, first=10, order_by="revenue"):
+    """The first best selling products of the period from the rollup, with their figures summed
+        order_by: a key of TOP_PRODUCTS_ORDER, ties go to the lowest product id
+    """
+    field = TOP_PRODUCTS_ORDER[order_by]
+    totals = list(
+        _in_period(DailySalesRollup.objects.filter(product__isnull=False), start_date, end_date)
+        .values("product_id")
+        .annotate(units=Sum("units"), order_count=Sum("order_count"), revenue=Sum("revenue"))
+        .order_by(f"-{field}", "product_id")[:first]
+    )
+    products = Product.objects.in_bulk([row["product_id"] for row in totals])
+    for row in totals:
+        row["product"] = products.get(row["product_id"])
+        row["revenue"] = to_cents(row["revenue"])
+    return totals
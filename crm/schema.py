@@ -1,47 +1,134 @@
 import graphene
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
-from crm.models import Product, Customer, Order
+from crm.models import Product, Customer, Order, OrderItem, DailySalesRollup
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, When
 from django.utils import timezone
 from decimal import Decimal
 from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .fields import BatchedFilterConnectionField, KeysetFilterConnectionField
+from .imports import import_orders
+from .loaders import get_loaders
+from .optimizer import optimize_queryset, selected_fields
+from .pagination import get_max_page_size, paginate_by_id
+from .reports import CrmStats
+from .response_cache import depends_on, invalidate
+from .rollup import TOP_PRODUCTS_ORDER, sales_by_day, top_products
+from .search import search_queryset
 import re
 
 
 PHONE_REGEX = re.compile(r"^(\+\d{10,15}|\d{3}-\d{3}-\d{4})$")
 
+# Rows per INSERT / email__in lookup in the bulk mutations
+BULK_BATCH_SIZE = 1000
+
 
 # ────────────── TYPES ──────────────
 
+class CountableConnection(graphene.relay.Connection):
+    """Connection with a totalCount that is only computed when it is selected"""
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        if isinstance(root.iterable, list):
+            return len(root.iterable)
+        return root.iterable.count()
+
+
 class CustomerType(DjangoObjectType):
+    # Batched through the request loaders instead of one query per customer
+    orders = BatchedFilterConnectionField(lambda: OrderType, required=True)
+
     class Meta:
         model = Customer
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = CustomerFilter
-        fields = ("id", "name", "email", "phone", "orders", "created_at")
+        fields = (
+            "id", "name", "email", "phone", "orders", "created_at",
+            "order_count", "lifetime_revenue", "last_order_at",
+        )
 
-    def resolve_orders(self, info):
-        return self.orders.all()
+    def resolve_orders(self, info, **kwargs):
+        filters = {k: v for k, v in kwargs.items() if k in OrderFilter.base_filters and v is not None}
+        if not filters and "orders" in getattr(self, "_prefetched_objects_cache", {}):
+            return list(self.orders.all())
+        return get_loaders(info).orders_by_customer(filters).load(self.pk)
 
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = ProductFilter
         fields = ("id", "name", "price", "stock")
 
+class OrderItemType(DjangoObjectType):
+    line_total = graphene.Decimal()
+
+    class Meta:
+        model = OrderItem
+        fields = ("product", "quantity", "unit_price")
+
 class OrderType(DjangoObjectType):
     products = graphene.List(ProductType)  # override connection with plain list
+    items = graphene.List(OrderItemType)
 
     class Meta:
         model = Order
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = OrderFilter
-        fields = ("id", "customer", "products", "total_amount", "order_date")
+        fields = ("id", "customer", "products", "items", "total_amount", "order_date")
     
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).customer.load(self.customer_id)
+
+    def resolve_items(self, info):
+        if "items" in getattr(self, "_prefetched_objects_cache", {}):
+            return list(self.items.all())
+        return get_loaders(info).items_by_order.load(self.pk)
+
     def resolve_products(self, info):
-        return list(self.products.all())
+        # Read from the items: one prefetch or batch serves both fields
+        return [item.product for item in OrderType.resolve_items(self, info)]
+
+
+
+@depends_on(Order)
+class DailyStatsType(graphene.ObjectType):
+    date = graphene.Date()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+
+@depends_on(Customer, Order)
+class CrmStatsType(graphene.ObjectType):
+    customer_count = graphene.Int()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+    average_order_value = graphene.Decimal()
+    daily = graphene.List(DailyStatsType)
+
+@depends_on(DailySalesRollup)
+class DailySalesType(graphene.ObjectType):
+    date = graphene.Date()
+    units = graphene.Int()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+
+@depends_on(DailySalesRollup)
+class ProductSalesType(graphene.ObjectType):
+    product = graphene.Field(ProductType)
+    units = graphene.Int()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
 
 
 
@@ -62,9 +149,25 @@ class CreateProductInput(graphene.InputObjectType):
     price = graphene.Float(required=True) 
     stock = graphene.Int()
 
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+class ImportOrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+    unit_price = graphene.Decimal()  # price paid, defaults to the current price
+
+class BulkCreateOrdersInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.ID)  # one of each
+    items = graphene.List(ImportOrderItemInput)
+    order_date = graphene.DateTime()
+
 class CreateOrderInput(graphene.InputObjectType):
     customer_id = graphene.ID(required=True)
-    product_ids = graphene.List(graphene.ID, required=True)
+    product_ids = graphene.List(graphene.ID)  # one of each
+    items = graphene.List(OrderItemInput)
     order_date = graphene.DateTime()
 
 
@@ -114,8 +217,10 @@ class BulkCreateCustomers(graphene.Mutation):
                 email: required unique string
                 phone: optional string (+1234567890 or 123-456-7890)
         Logic:
-            Validates each customer
-            Creates valid entries
+            Checks the emails against the database with one email__in query per chunk
+            Validates each customer in memory, in input order
+                (an email repeated in the batch only succeeds the first time it is valid)
+            Inserts the valid entries with chunked bulk_create in one transaction
             Collects errors for invalid entries
         Return:
             list of successfully created customers
@@ -128,23 +233,34 @@ class BulkCreateCustomers(graphene.Mutation):
     errors = graphene.List(graphene.String)
 
     def mutate(self, info, input):
-        created = []
+        emails = list({c.email for c in input})
+        taken = set()
+        for i in range(0, len(emails), BULK_BATCH_SIZE):
+            taken.update(
+                Customer.objects.filter(email__in=emails[i:i + BULK_BATCH_SIZE])
+                .values_list("email", flat=True)
+            )
+
+        pending = []
         errors = []
         for c in input:
-            # Ensure email is unique
-            if Customer.objects.filter(email=c.email).exists():
+            # Ensure email is unique, also within this batch
+            if c.email in taken:
                 errors.append(f"Email {c.email} already exists")
                 continue
-            
+
             # Validate phone format
             if c.phone and not PHONE_REGEX.match(c.phone):
                 errors.append(f"Invalid phone format for {c.email}")
                 continue
 
-            customer = Customer.objects.create(
-                name=c.name, email=c.email, phone=c.phone
-            )
-            created.append(customer)
+            taken.add(c.email)
+            pending.append(Customer(name=c.name, email=c.email, phone=c.phone))
+
+        with transaction.atomic():
+            created = Customer.objects.bulk_create(pending, batch_size=BULK_BATCH_SIZE)
+            # bulk_create sends no post_save
+            invalidate(Customer)
         return BulkCreateCustomers(customers=created, errors=errors)
 
 
@@ -188,15 +304,21 @@ class CreateOrder(graphene.Mutation):
     """
         Input Fields:
             customer_id: required existing ID
-            product_ids: required list of existing IDs
+            product_ids: list of existing IDs, one unit of each
+            items: list of {product_id, quantity}, quantity defaults to 1
             order_date: optional datetime (defaults to now)
         Logic:
-            Validates customer and product IDs
-            Ensures at least one product
-            Calculates total_amount
-            Creates order and associates products
+            Validates customer and product IDs, merges the lines of a same product
+            Ensures at least one product and positive quantities
+            Reserves the stock of every line with one conditional
+                UPDATE ... SET stock = stock - quantity WHERE stock >= quantity, so
+                concurrent orders can never oversell, and fails if any product ran out
+            Calculates total_amount from the current prices
+            Creates order and its items with one bulk INSERT, capturing the unit
+                prices, all in one transaction (saving the order updates the
+                customer's stats, see crm.stats)
         Return:
-            order object with nested customer and products
+            order object with nested customer, products and items
     """
     class Arguments:
         input = CreateOrderInput(required=True)
@@ -210,57 +332,141 @@ class CreateOrder(graphene.Mutation):
         except Customer.DoesNotExist:
             raise ValidationError("Invalid customer ID")
 
-        if not input.product_ids:
+        # {product id: quantity} in the order of the input
+        quantities = {}
+        lines = [(product_id, 1) for product_id in input.product_ids or []]
+        lines += [(item.product_id, item.quantity) for item in input.items or []]
+        for product_id, quantity in lines:
+            if quantity is None or quantity < 1:
+                raise ValidationError("Quantities must be positive")
+            try:
+                product_id = int(product_id)
+            except (TypeError, ValueError):
+                raise ValidationError("Invalid product IDs")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        if not quantities:
             raise ValidationError("At least one product must be selected")
 
-        # Ensure all product IDs are valid
-        products = Product.objects.filter(id__in=input.product_ids)
-        if not products.exists() or len(products) != len(input.product_ids):
+        # Ensure all product IDs are valid (the queryset is evaluated once)
+        products = Product.objects.in_bulk(list(quantities))
+        if len(products) != len(quantities):
             # If one is invalid don't proceed
             raise ValidationError("Invalid product IDs")
 
         # Calculate the total amount for this order
-        total_amount = sum([Decimal(str(p.price)) for p in products])
+        total_amount = sum(products[pk].price * quantity for pk, quantity in quantities.items())
         order_date = input.order_date if input.order_date else timezone.now()
 
-        order = Order(customer=customer, order_date=order_date)
-        order.save()
-        order.products.add(*products)
-        order.total_amount = sum(p.price for p in products)
-        order.save()
+        in_stock = Q()
+        for pk, quantity in quantities.items():
+            in_stock |= Q(id=pk, stock__gte=quantity)
+
+        with transaction.atomic():
+            # The stock check and the decrement are a single statement
+            reserved = Product.objects.filter(in_stock).update(
+                stock=F("stock") - Case(*(When(id=pk, then=quantity) for pk, quantity in quantities.items()))
+            )
+            invalidate(Product)
+            if reserved != len(products):
+                # Undo the reservations made for the products that were in stock
+                transaction.set_rollback(True)
+            else:
+                order = Order(customer=customer, order_date=order_date, total_amount=total_amount)
+                order.save()
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=products[pk], quantity=quantity, unit_price=products[pk].price)
+                    for pk, quantity in quantities.items()
+                ])
+
+        if reserved != len(products):
+            stock = Product.objects.filter(id__in=quantities).values_list("id", "stock")
+            sold_out = [products[pk] for pk, left in stock if left < quantities[pk]]
+            raise ValidationError(f"Out of stock: {', '.join(p.name for p in sold_out)}")
 
         return CreateOrder(order=order)
 
 
+class BulkCreateOrders(graphene.Mutation):
+    """ Records many past orders at once (see crm.imports, shared with the import_orders command)
+        Input Fields:
+            List of orders, each with:
+                customer_id: required existing ID
+                product_ids: list of existing IDs, one unit of each
+                items: list of {product_id, quantity, unit_price}, unit_price
+                    defaults to the current price
+                order_date: optional datetime (defaults to now)
+        Logic:
+            Looks the customers and products up with one id__in query each per chunk
+            Validates each order in memory, in input order
+            Inserts the valid orders, then their items, with bulk_create in one
+                transaction, without taking stock
+            Recomputes the stats of the customers concerned
+            Collects errors for invalid entries
+        Return:
+            list of successfully created orders
+            list of errors
+    """
+    class Arguments:
+        input = graphene.List(BulkCreateOrdersInput, required=True)
+
+    orders = graphene.List(OrderType)
+    errors = graphene.List(graphene.String)
+
+    def mutate(self, info, input):
+        rows = (
+            (number, {
+                "customer_id": order.customer_id,
+                "product_ids": order.product_ids,
+                "items": [dict(item) for item in order.items or []],
+                "order_date": order.order_date,
+            })
+            for number, order in enumerate(input, start=1)
+        )
+        with transaction.atomic():
+            result = import_orders(rows, chunk_size=BULK_BATCH_SIZE, keep_orders=True)
+        get_loaders(info).prime(result.orders)
+        errors = [f"Order {number}: {message}" for number, message in result.errors]
+        return BulkCreateOrders(orders=result.orders, errors=errors)
+
+
 class UpdateLowStockProducts(graphene.Mutation):
     """
-        Mutation to update stock levels of products that are low in stock (stock < 10)
+        Mutation to update stock levels of products that are low in stock
+        Input Fields:
+            threshold: optional int, products with stock below it are restocked (default 10)
+            amount: optional positive int added to their stock (default 10)
         Logic:
-            Find products with stock below 10
-            Restock: increase their stock by 10
+            Reads and locks the low stock rows with SELECT ... FOR UPDATE
+            Restocks them with a single UPDATE ... SET stock = stock + amount WHERE stock < threshold
+            Returns the rows read, with the amount added to their stock
         Return:
             list of updated products
             and a success message
     """
+    class Arguments:
+        threshold = graphene.Int(default_value=10)
+        amount = graphene.Int(default_value=10)
+
     products = graphene.List(ProductType)
     message = graphene.String()
 
-    def mutate(self, info):
-        low_stock_products = Product.objects.filter(stock__lt=10)
+    def mutate(self, info, threshold=10, amount=10):
+        if amount <= 0:
+            raise ValidationError("Amount must be positive")
 
-        # Keep track of the low stock products that will be updated
-        ids = [product.id for product in low_stock_products]
+        with transaction.atomic():
+            # Lock the low stock products, the UPDATE below then finds the same rows
+            updated_products = list(Product.objects.select_for_update().filter(stock__lt=threshold))
+            Product.objects.filter(stock__lt=threshold).update(stock=F("stock") + amount)
+            for product in updated_products:
+                product.stock += amount
 
-        for product in low_stock_products:
-            product.stock += 10
-            product.save()
-        
-        # Query again the products to return the updated instances
-        updated_products = Product.objects.filter(id__in=ids)
+            invalidate(Product)
 
         return UpdateLowStockProducts(
-            products=list(updated_products),
-            message="Low stock products have been restocked by 10 units each."
+            products=updated_products,
+            message=f"Low stock products have been restocked by {amount} units each."
         )
 
 
@@ -268,68 +474,152 @@ class UpdateLowStockProducts(graphene.Mutation):
 
 class Query(graphene.ObjectType):
     hello = graphene.String(default_value="Hello, GraphQL!")
-    customers = graphene.List(CustomerType)
-    products = graphene.List(ProductType)
-    orders = graphene.List(OrderType)
 
-    def resolve_customers(root, info):
-        return Customer.objects.all()
+    # Plain lists are paginated by id: pass the id of the last row as after
+    # to get the next page, first is capped by CRM_LIST_MAX_PAGE_SIZE
+    customers = graphene.List(CustomerType, first=graphene.Int(), after=graphene.ID())
+    products = graphene.List(ProductType, first=graphene.Int(), after=graphene.ID())
+    orders = graphene.List(OrderType, first=graphene.Int(), after=graphene.ID())
+
+    def resolve_customers(root, info, first=None, after=None):
+        qs = optimize_queryset(Customer.objects.all(), info)
+        customers = list(paginate_by_id(qs, first, after))
+        get_loaders(info).prime(customers)
+        return customers
+
+    def resolve_products(root, info, first=None, after=None):
+        qs = optimize_queryset(Product.objects.all(), info)
+        return paginate_by_id(qs, first, after)
+
+    def resolve_orders(root, info, first=None, after=None):
+        qs = optimize_queryset(Order.objects.all(), info)
+        orders = list(paginate_by_id(qs, first, after))
+        get_loaders(info).prime(orders)
+        return orders
+
+    # Aggregated CRM figures, computed in the database (see crm.reports)
+    crm_stats = graphene.Field(
+        CrmStatsType,
+        start_date=graphene.Date(),
+        end_date=graphene.Date(),
+        customer_id=graphene.ID(),
+    )
+
+    def resolve_crm_stats(root, info, start_date=None, end_date=None, customer_id=None):
+        return CrmStats(start_date=start_date, end_date=end_date, customer_id=customer_id)
+
+    # Sales read from the daily rollup (see crm.rollup), as fresh as its last refresh
+    sales_by_day = graphene.List(
+        DailySalesType,
+        start_date=graphene.Date(),
+        end_date=graphene.Date(),
+        product_id=graphene.ID(),  # one product's sales, all products by default
+    )
+    top_products = graphene.List(
+        ProductSalesType,
+        start_date=graphene.Date(),
+        end_date=graphene.Date(),
+        first=graphene.Int(default_value=10),
+        orderBy=graphene.String(default_value="revenue"),  # revenue, units or orderCount, descending
+    )
 
-    def resolve_products(root, info):
-        return Product.objects.all()
+    def resolve_sales_by_day(root, info, start_date=None, end_date=None, product_id=None):
+        # Read here: the async view runs this resolver in a thread, not the iteration of a queryset
+        return list(sales_by_day(start_date=start_date, end_date=end_date, product_id=product_id))
 
-    def resolve_orders(root, info):
-        return Order.objects.all()
+    def resolve_top_products(root, info, start_date=None, end_date=None, first=10, orderBy="revenue"):
+        max_page_size = get_max_page_size()
+        if not 0 < first <= max_page_size:
+            raise ValidationError(f"first must be between 1 and {max_page_size}")
+        if orderBy not in TOP_PRODUCTS_ORDER:
+            raise ValidationError(f"orderBy must be one of {', '.join(TOP_PRODUCTS_ORDER)}")
+        return top_products(start_date=start_date, end_date=end_date, first=first, order_by=orderBy)
 
     # FILTERS
+    # The connection fields apply the FilterSet themselves, the resolvers only
+    # shape the base queryset and apply the ordering
 
     # Customers query with filters and ordering
-    all_customers = DjangoFilterConnectionField(
+    all_customers = KeysetFilterConnectionField(
         CustomerType,
-        orderBy=graphene.List(of_type=graphene.String)  # Argument to sort customers (by name, email, created_at in asc/desc order)
+        orderBy=graphene.List(of_type=graphene.String),  # Argument to sort customers (by name, email, created_at, order_count, lifetime_revenue, last_order_at in asc/desc order)
+        search=graphene.String(),  # Full-text search on name and email
     )
 
-    def resolve_allCustomers(self, info, orderBy=None, **kwargs):
-        qs = Customer.objects.all()  # Start with all customers
-        if kwargs:  # Apply filters from CustomerFilter (name, email, createdAtGte/Lte, phone_starts_with)
-            qs = CustomerFilter(kwargs, queryset=qs).qs
+    def resolve_all_customers(self, info, orderBy=None, search=None, **kwargs):
+        qs = optimize_queryset(Customer.objects.all(), info)
+        if search:  # Full-text search, best matches first unless ordered otherwise
+            qs = search_queryset(qs, search).order_by("-search_rank")
         if orderBy:  # Apply ordering if provided
             qs = qs.order_by(*orderBy)
         return qs
 
     # Products query with filters and ordering
-    all_products = DjangoFilterConnectionField(
+    all_products = KeysetFilterConnectionField(
         ProductType,
-        orderBy=graphene.List(of_type=graphene.String)  # Argument to sort products (by name, price, stock in asc/desc order)
+        orderBy=graphene.List(of_type=graphene.String),  # Argument to sort products (by name, price, stock in asc/desc order)
+        search=graphene.String(),  # Full-text search on name
     )
 
-    def resolve_allProducts(self, info, orderBy=None, **kwargs):
-        qs = Product.objects.all()  # Start with all products
-        if kwargs:  # Apply filters from ProductFilter (name, price, stock, lowStock)
-            qs = ProductFilter(kwargs, queryset=qs).qs
+    def resolve_all_products(self, info, orderBy=None, search=None, **kwargs):
+        qs = optimize_queryset(Product.objects.all(), info)
+        if search:  # Full-text search, best matches first unless ordered otherwise
+            qs = search_queryset(qs, search).order_by("-search_rank")
         if orderBy:  # Apply ordering if provided
             qs = qs.order_by(*orderBy)
         return qs
 
     # Orders query with filters and ordering
-    all_orders = DjangoFilterConnectionField(
+    all_orders = KeysetFilterConnectionField(
         OrderType,
-        orderBy=graphene.List(of_type=graphene.String)  # Argument to sort orders (by order_date, total_amount, customer__name in asc/desc order)
+        orderBy=graphene.List(of_type=graphene.String),  # Argument to sort orders (by order_date, total_amount, customer__name in asc/desc order)
+        search=graphene.String(),  # Full-text search on customer name/email and product names
     )
 
-    def resolve_allOrders(self, info, orderBy=None, **kwargs):
-        qs = Order.objects.all()  # Start with all orders
-        if kwargs:  # Apply filters from OrderFilter (customerName, productName, totalAmountGte/Lte, orderDateAfter/Before, product_id)
-            qs = OrderFilter(kwargs, queryset=qs).qs
+    def resolve_all_orders(self, info, orderBy=None, search=None, **kwargs):
+        qs = optimize_queryset(Order.objects.all(), info)
+        if search:  # Full-text search, best matches first unless ordered otherwise
+            qs = search_queryset(qs, search).order_by("-search_rank")
         if orderBy:  # Apply ordering if provided
             qs = qs.order_by(*orderBy)
         return qs
 
+class AsyncQuery(Query):
+    """Query for async execution (the ASGI view)
+        The list and stats resolvers use the async ORM, so sibling root fields
+        resolve concurrently. The connection fields keep their sync resolvers,
+        which crm.middleware.SyncResolverMiddleware runs in a thread.
+    """
+
+    async def resolve_customers(root, info, first=None, after=None):
+        qs = paginate_by_id(optimize_queryset(Customer.objects.all(), info), first, after)
+        # A chunk as large as the page prefetches the relations in one go
+        customers = [c async for c in qs.aiterator(chunk_size=get_max_page_size())]
+        get_loaders(info).prime(customers)
+        return customers
+
+    async def resolve_products(root, info, first=None, after=None):
+        qs = paginate_by_id(optimize_queryset(Product.objects.all(), info), first, after)
+        return [p async for p in qs.aiterator(chunk_size=get_max_page_size())]
+
+    async def resolve_orders(root, info, first=None, after=None):
+        qs = paginate_by_id(optimize_queryset(Order.objects.all(), info), first, after)
+        orders = [o async for o in qs.aiterator(chunk_size=get_max_page_size())]
+        get_loaders(info).prime(orders)
+        return orders
+
+    async def resolve_crm_stats(root, info, start_date=None, end_date=None, customer_id=None):
+        stats = CrmStats(start_date=start_date, end_date=end_date, customer_id=customer_id)
+        await stats.aload(selected_fields(info))
+        return stats
+
+
 # ────────────── MUTATION ──────────────
 
 class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
     bulk_create_customers = BulkCreateCustomers.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""Full-text search for customers, products and orders
+
+SQLite: FTS5 external-content tables (crm_customer_fts, crm_product_fts) kept
+in sync with their source tables by triggers, so bulk_create() and
+QuerySet.update() are indexed too. Results are ranked with bm25().
+PostgreSQL: GIN indexes on a tsvector expression plus pg_trgm indexes on the
+names, ranked with the best of ts_rank() and similarity().
+
+Both are installed by migration 0005_search. SQLite drops triggers together
+with their table, so a migration that makes Django rebuild crm_customer or
+crm_product (e.g. adding a NOT NULL column) must run install_search again.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Exists, FloatField, OuterRef, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Customer, Order, Product
+
+
+# Columns indexed for each searchable table
+SEARCH_COLUMNS = {
+    "crm_customer": ("name", "email"),
+    "crm_product": ("name",),
+}
+
+
+def _tsvector(table, qualified=False):
+    """The tsvector expression, identical in the GIN index and the queries using it"""
+    prefix = f"{table}." if qualified else ""
+    document = " || ' ' || ".join(
+        f"coalesce({prefix}{column}, '')" for column in SEARCH_COLUMNS[table]
+    )
+    return f"to_tsvector('simple', {document})"
+
+
+# ────────────── SCHEMA ──────────────
+
+def _sqlite_statements(table):
+    fts = f"{table}_fts"
+    columns = SEARCH_COLUMNS[table]
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _postgresql_statements(table):
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (({_tsvector(table)}))",
+        f"CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx ON {table} USING GIN (name gin_trgm_ops)",
+    ]
+
+
+def install_search(schema_editor):
+    """Creates (or recreates after a table rebuild) the search structures"""
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_COLUMNS:
+        if vendor == "sqlite":
+            statements = _sqlite_statements(table)
+        elif vendor == "postgresql":
+            statements = _postgresql_statements(table)
+        else:
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def uninstall_search(schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_COLUMNS:
+        if vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+        elif vendor == "postgresql":
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_name_trgm_idx")
+
+
+# ────────────── QUERIES ──────────────
+
+def _terms(text):
+    return re.findall(r"\w+", text or "")
+
+
+def _matching(model, terms):
+    """(ids subquery, rank expression) for rows of model matching every term as a prefix
+    The rank is higher for better matches on every backend."""
+    table = model._meta.db_table
+    if connection.vendor == "sqlite":
+        fts = f"{table}_fts"
+        match = " ".join(f'"{term}"*' for term in terms)
+        ids = RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        rank = RawSQL(
+            f"SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id",
+            [match],
+            output_field=FloatField(),
+        )
+        return ids, rank
+
+    if connection.vendor == "postgresql":
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        text = " ".join(terms)
+        condition = f"{_tsvector(table)} @@ to_tsquery('simple', %s) OR name ILIKE %s"
+        ids = RawSQL(f"SELECT id FROM {table} WHERE {condition}", [tsquery, f"%{text}%"])
+        rank = RawSQL(
+            f"GREATEST(ts_rank({_tsvector(table, qualified=True)}, to_tsquery('simple', %s)), "
+            f"similarity({table}.name, %s))",
+            [tsquery, text],
+            output_field=FloatField(),
+        )
+        return ids, rank
+
+    # Other backends: plain icontains on every term, unranked
+    condition = Q()
+    for term in terms:
+        term_condition = Q()
+        for column in SEARCH_COLUMNS[table]:
+            term_condition |= Q(**{f"{column}__icontains": term})
+        condition &= term_condition
+    return model.objects.filter(condition).values("id"), Value(0.0, output_field=FloatField())
+
+
+def search_queryset(queryset, text):
+    """Narrows queryset to the rows matching text and annotates them with search_rank
+        Customers match on name/email, products on name, orders on the name/email
+        of their customer or the name of one of their products (orders are unranked).
+    """
+    terms = _terms(text)
+    if not terms:
+        return queryset.none()
+
+    model = queryset.model
+    if model in (Customer, Product):
+        ids, rank = _matching(model, terms)
+        return queryset.filter(id__in=ids).annotate(search_rank=rank)
+
+    if model is Order:
+        customer_ids, _ = _matching(Customer, terms)
+        product_ids, _ = _matching(Product, terms)
+        product_match = Order.products.through.objects.filter(
+            order_id=OuterRef("pk"), product_id__in=product_ids
+        )
+        return queryset.filter(
+            Q(customer_id__in=customer_ids) | Exists(product_match)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    raise ValueError(f"{model.__name__} is not searchable")
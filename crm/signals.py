@@ -0,0 +1,116 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from django.db.models import QuerySet
+
+from .models import Customer, Order, OrderItem, Product, order_items_deleted
+from .response_cache import invalidate
+from .rollup import day_of, mark_stale
+from .stats import forget_order, record_order, update_order
+
+
+# ────────────── RESPONSE CACHE ──────────────
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def invalidate_model_responses(sender, **kwargs):
+    """Saving or deleting a row makes the responses reading its model stale"""
+    invalidate(sender)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(order_items_deleted)
+def invalidate_order_item_responses(sender, **kwargs):
+    """An item is read as the products and total of its order and the orders of its product"""
+    invalidate(Order, OrderItem, Product)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_order_product_responses(sender, action, **kwargs):
+    """Adding/removing order products changes both sides of the relation"""
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate(Order, OrderItem, Product)
+
+
+# ────────────── CUSTOMER STATS ──────────────
+
+@receiver(pre_save, sender=Order)
+def remember_previous_order(sender, instance, **kwargs):
+    """Keeps the customer and date an existing order had before the save"""
+    instance._previous_state = None
+    if not instance._state.adding:
+        instance._previous_state = (
+            Order.objects.filter(pk=instance.pk).values_list("customer_id", "order_date").first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def record_customer_order(sender, instance, created, **kwargs):
+    if created:
+        record_order(instance)
+        return
+    previous = getattr(instance, "_previous_state", None)
+    update_order(instance, previous_customer_id=previous[0] if previous else None)
+
+
+@receiver(post_delete, sender=Order)
+def forget_customer_order(sender, instance, origin=None, **kwargs):
+    # Orders deleted along with their customer have nobody left to update
+    if isinstance(origin, Customer) or (isinstance(origin, QuerySet) and origin.model is Customer):
+        return
+    forget_order(instance)
+
+
+# ────────────── SALES ROLLUP ──────────────
+# New orders mark their day too: with concurrent writers, an order can commit
+# after a refresh has read a higher id and moved the watermark past it
+
+@receiver(post_save, sender=Order)
+def mark_saved_order_day(sender, instance, created, **kwargs):
+    days = {day_of(instance.order_date)}
+    # An order moved to another date leaves its previous day stale too
+    previous = None if created else getattr(instance, "_previous_state", None)
+    if previous:
+        days.add(day_of(previous[1]))
+    mark_stale(*days)
+
+
+@receiver(post_save, sender=OrderItem)
+def mark_updated_item_day(sender, instance, created, **kwargs):
+    mark_stale(day_of(Order.objects.values_list("order_date", flat=True).get(pk=instance.order_id)))
+
+
+@receiver(order_items_deleted)
+def mark_deleted_items_days(sender, order_ids, **kwargs):
+    mark_stale(*(day_of(moment) for moment in Order.objects.filter(pk__in=order_ids).values_list("order_date", flat=True)))
+
+
+@receiver(pre_delete, sender=Product)
+def mark_deleted_product_days(sender, instance, **kwargs):
+    # Its items go with a fast delete, read the days of its orders before
+    mark_stale(*(day_of(moment) for moment in instance.orders.values_list("order_date", flat=True)))
+
+
+@receiver(post_delete, sender=Order)
+def mark_deleted_order_day(sender, instance, **kwargs):
+    mark_stale(day_of(instance.order_date))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def mark_order_products_day(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_remove", "post_clear"):
+            mark_stale(day_of(instance.order_date))
+        return
+    # A product losing orders, read their days before the links go
+    if action == "pre_remove":
+        orders = Order.objects.filter(pk__in=pk_set)
+    elif action == "pre_clear":
+        orders = instance.orders.all()
+    else:
+        return
+    mark_stale(*(day_of(moment) for moment in orders.values_list("order_date", flat=True)))
@@ -0,0 +1,80 @@
+"""Per-customer order aggregates stored on Customer
+
+order_count, lifetime_revenue and last_order_at are kept on the customer row so
+listing, filtering and sorting customers by them reads one indexed table
+instead of grouping their orders:
+    - saving a new order adds it to the figures of its customer (record_order)
+    - saving an existing order recomputes the figures of its customer, and of
+      the customer it had before when it moved (update_order)
+    - deleting an order recomputes them from the remaining orders (forget_order),
+      except when the customer is being deleted with its orders
+Both run in the transaction of the write, from crm/signals.py. Writes that send
+no signals (bulk_create, QuerySet.update of orders, raw SQL) must call
+refresh_customer_stats for the customers they touch, or the
+rebuild_customer_stats command afterwards.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Customer, Order
+from .response_cache import invalidate
+
+
+def _aggregates():
+    """The figures of the outer customer computed from its orders, for QuerySet.update()"""
+    orders = Order.objects.filter(customer=OuterRef("pk")).order_by().values("customer")
+    return {
+        "order_count": Coalesce(Subquery(orders.annotate(n=Count("pk")).values("n")), 0),
+        "lifetime_revenue": Coalesce(
+            Subquery(orders.annotate(total=Sum("total_amount")).values("total")),
+            Value(Decimal("0")),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+        "last_order_at": Subquery(orders.annotate(last=Max("order_date")).values("last")),
+    }
+
+
+def record_order(order):
+    """Adds a new order to the figures of its customer"""
+    Customer.objects.filter(pk=order.customer_id).update(
+        order_count=F("order_count") + 1,
+        lifetime_revenue=F("lifetime_revenue") + Decimal(order.total_amount),
+        # SQLite's MAX() of a NULL is NULL
+        last_order_at=Greatest(Coalesce("last_order_at", Value(order.order_date)), Value(order.order_date)),
+    )
+    invalidate(Customer)
+
+
+def update_order(order, previous_customer_id=None):
+    """Recomputes the figures of the customer of a changed order, and of its previous customer"""
+    customer_ids = {order.customer_id, previous_customer_id} - {None}
+    refresh_customer_stats(Customer.objects.filter(pk__in=customer_ids))
+
+
+def forget_order(order):
+    """Recomputes the figures of the customer of a deleted order"""
+    refresh_customer_stats(Customer.objects.filter(pk=order.customer_id))
+
+
+def refresh_customer_stats(customers):
+    """Recomputes the figures of a queryset of customers in one UPDATE, returns the rows updated"""
+    updated = customers.update(**_aggregates())
+    invalidate(Customer)
+    return updated
+
+
+def rebuild_customer_stats(batch_size=10000, log=None):
+    """Recomputes the figures of every customer, batch_size customers per transaction"""
+    last_id = Customer.objects.aggregate(last=Max("pk"))["last"] or 0
+    updated = 0
+    for start in range(0, last_id, batch_size):
+        with transaction.atomic():
+            updated += refresh_customer_stats(
+                Customer.objects.filter(pk__gt=start, pk__lte=start + batch_size)
+            )
+        if log:
+            log(f"{updated} customers updated (ids up to {min(start + batch_size, last_id)})")
+    return updated
@@ -1,32 +1,61 @@
 from celery import shared_task
+from django.conf import settings
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from datetime import datetime
 import requests
 
+from .persisted import PersistedQueryTransport
+from .reports import CrmStats
+from .rollup import refresh_sales_rollup
 
-@shared_task
-def generate_crm_report():
-    transport = RequestsHTTPTransport(
+
+# Parsed once per worker instead of on every run
+REPORT_QUERY = gql("""
+    query {
+        crmStats { customerCount, orderCount, revenue }
+    }
+""")
+
+
+def fetch_report_stats():
+    """Asks the web server for the report figures over HTTP"""
+    transport = PersistedQueryTransport(
         url='http://localhost:8000/graphql',
         verify=True,
         retries=3,
     )
 
-    client = Client(transport=transport, fetch_schema_from_transport=True)
+    # No fetch_schema_from_transport: the query is fixed, the introspection
+    # round-trip it would cost buys nothing
+    client = Client(transport=transport)
+
+    stats = client.execute(REPORT_QUERY)['crmStats']
+    return stats['customerCount'], stats['orderCount'], float(stats['revenue'])
 
-    query = gql("""
-        query {
-            customers { id }
-            orders { id, totalAmount }
-        }
-    """)
 
-    result = client.execute(query)
+def compute_report_stats():
+    """Computes the report figures in the worker, straight from the database"""
+    stats = CrmStats()
+    return stats.customer_count, stats.order_count, float(stats.revenue)
 
-    customer_count = len(result['customers'])
-    order_count = len(result['orders'])
-    total_revenue = sum(float(order['totalAmount']) for order in result['orders'])
+
+@shared_task
+def refresh_daily_sales():
+    """Brings DailySalesRollup up to date with the orders, returns the days recomputed"""
+    return [day.isoformat() for day in refresh_sales_rollup()]
+
+
+@shared_task
+def generate_crm_report():
+    """Logs the weekly CRM report
+        By default the figures are aggregated in the worker process, so the task
+        does not depend on the web server. Set CRM_REPORT_IN_PROCESS = False
+        for workers that cannot reach the database and must go through /graphql.
+    """
+    if getattr(settings, 'CRM_REPORT_IN_PROCESS', True):
+        customer_count, order_count, total_revenue = compute_report_stats()
+    else:
+        customer_count, order_count, total_revenue = fetch_report_stats()
 
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -37,5 +66,5 @@ def generate_crm_report():
     # Store the report in a log file in /tmp/crm_report_log.txt
     with open('crm/tmp/crm_report.log', 'a') as log_file:
         log_file.write(log_line)
-    
-    print("CRM report generated and logged.")
\ No newline at end of file
+
+    print("CRM report generated and logged.")
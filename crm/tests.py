@@ -1,3 +1,1507 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from gql import Client, gql
+from graphene_django.utils.testing import GraphQLTestCase
+
+from . import exports
+from .cron_jobs import send_order_reminders
+from .filters import CustomerFilter, OrderFilter
+from .imports import import_orders
+from .middleware import SyncResolverMiddleware
+from .models import Customer, DailySalesRollup, Product, Order, OrderItem, SalesRollupState, StaleSalesDay
+from .rollup import refresh_sales_rollup
+from .persisted import DocumentCache, PersistedQueryTransport, query_hash, reset_persisted_queries
+from .tasks import generate_crm_report
+from . import response_cache, tracing
+
+
+# Tests run in one process, the local memory backend sees every invalidation
+@override_settings(CRM_RESPONSE_CACHE={"ALIAS": "default", "ALLOW_LOCAL": True})
+class CRMGraphQLTestCase(GraphQLTestCase):
+    GRAPHQL_URL = "/graphql"
+
+    def setUp(self):
+        super().setUp()
+        # Query counts are about execution, start every test with an empty response cache
+        response_cache.get_cache().clear()
+        response_cache.stats.reset()
+
+    @staticmethod
+    def create_orders(customer_count, orders_per_customer=2, products_per_order=2):
+        """Creates customers each with a few orders spanning a few products"""
+        products = [
+            Product.objects.create(name=f"Product {i}", price=Decimal("10.00"), stock=100)
+            for i in range(products_per_order + 1)
+        ]
+        for c in range(customer_count):
+            customer = Customer.objects.create(name=f"Customer {c}", email=f"customer{c}@example.com")
+            for o in range(orders_per_customer):
+                order = Order.objects.create(customer=customer, total_amount=Decimal("20.00"))
+                order.products.add(
+                    *products[o % 2:o % 2 + products_per_order], through_defaults={"unit_price": Decimal("10.00")}
+                )
+
+
+class BatchLoaderTests(CRMGraphQLTestCase):
+    """Nested fields must cost a fixed number of queries whatever the result size"""
+
+    def assertFixedQueryCount(self, query, expected, key):
+        for customer_count in (2, 6):
+            # Run the on_commit cache invalidation as a real commit would
+            with self.captureOnCommitCallbacks(execute=True):
+                Customer.objects.all().delete()
+                Product.objects.all().delete()
+                self.create_orders(customer_count)
+            with self.assertNumQueries(expected):
+                response = self.query(query)
+            self.assertResponseNoErrors(response)
+            self.assertTrue(response.json()["data"][key])
+
+    def test_plain_customers_list(self):
+        # customers, orders, products (the order customer is the parent)
+        self.assertFixedQueryCount("""
+            query {
+                customers {
+                    name
+                    orders { edges { node { totalAmount products { name } customer { email } } } }
+                }
+            }
+        """, 3, "customers")
+
+    def test_plain_orders_list(self):
+        self.assertFixedQueryCount("""
+            query { orders { customer { name } products { name } } }
+        """, 2, "orders")
+
+    def test_relay_connections(self):
+        self.assertFixedQueryCount("""
+            query {
+                allCustomers {
+                    edges { node { orders { edges { node { products { name } } } } } }
+                }
+            }
+        """, 3, "allCustomers")
+        self.assertFixedQueryCount("""
+            query { allOrders { edges { node { customer { name } products { name } } } } }
+        """, 2, "allOrders")
+
+    def test_relations_below_select_related(self):
+        # orders + joined customer, customer orders (loader), their products (loader)
+        self.assertFixedQueryCount("""
+            query { orders { customer { orders { edges { node { products { name } } } } } } }
+        """, 3, "orders")
+
+    def test_nested_orders_filter_is_batched(self):
+        self.create_orders(3)
+        Order.objects.filter(pk__in=Order.objects.order_by("pk").values("pk")[:1]).update(
+            total_amount=Decimal("99.00")
+        )
+        with self.assertNumQueries(2):
+            response = self.query("""
+                query { customers { orders(totalAmountGte: 50) { edges { node { totalAmount } } } } }
+            """)
+        self.assertResponseNoErrors(response)
+        amounts = [
+            edge["node"]["totalAmount"]
+            for customer in response.json()["data"]["customers"]
+            for edge in customer["orders"]["edges"]
+        ]
+        self.assertEqual(amounts, ["99.00"])
+
+
+class QueryOptimizerTests(CRMGraphQLTestCase):
+    """Root resolvers only fetch the selected columns and relations"""
+
+    def test_only_selected_columns(self):
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query("query { customers { name } }")
+        self.assertResponseNoErrors(response)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]["sql"]
+        self.assertIn('"crm_customer"."name"', sql)
+        self.assertNotIn('"crm_customer"."email"', sql)
+
+    def test_customer_is_joined_only_when_selected(self):
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.query("query { orders { totalAmount } }")
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("JOIN", queries[0]["sql"])
+
+    def test_order_by_is_applied(self):
+        self.create_orders(3)
+        response = self.query('query { allCustomers(orderBy: ["-name"]) { edges { node { name } } } }')
+        self.assertResponseNoErrors(response)
+        names = [edge["node"]["name"] for edge in response.json()["data"]["allCustomers"]["edges"]]
+        self.assertEqual(names, ["Customer 2", "Customer 1", "Customer 0"])
+
+    def test_products_and_items_share_one_prefetch(self):
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query("""
+                query { orders { products { name price } items { quantity product { name } } } }
+            """)
+        self.assertResponseNoErrors(response)
+        self.assertEqual(len(queries), 2)
+        order = response.json()["data"]["orders"][0]
+        self.assertEqual([p["name"] for p in order["products"]], [i["product"]["name"] for i in order["items"]])
+
+
+class ListPaginationTests(CRMGraphQLTestCase):
+    """Plain list fields page by id with a server-side maximum page size"""
+
+    def test_pages_follow_each_other(self):
+        self.create_orders(5)
+        response = self.query("query { customers(first: 2) { id name } }")
+        first_page = response.json()["data"]["customers"]
+        self.assertEqual([c["name"] for c in first_page], ["Customer 0", "Customer 1"])
+
+        response = self.query(
+            "query ($after: ID) { customers(first: 2, after: $after) { id name } }",
+            variables={"after": first_page[-1]["id"]},
+        )
+        self.assertEqual(
+            [c["name"] for c in response.json()["data"]["customers"]], ["Customer 2", "Customer 3"]
+        )
+
+    @override_settings(CRM_LIST_MAX_PAGE_SIZE=3)
+    def test_max_page_size(self):
+        self.create_orders(5)
+        response = self.query("query { orders { id } }")
+        self.assertEqual(len(response.json()["data"]["orders"]), 3)
+
+        response = self.query("query { orders(first: 4) { id } }")
+        self.assertResponseHasErrors(response)
+
+
+class KeysetConnectionTests(CRMGraphQLTestCase):
+    """Relay connections seek on the sort key instead of using OFFSET"""
+
+    QUERY = """
+        query ($first: Int, $after: String, $last: Int, $before: String) {
+            allCustomers(orderBy: ["-name"], first: $first, after: $after, last: $last, before: $before) {
+                edges { cursor node { name } }
+                pageInfo { hasNextPage hasPreviousPage endCursor startCursor }
+            }
+        }
+    """
+
+    def names(self, response):
+        self.assertResponseNoErrors(response)
+        return [edge["node"]["name"] for edge in response.json()["data"]["allCustomers"]["edges"]]
+
+    def test_forward_and_backward_pages(self):
+        self.create_orders(5)
+        response = self.query(self.QUERY, variables={"first": 2})
+        self.assertEqual(self.names(response), ["Customer 4", "Customer 3"])
+        page_info = response.json()["data"]["allCustomers"]["pageInfo"]
+        self.assertTrue(page_info["hasNextPage"])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query(self.QUERY, variables={"first": 2, "after": page_info["endCursor"]})
+        self.assertEqual(self.names(response), ["Customer 2", "Customer 1"])
+        self.assertNotIn("OFFSET", queries[-1]["sql"])
+
+        page_info = response.json()["data"]["allCustomers"]["pageInfo"]
+        response = self.query(self.QUERY, variables={"first": 2, "after": page_info["endCursor"]})
+        self.assertEqual(self.names(response), ["Customer 0"])
+        self.assertFalse(response.json()["data"]["allCustomers"]["pageInfo"]["hasNextPage"])
+
+        response = self.query(self.QUERY, variables={"last": 2, "before": page_info["startCursor"]})
+        self.assertEqual(self.names(response), ["Customer 4", "Customer 3"])
+
+    def test_ties_follow_the_direction_of_the_key(self):
+        customers = [
+            Customer.objects.create(name="Same", email=f"same{i}@example.com") for i in range(3)
+        ]
+        query = """
+            query ($after: String) {
+                allCustomers(orderBy: ["-name"], first: 2, after: $after) {
+                    edges { node { email } }
+                    pageInfo { endCursor }
+                }
+            }
+        """
+        emails, after = [], None
+        for _ in range(2):
+            response = self.query(query, variables={"after": after})
+            self.assertResponseNoErrors(response)
+            data = response.json()["data"]["allCustomers"]
+            emails += [edge["node"]["email"] for edge in data["edges"]]
+            after = data["pageInfo"]["endCursor"]
+        # Descending name, then descending id
+        self.assertEqual(emails, [c.email for c in reversed(customers)])
+
+    def test_datetime_sort_key(self):
+        self.create_orders(3)
+        query = """
+            query ($after: String) {
+                allCustomers(orderBy: ["created_at"], first: 1, after: $after) {
+                    edges { node { name } }
+                    pageInfo { endCursor }
+                }
+            }
+        """
+        names, after = [], None
+        for _ in range(3):
+            response = self.query(query, variables={"after": after})
+            names += self.names(response)
+            after = response.json()["data"]["allCustomers"]["pageInfo"]["endCursor"]
+        self.assertEqual(names, ["Customer 0", "Customer 1", "Customer 2"])
+
+    def test_nullable_sort_key(self):
+        for i, phone in enumerate(["+1003", None, "+1001", None, "+1002"]):
+            Customer.objects.create(name=f"Customer {i}", email=f"c{i}@example.com", phone=phone)
+        query = """
+            query ($orderBy: [String], $first: Int, $after: String, $last: Int, $before: String) {
+                allCustomers(orderBy: $orderBy, first: $first, after: $after, last: $last, before: $before) {
+                    edges { node { name } }
+                    pageInfo { startCursor endCursor }
+                }
+            }
+        """
+
+        def walk(order_by, **page):
+            names, after, cursors = [], None, []
+            for _ in range(3):
+                response = self.query(query, variables={"orderBy": order_by, "after": after, **page})
+                names += self.names(response)
+                page_info = response.json()["data"]["allCustomers"]["pageInfo"]
+                after = page_info["endCursor"]
+                cursors.append(page_info)
+            return names, cursors
+
+        # NULL sorts last ascending, first descending
+        names, _ = walk(["phone"], first=2)
+        self.assertEqual(names, ["Customer 2", "Customer 4", "Customer 0", "Customer 1", "Customer 3"])
+        names, cursors = walk(["-phone"], first=2)
+        self.assertEqual(names, ["Customer 3", "Customer 1", "Customer 0", "Customer 4", "Customer 2"])
+
+        # Backwards from the third page, across the NULL rows
+        response = self.query(query, variables={"orderBy": ["-phone"], "last": 3, "before": cursors[2]["startCursor"]})
+        self.assertEqual(self.names(response), ["Customer 1", "Customer 0", "Customer 4"])
+
+    def test_total_count_only_when_selected(self):
+        self.create_orders(3)
+        with CaptureQueriesContext(connection) as queries:
+            self.query("query { allProducts { edges { node { name } } } }")
+        self.assertFalse(any("COUNT" in q["sql"] for q in queries))
+
+        response = self.query("query { allProducts(first: 1) { totalCount edges { node { name } } } }")
+        self.assertEqual(response.json()["data"]["allProducts"]["totalCount"], 3)
+
+    def test_invalid_cursor(self):
+        response = self.query(self.QUERY, variables={"first": 2, "after": "not-a-cursor"})
+        self.assertResponseHasErrors(response)
+
+
+class BulkCreateCustomersTests(CRMGraphQLTestCase):
+    """The bulk path keeps the per-row error semantics of the row-by-row version"""
+
+    MUTATION = """
+        mutation ($input: [BulkCreateCustomersInput]!) {
+            bulkCreateCustomers(input: $input) { customers { name email } errors }
+        }
+    """
+
+    def test_errors_and_duplicates(self):
+        Customer.objects.create(name="Existing", email="taken@example.com")
+        rows = [
+            {"name": "A", "email": "a@example.com", "phone": "123-456-7890"},
+            {"name": "Taken", "email": "taken@example.com"},
+            {"name": "Bad phone", "email": "b@example.com", "phone": "12"},
+            {"name": "B", "email": "b@example.com", "phone": "+12345678901"},
+            {"name": "A again", "email": "a@example.com"},
+        ]
+        # email lookup + one INSERT (wrapped in a savepoint inside the test transaction)
+        with self.assertNumQueries(4):
+            response = self.query(self.MUTATION, variables={"input": rows})
+        self.assertResponseNoErrors(response)
+        data = response.json()["data"]["bulkCreateCustomers"]
+        self.assertEqual([c["name"] for c in data["customers"]], ["A", "B"])
+        self.assertEqual(data["errors"], [
+            "Email taken@example.com already exists",
+            "Invalid phone format for b@example.com",
+            "Email a@example.com already exists",
+        ])
+        self.assertEqual(Customer.objects.count(), 3)
+
+
+class CreateOrderTests(CRMGraphQLTestCase):
+    """Orders reserve stock atomically and never oversell"""
+
+    MUTATION = """
+        mutation ($input: CreateOrderInput!) {
+            createOrder(input: $input) { order { totalAmount products { name } } }
+        }
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal("999.99"), stock=1)
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("49.99"), stock=5)
+
+    def order(self, *products):
+        return self.query(self.MUTATION, variables={"input": {
+            "customerId": self.customer.id, "productIds": [p.id for p in products],
+        }})
+
+    def test_stock_is_decremented(self):
+        response = self.order(self.laptop, self.mouse)
+        self.assertResponseNoErrors(response)
+        self.assertEqual(response.json()["data"]["createOrder"]["order"]["totalAmount"], "1049.98")
+        self.laptop.refresh_from_db()
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.laptop.stock, self.mouse.stock), (0, 4))
+
+    def test_out_of_stock_rolls_back(self):
+        self.order(self.laptop)
+        response = self.order(self.laptop, self.mouse)
+        self.assertResponseHasErrors(response)
+        self.assertIn("Out of stock: Laptop", response.json()["errors"][0]["message"])
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 5)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_items_capture_quantity_and_price(self):
+        response = self.query("""
+            mutation ($input: CreateOrderInput!) {
+                createOrder(input: $input) {
+                    order { totalAmount items { product { name } quantity unitPrice lineTotal } }
+                }
+            }
+        """, variables={"input": {
+            "customerId": self.customer.id,
+            "productIds": [self.mouse.id],
+            "items": [{"productId": self.mouse.id, "quantity": 2}, {"productId": self.laptop.id}],
+        }})
+        self.assertResponseNoErrors(response)
+        order = response.json()["data"]["createOrder"]["order"]
+        self.assertEqual(order["totalAmount"], "1149.96")
+        self.assertEqual(order["items"], [
+            {"product": {"name": "Mouse"}, "quantity": 3, "unitPrice": "49.99", "lineTotal": "149.97"},
+            {"product": {"name": "Laptop"}, "quantity": 1, "unitPrice": "999.99", "lineTotal": "999.99"},
+        ])
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 2)
+
+        # A later price change leaves the order alone
+        Product.objects.filter(pk=self.mouse.pk).update(price=Decimal("1.00"))
+        self.assertEqual(OrderItem.objects.get(product=self.mouse).unit_price, Decimal("49.99"))
+
+    def test_quantity_over_stock_rolls_back(self):
+        response = self.query(self.MUTATION, variables={"input": {
+            "customerId": self.customer.id, "items": [{"productId": self.mouse.id, "quantity": 6}],
+        }})
+        self.assertIn("Out of stock: Mouse", response.json()["errors"][0]["message"])
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 5)
+
+        response = self.query(self.MUTATION, variables={"input": {
+            "customerId": self.customer.id, "items": [{"productId": self.mouse.id, "quantity": 0}],
+        }})
+        self.assertIn("Quantities must be positive", response.json()["errors"][0]["message"])
+
+
+class UpdateLowStockProductsTests(CRMGraphQLTestCase):
+    """Restocking is a single set-based UPDATE"""
+
+    def test_restock(self):
+        for name, stock in (("Low", 2), ("Edge", 10), ("Empty", 0), ("Plenty", 15)):
+            Product.objects.create(name=name, price=Decimal("1.00"), stock=stock)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query("""
+                mutation { updateLowStockProducts { products { name stock } message } }
+            """)
+        self.assertResponseNoErrors(response)
+        # One SELECT, one UPDATE on the threshold, no list of ids sent back
+        statements = [q["sql"] for q in queries if q["sql"].startswith(("SELECT", "UPDATE"))]
+        self.assertEqual(len(statements), 2)
+        self.assertNotIn(" IN (", statements[1])
+        products = response.json()["data"]["updateLowStockProducts"]["products"]
+        self.assertEqual(
+            sorted((p["name"], p["stock"]) for p in products), [("Empty", 10), ("Low", 12)]
+        )
+
+        response = self.query("""
+            mutation { updateLowStockProducts(threshold: 12, amount: 5) { products { name stock } } }
+        """)
+        products = response.json()["data"]["updateLowStockProducts"]["products"]
+        self.assertEqual(
+            sorted((p["name"], p["stock"]) for p in products), [("Edge", 15), ("Empty", 15)]
+        )
+
+
+class CrmStatsTests(CRMGraphQLTestCase):
+    """crmStats aggregates in the database"""
+
+    def test_stats(self):
+        self.create_orders(3)  # 6 orders of 20.00
+        first = Customer.objects.order_by("pk").first()
+        Order.objects.filter(customer=first).update(order_date=timezone.now() - timedelta(days=3))
+
+        query = """
+            query ($start: Date, $customer: ID) {
+                crmStats(startDate: $start, customerId: $customer) {
+                    customerCount orderCount revenue averageOrderValue
+                    daily { date orderCount revenue }
+                }
+            }
+        """
+        with self.assertNumQueries(3):
+            response = self.query(query)
+        stats = response.json()["data"]["crmStats"]
+        self.assertEqual(
+            (stats["customerCount"], stats["orderCount"], stats["revenue"], stats["averageOrderValue"]),
+            (3, 6, "120.00", "20.00"),
+        )
+        self.assertEqual([d["orderCount"] for d in stats["daily"]], [2, 4])
+
+        yesterday = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.query(query, variables={"start": yesterday})
+        self.assertEqual(response.json()["data"]["crmStats"]["orderCount"], 4)
+
+        response = self.query(query, variables={"customer": first.id})
+        stats = response.json()["data"]["crmStats"]
+        self.assertEqual((stats["customerCount"], stats["orderCount"]), (1, 2))
+
+
+class CrmReportTaskTests(CRMGraphQLTestCase):
+    """The weekly report is computed in the worker without any HTTP call"""
+
+    def test_in_process_report(self):
+        self.create_orders(2)
+        with mock.patch("crm.tasks.fetch_report_stats") as fetch, \
+                mock.patch("builtins.open", mock.mock_open()) as log_file:
+            generate_crm_report()
+        fetch.assert_not_called()
+        line = log_file().write.call_args[0][0]
+        self.assertIn("Report: 2 customers, 4 orders, $80.00 revenue", line)
+
+
+class SendOrderRemindersTests(TestCase):
+    """The reminder job pages through allOrders and resumes after the last order it logged"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(directory, "log.txt")
+        self.state_path = os.path.join(directory, "state.json")
+        # Orders c1, c2, ... the server returns at most two per page
+        self.cursors = ["c1", "c2", "c3"]
+
+    def execute(self, query, variable_values):
+        after = variable_values["after"]
+        start = self.cursors.index(after) + 1 if after else 0
+        edges = [
+            {"cursor": cursor, "node": {"id": cursor, "customer": {"email": f"{cursor}@example.com"}}}
+            for cursor in self.cursors[start:start + 2]
+        ]
+        return {"allOrders": {
+            "edges": edges,
+            "pageInfo": {
+                "hasNextPage": start + 2 < len(self.cursors),
+                "endCursor": edges[-1]["cursor"] if edges else None,
+            },
+        }}
+
+    def run_job(self):
+        client = mock.Mock()
+        client.execute.side_effect = self.execute
+        with mock.patch.multiple(
+            send_order_reminders, Client=mock.Mock(return_value=client), RequestsHTTPTransport=mock.Mock(),
+            LOG_PATH=self.log_path, STATE_PATH=self.state_path, PAGE_SIZE=2,
+        ), mock.patch("builtins.print"):
+            send_order_reminders.main()
+        return [call.kwargs["variable_values"]["after"] for call in client.execute.call_args_list]
+
+    def logged(self):
+        with open(self.log_path) as log_file:
+            return [line.split("Order ID: ")[1].split(",")[0] for line in log_file]
+
+    def test_pages_and_resumes_from_the_saved_cursor(self):
+        self.assertEqual(self.run_job(), [None, "c2"])
+        self.assertEqual(self.logged(), ["c1", "c2", "c3"])
+        with open(self.state_path) as state_file:
+            self.assertEqual(json.load(state_file), {"cursor": "c3"})
+
+        # Nothing new: one empty page, the state file is left alone
+        modified = os.stat(self.state_path).st_mtime_ns
+        with mock.patch.object(send_order_reminders, "save_state") as save_state:
+            self.assertEqual(self.run_job(), ["c3"])
+        save_state.assert_not_called()
+        self.assertEqual(os.stat(self.state_path).st_mtime_ns, modified)
+
+        self.cursors.append("c4")
+        self.assertEqual(self.run_job(), ["c3"])
+        self.assertEqual(self.logged(), ["c1", "c2", "c3", "c4"])
+        with open(self.state_path) as state_file:
+            self.assertEqual(json.load(state_file), {"cursor": "c4"})
+
+
+class CleanInactiveCustomersTests(TestCase):
+    """The cleanup finds inactive customers from their stored last order date"""
+
+    def test_deletes_only_inactive_customers(self):
+        old = timezone.now() - timedelta(days=400)
+        inactive = Customer.objects.create(name="Inactive", email="inactive@example.com")
+        active = Customer.objects.create(name="Active", email="active@example.com")
+        Customer.objects.create(name="No orders", email="none@example.com")
+        Order.objects.create(customer=inactive, order_date=old)
+        Order.objects.create(customer=active, order_date=old)
+        Order.objects.create(customer=active)
+
+        with tempfile.NamedTemporaryFile("r") as log_file:
+            call_command("clean_inactive_customers", "--dry-run", log_file=log_file.name, stdout=StringIO())
+            self.assertEqual(Customer.objects.count(), 3)
+
+            call_command("clean_inactive_customers", "--batch-size", "1", log_file=log_file.name, stdout=StringIO())
+            self.assertIn("Deleted 1 customers", log_file.read())
+
+        self.assertEqual(
+            sorted(Customer.objects.values_list("name", flat=True)), ["Active", "No orders"]
+        )
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class PhoneFilterTests(CRMGraphQLTestCase):
+    """phone_starts_with matches prefixes, whichever SQL it is written in"""
+
+    PHONES = ["+15550001", "+15551234", "+1555", "+1556", "555-123-4567", "é12", "éa", "e12", "+۱۲۳", None]
+
+    def setUp(self):
+        super().setUp()
+        for i, phone in enumerate(self.PHONES):
+            Customer.objects.create(name=f"Customer {i}", email=f"c{i}@example.com", phone=phone)
+
+    def phones(self, prefix):
+        qs = CustomerFilter({"phone_starts_with": prefix}, queryset=Customer.objects.all()).qs
+        return sorted(qs.values_list("phone", flat=True))
+
+    def test_prefixes(self):
+        for prefix in ("+1555", "+15551", "555-", "é", "é1", "+۱", "e"):
+            expected = sorted(p for p in self.PHONES if p is not None and p.startswith(prefix))
+            self.assertEqual(self.phones(prefix), expected, prefix)
+            # The LIKE used by the other databases
+            with mock.patch.object(connection, "vendor", "postgresql"):
+                self.assertEqual(self.phones(prefix), expected, prefix)
+                qs = CustomerFilter({"phone_starts_with": prefix}, queryset=Customer.objects.all()).qs
+                self.assertIn("LIKE", str(qs.query))
+
+    def test_sqlite_range_uses_the_index(self):
+        qs = CustomerFilter({"phone_starts_with": "+1555"}, queryset=Customer.objects.all()).qs
+        self.assertIn("crm_customer_phone_idx", qs.explain())
+
+
+class SearchTests(CRMGraphQLTestCase):
+    """The search argument goes through the full-text index and ranks the matches"""
+
+    def search(self, field, text):
+        response = self.query(
+            f'query ($q: String) {{ {field}(search: $q) {{ edges {{ node {{ id }} }} }} }}',
+            variables={"q": text},
+        )
+        self.assertResponseNoErrors(response)
+        return response.json()["data"][field]["edges"]
+
+    def test_customers_prefix_search_and_rank(self):
+        Customer.objects.bulk_create([
+            Customer(name="Jonathan Smith", email="jsmith@example.com"),
+            Customer(name="Jane Doe", email="jane@example.com"),
+            Customer(name="Smith Smithson", email="smith@smithson.com"),
+        ])
+        response = self.query("""
+            query { allCustomers(search: "smi") { edges { node { name } } } }
+        """)
+        names = [e["node"]["name"] for e in response.json()["data"]["allCustomers"]["edges"]]
+        self.assertEqual(names, ["Smith Smithson", "Jonathan Smith"])
+
+        # Ranked results page with cursors on the rank
+        query = """
+            query ($after: String) {
+                allCustomers(search: "smi", first: 1, after: $after) {
+                    edges { node { name } }
+                    pageInfo { endCursor }
+                }
+            }
+        """
+        first_page = self.query(query).json()["data"]["allCustomers"]
+        second_page = self.query(
+            query, variables={"after": first_page["pageInfo"]["endCursor"]}
+        ).json()["data"]["allCustomers"]
+        self.assertEqual(second_page["edges"][0]["node"]["name"], "Jonathan Smith")
+
+        # Updates and deletes keep the index in sync
+        Customer.objects.filter(name="Jane Doe").update(name="Jane Smithers")
+        Customer.objects.filter(name="Jonathan Smith").delete()
+        response = self.query("""
+            query { allCustomers(search: "smi", orderBy: ["name"]) { edges { node { name } } } }
+        """)
+        names = [e["node"]["name"] for e in response.json()["data"]["allCustomers"]["edges"]]
+        self.assertEqual(names, ["Jane Smithers", "Smith Smithson"])
+
+    def test_products_and_orders(self):
+        self.create_orders(2)
+        self.assertEqual(len(self.search("allProducts", "product")), 3)
+        self.assertEqual(len(self.search("allProducts", "nothing")), 0)
+        # Orders match on their customer or on one of their products
+        self.assertEqual(len(self.search("allOrders", "customer")), 4)
+        self.assertEqual(len(self.search("allOrders", "customer 1")), 2)
+        self.assertEqual(len(self.search("allOrders", "product 2")), 2)
+
+
+class OrderProductFilterTests(CRMGraphQLTestCase):
+    """Product filters return each order once and do not join the M2M table"""
+
+    def setUp(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("10.00"))
+        self.mousepad = Product.objects.create(name="Mousepad", price=Decimal("5.00"))
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal("900.00"))
+        self.both = Order.objects.create(customer=customer)
+        self.both.products.add(self.mouse, self.mousepad, through_defaults={"unit_price": Decimal("10.00")})
+        self.laptop_only = Order.objects.create(customer=customer)
+        self.laptop_only.products.add(self.laptop, through_defaults={"unit_price": Decimal("900.00")})
+
+    def test_product_name_matches_each_order_once(self):
+        qs = OrderFilter({"productName": "mouse"}, queryset=Order.objects.all()).qs
+        self.assertEqual(list(qs), [self.both])
+        self.assertEqual(qs.count(), 1)
+
+        response = self.query("""
+            query { allOrders(productName: "mouse") { totalCount edges { node { id } } } }
+        """)
+        self.assertResponseNoErrors(response)
+        data = response.json()["data"]["allOrders"]
+        self.assertEqual((data["totalCount"], len(data["edges"])), (1, 1))
+
+    def test_product_id(self):
+        qs = OrderFilter({"product_id": self.laptop.id}, queryset=Order.objects.all()).qs
+        self.assertEqual(list(qs), [self.laptop_only])
+
+    def test_query_plan_uses_exists(self):
+        for data in ({"productName": "mouse"}, {"product_id": self.mouse.id}):
+            qs = OrderFilter(data, queryset=Order.objects.all()).qs
+            sql = str(qs.query)
+            self.assertIn("EXISTS", sql)
+            self.assertNotIn("JOIN", sql.split("EXISTS")[0])
+            self.assertNotIn("DISTINCT", sql)
+            # product_id is served by the through table index
+            if "product_id" in data:
+                self.assertIn("INDEX", qs.explain())
+
+
+class PersistedQueryTests(CRMGraphQLTestCase):
+    """Automatic persisted queries and the parsed document cache"""
+
+    QUERY = "query { customers { name } }"
+
+    def setUp(self):
+        reset_persisted_queries()
+        self.addCleanup(reset_persisted_queries)
+        Customer.objects.create(name="Alice", email="alice@example.com")
+
+    def post(self, payload):
+        return self.client.post(self.GRAPHQL_URL, json.dumps(payload), content_type="application/json")
+
+    def extensions(self, query):
+        return {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+
+    def test_unknown_hash_then_register(self):
+        response = self.post({"extensions": self.extensions(self.QUERY)})
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND")
+
+        response = self.post({"query": self.QUERY, "extensions": self.extensions(self.QUERY)})
+        self.assertEqual(response.json()["data"]["customers"], [{"name": "Alice"}])
+
+        # The hash alone is enough now, and the document is neither parsed nor validated again
+        with mock.patch("crm.persisted.parse") as parse, mock.patch("crm.persisted.validate") as validate:
+            response = self.post({"extensions": self.extensions(self.QUERY)})
+        self.assertEqual(response.json()["data"]["customers"], [{"name": "Alice"}])
+        parse.assert_not_called()
+        validate.assert_not_called()
+
+    def test_plain_queries_are_cached(self):
+        self.query(self.QUERY)
+        with mock.patch("crm.persisted.parse") as parse:
+            response = self.query(self.QUERY)
+        self.assertResponseNoErrors(response)
+        parse.assert_not_called()
+
+    def test_hash_mismatch(self):
+        response = self.post({"query": self.QUERY, "extensions": self.extensions("query { hello }")})
+        self.assertIn("does not match", response.json()["errors"][0]["message"])
+
+    def test_validation_errors_are_cached(self):
+        response = self.query("query { customers { nope } }")
+        self.assertResponseHasErrors(response)
+        response = self.query("query { customers { nope } }")
+        self.assertIn("nope", response.json()["errors"][0]["message"])
+
+    def test_lru_eviction(self):
+        cache = DocumentCache(2)
+        for key in "abc":
+            cache.set(key, key)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.get("b"), cache.get("c")), ("b", "c"))
+
+    def test_allow_list_only(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as manifest:
+            json.dump({query_hash(self.QUERY): self.QUERY}, manifest)
+        self.addCleanup(os.remove, manifest.name)
+
+        settings = {"ALLOW_LIST_ONLY": True, "ALLOW_LIST": manifest.name}
+        with override_settings(CRM_PERSISTED_QUERIES=settings):
+            reset_persisted_queries()
+            # Listed documents run by hash without ever being registered
+            response = self.post({"extensions": self.extensions(self.QUERY)})
+            self.assertEqual(response.json()["data"]["customers"], [{"name": "Alice"}])
+
+            response = self.query("query { products { name } }")
+            self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_ALLOWED")
+
+    def test_client_transport_retries_with_the_query(self):
+        transport = PersistedQueryTransport(url="http://testserver/graphql")
+        payloads = []
+
+        def post(method, url, json=None, **kwargs):
+            payloads.append(dict(json))
+            response = self.post(json)
+            return mock.Mock(text=response.content.decode(), status_code=response.status_code)
+
+        with Client(transport=transport) as session, mock.patch.object(transport.session, "request", post):
+            self.assertEqual(session.execute(gql(self.QUERY))["customers"], [{"name": "Alice"}])
+            session.execute(gql(self.QUERY))
+
+        # Full text on the first call only
+        self.assertEqual(["query" in payload for payload in payloads], [False, True, False])
+
+
+class ResponseCacheTests(CRMGraphQLTestCase):
+    """Query responses are cached until one of the models they read changes"""
+
+    PRODUCTS = "query { allProducts { edges { node { name stock } } } }"
+    CUSTOMERS = "query { customers { name } }"
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name="Mouse", price=Decimal("10.00"), stock=5)
+            self.customer = Customer.objects.create(name="Alice", email="alice@example.com")
+
+    def changes(self):
+        """Runs the on_commit invalidation, as the commit of a real request would"""
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        first = self.query(self.PRODUCTS).json()
+        with self.assertNumQueries(0):
+            # Same document, different whitespace
+            second = self.query(" ".join(self.PRODUCTS.split()).replace("{ ", "{\n")).json()
+        self.assertEqual(first, second)
+        self.assertEqual(response_cache.stats.as_dict()["hits"], 1)
+
+    def test_variables_are_part_of_the_key(self):
+        query = "query ($first: Int) { products(first: $first) { name } }"
+        with self.changes():
+            Product.objects.create(name="Keyboard", price=Decimal("20.00"))
+        self.assertEqual(len(self.query(query, variables={"first": 1}).json()["data"]["products"]), 1)
+        self.assertEqual(len(self.query(query, variables={"first": 2}).json()["data"]["products"]), 2)
+
+    def test_model_changes_only_invalidate_their_model(self):
+        self.query(self.PRODUCTS)
+        self.query(self.CUSTOMERS)
+        with self.changes():
+            self.product.stock = 7
+            self.product.save()
+
+        with self.assertNumQueries(0):
+            self.query(self.CUSTOMERS)
+        data = self.query(self.PRODUCTS).json()["data"]["allProducts"]["edges"]
+        self.assertEqual(data[0]["node"]["stock"], 7)
+
+    def test_nested_models_and_m2m_changes(self):
+        query = "query { orders { products { name } } }"
+        with self.changes():
+            order = Order.objects.create(customer=self.customer)
+        self.assertEqual(self.query(query).json()["data"]["orders"], [{"products": []}])
+
+        with self.changes():
+            order.products.add(self.product, through_defaults={"unit_price": self.product.price})
+        self.assertEqual(self.query(query).json()["data"]["orders"], [{"products": [{"name": "Mouse"}]}])
+
+    def test_item_changes_invalidate_their_order(self):
+        query = "query { orders { totalAmount items { quantity product { name } } } }"
+        with self.changes():
+            order = Order.objects.create(customer=self.customer, total_amount=Decimal("10.00"))
+            item = OrderItem.objects.create(order=order, product=self.product, unit_price=Decimal("10.00"))
+        self.assertEqual(self.query(query).json()["data"]["orders"][0]["items"][0]["quantity"], 1)
+
+        with self.changes():
+            item.quantity = 3
+            item.save()
+        self.assertEqual(self.query(query).json()["data"]["orders"][0]["items"][0]["quantity"], 3)
+
+        with self.changes():
+            OrderItem.objects.filter(order=order).delete()
+        self.assertEqual(self.query(query).json()["data"]["orders"][0]["items"], [])
+
+    def test_mutations_invalidate_without_signals(self):
+        self.query(self.CUSTOMERS)
+        with self.changes():
+            self.query("""
+                mutation { bulkCreateCustomers(input: [{name: "Bob", email: "bob@example.com"}]) { errors } }
+            """)
+        names = [c["name"] for c in self.query(self.CUSTOMERS).json()["data"]["customers"]]
+        self.assertEqual(names, ["Alice", "Bob"])
+
+    def test_rollback_keeps_the_versions(self):
+        versions = response_cache.get_versions(["crm.product"])
+        with self.changes():
+            try:
+                with transaction.atomic():
+                    self.product.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(response_cache.get_versions(["crm.product"]), versions)
+
+    def test_mutations_are_not_cached(self):
+        mutation = "mutation { updateLowStockProducts(threshold: 10, amount: 1) { products { stock } } }"
+        with self.changes():
+            self.query(mutation)
+            second = self.query(mutation).json()
+        self.assertEqual(second["data"]["updateLowStockProducts"]["products"], [{"stock": 7}])
+        self.assertEqual(response_cache.stats.as_dict()["misses"], 0)
+
+    def test_stats_endpoint(self):
+        self.query(self.CUSTOMERS)
+        self.query(self.CUSTOMERS)
+        stats = self.client.get("/graphql/cache-stats").json()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+
+    def test_cache_outage_does_not_fail_writes(self):
+        with mock.patch.object(response_cache.get_cache(), "incr", side_effect=ConnectionError):
+            with self.assertLogs("crm.response_cache", "ERROR"), self.changes():
+                self.product.stock = 9
+                self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+    def test_off_on_a_per_process_backend(self):
+        with override_settings(CRM_RESPONSE_CACHE={"ALIAS": "default"}):
+            self.query(self.CUSTOMERS)
+            self.query(self.CUSTOMERS)
+            self.assertFalse(self.client.get("/graphql/cache-stats").json()["enabled"])
+            # Nothing to invalidate either
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.product.save()
+            self.assertFalse(any(isinstance(c, response_cache._PendingInvalidation) for c in callbacks))
+        self.assertEqual(response_cache.stats.as_dict()["hits"], 0)
+
+
+class QueryCostTests(CRMGraphQLTestCase):
+    """Documents over the depth/cost budget are rejected before execution"""
+
+    def setUp(self):
+        super().setUp()
+        # Validation results are cached with the documents
+        reset_persisted_queries()
+        self.addCleanup(reset_persisted_queries)
+
+    def test_cost_is_reported(self):
+        response = self.query("""
+            { customers(first: 5) { name orders(first: 2) { totalCount edges { node { id } } } } }
+        """)
+        self.assertResponseNoErrors(response)
+        cost = response.json()["extensions"]["cost"]
+        # 5 customers x (1 + 2 orders x (1 edge + 1 node))
+        self.assertEqual((cost["depth"], cost["estimated"]), (5, 35))
+
+    def test_missing_page_size_counts_the_largest_page(self):
+        response = self.query("""
+            { allCustomers { edges { node { orders { edges { node { products { name } } } } } } } }
+        """)
+        self.assertResponseNoErrors(response)
+        # 100 customers x 100 orders x 10 products, plus the edges and nodes
+        self.assertEqual(response.json()["extensions"]["cost"]["estimated"], 130300)
+
+    def test_variables_count_with_their_default(self):
+        response = self.query("query ($n: Int = 3) { products(first: $n) { name } }", variables={"n": 1})
+        self.assertEqual(response.json()["extensions"]["cost"]["estimated"], 3)
+
+    def test_too_deep(self):
+        with self.assertNumQueries(0):
+            response = self.query("""
+                { allCustomers(first: 1) { edges { node { orders(first: 1) { edges { node {
+                    customer { orders(first: 1) { edges { node { customer { name } } } } }
+                } } } } } } }
+            """)
+        self.assertResponseHasErrors(response)
+        error = response.json()["errors"][0]
+        self.assertEqual(error["extensions"]["code"], "QUERY_TOO_EXPENSIVE")
+        self.assertIn("12 levels deep", error["message"])
+
+    def test_too_expensive_through_fragments(self):
+        with override_settings(CRM_QUERY_COST={"MAX_COST": 1000}):
+            response = self.query("""
+                query Dashboard { allCustomers(first: 50) { edges { node { ...Orders } } } }
+                fragment Orders on CustomerType { orders(first: 50) { edges { node { id } } } }
+            """)
+        self.assertResponseHasErrors(response)
+        error = response.json()["errors"][0]
+        self.assertIn("Operation 'Dashboard' has an estimated cost of 7650", error["message"])
+        self.assertEqual(error["extensions"]["cost"], {"depth": 7, "estimated": 7650})
+
+
+class AsyncViewTests(CRMGraphQLTestCase):
+    """The ASGI view answers like the sync one"""
+
+    ASYNC_URL = "/graphql/async"
+
+    async def post_both(self, query):
+        """Responses of the sync and the async view to the same query"""
+        sync = await sync_to_async(self.query)(query)
+        response_cache.get_cache().clear()
+        async_ = await self.async_client.post(
+            self.ASYNC_URL, json.dumps({"query": query}), content_type="application/json"
+        )
+        return sync.json(), async_.json()
+
+    async def test_sibling_root_fields(self):
+        await sync_to_async(self.create_orders)(3)
+        sync, async_ = await self.post_both("""
+            query {
+                customers { name orders { totalCount edges { node { products { name } } } } }
+                products(first: 2) { name }
+                orders { customer { email } products { name } }
+                crmStats { customerCount orderCount revenue daily { orderCount revenue } }
+            }
+        """)
+        self.assertNotIn("errors", async_)
+        self.assertEqual(sync, async_)
+        self.assertEqual(len(async_["data"]["orders"]), 6)
+
+    async def test_connection_fields(self):
+        await sync_to_async(self.create_orders)(2)
+        sync, async_ = await self.post_both("""
+            query {
+                allCustomers(orderBy: ["-name"]) { totalCount edges { node { name orders { edges { node { id } } } } } }
+                allOrders(first: 1) { pageInfo { hasNextPage } edges { node { customer { name } } } }
+            }
+        """)
+        self.assertNotIn("errors", async_)
+        self.assertEqual(sync, async_)
+
+    async def test_sales_rollup_fields(self):
+        await sync_to_async(self.create_orders)(2)
+        await sync_to_async(refresh_sales_rollup)()
+        product_id = await Product.objects.values_list("id", flat=True).afirst()
+        sync, async_ = await self.post_both(f"""
+            query {{
+                salesByDay {{ date units revenue }}
+                productSales: salesByDay(productId: {product_id}) {{ date units orderCount revenue }}
+                topProducts(first: 2) {{ product {{ name }} units revenue }}
+            }}
+        """)
+        self.assertNotIn("errors", async_)
+        self.assertEqual(sync, async_)
+        self.assertEqual(async_["data"]["salesByDay"][0]["units"], 8)
+
+    async def test_mutation(self):
+        product = await Product.objects.acreate(name="Mouse", price=Decimal("10.00"), stock=1)
+        customer = await Customer.objects.acreate(name="Alice", email="alice@example.com")
+        mutation = """
+            mutation ($input: CreateOrderInput!) { createOrder(input: $input) { order { totalAmount } } }
+        """
+        variables = {"input": {"customerId": customer.id, "productIds": [product.id]}}
+        response = await self.async_client.post(
+            self.ASYNC_URL, json.dumps({"query": mutation, "variables": variables}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["data"]["createOrder"]["order"]["totalAmount"], "10.00")
+        await product.arefresh_from_db()
+        self.assertEqual(product.stock, 0)
+
+    async def test_errors_and_cache(self):
+        response = await self.async_client.post(
+            self.ASYNC_URL, json.dumps({"query": "{ customers(first: 0) { name } }"}),
+            content_type="application/json",
+        )
+        self.assertIn("errors", response.json())
+
+        for _ in range(2):
+            response = await self.async_client.post(
+                self.ASYNC_URL, json.dumps({"query": "{ hello }"}), content_type="application/json",
+            )
+        self.assertEqual(response.json()["data"], {"hello": "Hello, GraphQL!"})
+        self.assertIn("cost", response.json()["extensions"])
+        self.assertEqual(response_cache.stats.as_dict()["hits"], 1)
+
+    async def test_resolvers_leave_the_event_loop_only_for_the_database(self):
+        middleware = SyncResolverMiddleware()
+        info = SimpleNamespace()
+        calls = []
+
+        def loaded(root, info):
+            calls.append(asyncio.get_running_loop())
+            return "loaded"
+
+        def needs_database(root, info):
+            calls.append(None)
+            return Customer.objects.count()
+
+        self.assertEqual(middleware.resolve(loaded, None, info), "loaded")
+        result = middleware.resolve(needs_database, None, info)
+        self.assertEqual(await result, 0)
+        # Tried inline once, answered from the thread
+        self.assertEqual(len(calls), 3)
+
+
+class TracingTests(CRMGraphQLTestCase):
+    """Phases, resolver times and SQL counts, in the response or at /metrics"""
+
+    QUERY = "query { allOrders(first: 3) { edges { node { customer { name } products { name } } } } }"
+
+    def setUp(self):
+        super().setUp()
+        reset_persisted_queries()
+        tracing.metrics.reset()
+        self.create_orders(2)
+
+    def traced(self, query, url="/graphql"):
+        return self.client.post(
+            url, json.dumps({"query": query}), content_type="application/json",
+            headers={"X-CRM-Tracing": "1"},
+        ).json()
+
+    def test_tracing_extension(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.traced(self.QUERY)
+        self.assertNotIn("errors", response)
+        trace = response["extensions"]["tracing"]
+        self.assertEqual(set(trace["phases"]), {"parse", "validate", "execute"})
+        self.assertEqual(trace["sql"]["count"], len(queries))
+
+        resolvers = {tuple(r["path"]): r for r in trace["resolvers"]}
+        self.assertEqual(resolvers[("allOrders",)]["field"], "Query.allOrders")
+        self.assertGreater(resolvers[("allOrders",)]["sqlCount"], 0)
+        self.assertEqual(sum(r["sqlCount"] for r in trace["resolvers"]), len(queries))
+        self.assertIn(("allOrders", "edges", 0, "node", "customer"), resolvers)
+        # Attribute reads are not timed
+        self.assertNotIn(("allOrders", "edges", 0, "node", "customer", "name"), resolvers)
+
+        # The document comes from the persisted cache now
+        response = self.traced(self.QUERY)
+        self.assertEqual(set(response["extensions"]["tracing"]["phases"]), {"execute"})
+
+    def test_no_header_no_extension(self):
+        response = self.query(self.QUERY)
+        self.assertResponseNoErrors(response)
+        self.assertNotIn("tracing", response.json()["extensions"])
+
+    @override_settings(CRM_TRACING={"HEADER": None})
+    def test_header_can_be_disabled(self):
+        self.assertNotIn("tracing", self.traced(self.QUERY)["extensions"])
+
+    def test_metrics(self):
+        self.query(self.QUERY)
+        self.query(self.QUERY)
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn("# TYPE crm_graphql_resolver_seconds histogram", text)
+        # The second response comes from the response cache, no resolver runs
+        self.assertIn('crm_graphql_resolver_seconds_count{field="Query.allOrders"} 1', text)
+        self.assertIn('crm_graphql_phase_seconds_count{phase="encode"} 2', text)
+        self.assertIn('crm_graphql_request_sql_queries_bucket{le="+Inf"} 2', text)
+
+    def test_async_view_attributes_sql_to_concurrent_fields(self):
+        response = self.traced("query { customers { name } products { name } }", url="/graphql/async")
+        self.assertNotIn("errors", response)
+        resolvers = {tuple(r["path"]): r for r in response["extensions"]["tracing"]["resolvers"]}
+        self.assertEqual(resolvers[("customers",)]["sqlCount"], 1)
+        self.assertEqual(resolvers[("products",)]["sqlCount"], 1)
+
+
+class CustomerStatsTests(CRMGraphQLTestCase):
+    """Order aggregates stored on the customer follow the order writes"""
+
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.product = Product.objects.create(name="Laptop", price=Decimal("999.99"), stock=10)
+
+    def create_order(self):
+        response = self.query("""
+            mutation ($input: CreateOrderInput!) { createOrder(input: $input) { order { id } } }
+        """, variables={"input": {"customerId": self.customer.id, "productIds": [self.product.id]}})
+        self.assertResponseNoErrors(response)
+        return Order.objects.latest("pk")
+
+    def assertStats(self, order_count, revenue, last_order_at):
+        self.customer.refresh_from_db()
+        self.assertEqual(
+            (self.customer.order_count, self.customer.lifetime_revenue, self.customer.last_order_at),
+            (order_count, Decimal(revenue), last_order_at),
+        )
+
+    def test_create_and_delete_orders(self):
+        self.assertStats(0, "0", None)
+        first = self.create_order()
+        second = self.create_order()
+        self.assertStats(2, "1999.98", second.order_date)
+
+        second.delete()
+        self.assertStats(1, "999.99", first.order_date)
+        first.delete()
+        self.assertStats(0, "0", None)
+
+    def test_update_after_create(self):
+        other = Customer.objects.create(name="Other", email="other@example.com")
+        order = Order.objects.create(customer=self.customer)
+        order.total_amount = Decimal("50.00")
+        order.save()
+        self.assertStats(1, "50.00", order.order_date)
+
+        order.order_date -= timedelta(days=3)
+        order.save()
+        self.assertStats(1, "50.00", order.order_date)
+
+        # Moving the order updates both customers
+        order.customer = other
+        order.save()
+        self.assertStats(0, "0", None)
+        other.refresh_from_db()
+        self.assertEqual((other.order_count, other.lifetime_revenue), (1, Decimal("50.00")))
+
+    def test_customer_delete_skips_the_stats(self):
+        self.create_order()
+        with CaptureQueriesContext(connection) as queries:
+            self.customer.delete()
+        self.assertFalse(any(q["sql"].startswith("UPDATE") for q in queries))
+
+    def test_rebuild_command(self):
+        order = self.create_order()
+        Customer.objects.update(order_count=7, lifetime_revenue=0, last_order_at=None)
+        call_command("rebuild_customer_stats", "--batch-size", "1", stdout=StringIO())
+        self.assertStats(1, "999.99", order.order_date)
+
+    def test_fields_filters_and_ordering(self):
+        self.create_order()
+        other = Customer.objects.create(name="Window shopper", email="shopper@example.com")
+        response = self.query("""
+            query {
+                allCustomers(orderBy: ["-lifetime_revenue"]) {
+                    edges { node { name orderCount lifetimeRevenue lastOrderAt } }
+                }
+                big: allCustomers(lifetimeRevenueGte: 500, orderCountGte: 1) { edges { node { name } } }
+                idle: allCustomers(orderCountLte: 0) { edges { node { name } } }
+            }
+        """)
+        self.assertResponseNoErrors(response)
+        data = response.json()["data"]
+        nodes = [edge["node"] for edge in data["allCustomers"]["edges"]]
+        self.assertEqual([n["name"] for n in nodes], ["Buyer", other.name])
+        self.assertEqual((nodes[0]["orderCount"], nodes[0]["lifetimeRevenue"]), (1, "999.99"))
+        self.assertIsNone(nodes[1]["lastOrderAt"])
+        self.assertEqual([e["node"]["name"] for e in data["big"]["edges"]], ["Buyer"])
+        self.assertEqual([e["node"]["name"] for e in data["idle"]["edges"]], [other.name])
+
+    def test_revenue_ordering_scans_its_index(self):
+        plan = Customer.objects.order_by("-lifetime_revenue", "-pk")[:50].explain()
+        self.assertIn("crm_customer_revenue_idx", plan)
+
+
+class SalesRollupTests(CRMGraphQLTestCase):
+    """The daily sales rollup recomputes the days whose orders changed"""
+
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal("900.00"), stock=10)
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("25.00"), stock=10)
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def create_order(self, day, *products):
+        order = Order.objects.create(
+            customer=self.customer,
+            order_date=timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+            + timedelta(hours=12),
+            total_amount=sum(p.price for p in products),
+        )
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=p, unit_price=p.price) for p in products)
+        return order
+
+    def rollup(self):
+        return {
+            (row.date, row.product_id): (row.units, row.order_count, row.revenue)
+            for row in DailySalesRollup.objects.all()
+        }
+
+    def test_refresh_recomputes_the_new_days_only(self):
+        self.create_order(self.yesterday, self.laptop, self.mouse)
+        self.create_order(self.yesterday, self.mouse)
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(self.rollup(), {
+            (self.yesterday, None): (3, 2, Decimal("950.00")),
+            (self.yesterday, self.laptop.pk): (1, 1, Decimal("900.00")),
+            (self.yesterday, self.mouse.pk): (2, 2, Decimal("50.00")),
+        })
+
+        self.assertEqual(refresh_sales_rollup(), [])
+        self.create_order(self.today, self.mouse)
+        self.assertEqual(refresh_sales_rollup(), [self.today])
+        self.assertEqual(self.rollup()[(self.today, None)], (1, 1, Decimal("25.00")))
+        self.assertEqual(len(self.rollup()), 5)
+
+    def test_items_give_units_and_revenue(self):
+        order = self.create_order(self.yesterday, self.mouse)
+        OrderItem.objects.filter(order=order).update(quantity=3, unit_price=Decimal("20.00"))
+        refresh_sales_rollup()
+        self.assertEqual(self.rollup()[(self.yesterday, self.mouse.pk)], (3, 1, Decimal("60.00")))
+
+        # Saving an item of an order already rolled up marks its day
+        item = OrderItem.objects.get(order=order)
+        item.quantity = 1
+        item.save()
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(self.rollup()[(self.yesterday, self.mouse.pk)], (1, 1, Decimal("20.00")))
+
+    def test_deleted_order_marks_its_day_stale(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order(self.yesterday, self.laptop)
+            order = self.create_order(self.yesterday, self.mouse)
+        refresh_sales_rollup()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual(list(StaleSalesDay.objects.values_list("date", flat=True)), [self.yesterday])
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(self.rollup(), {
+            (self.yesterday, None): (1, 1, Decimal("900.00")),
+            (self.yesterday, self.laptop.pk): (1, 1, Decimal("900.00")),
+        })
+        self.assertFalse(StaleSalesDay.objects.exists())
+
+    def test_moved_order_marks_both_days_stale(self):
+        order = self.create_order(self.yesterday, self.mouse)
+        refresh_sales_rollup()
+        order.order_date += timedelta(days=1)
+        order.save()
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday, self.today])
+        self.assertEqual(self.rollup(), {
+            (self.today, None): (1, 1, Decimal("25.00")),
+            (self.today, self.mouse.pk): (1, 1, Decimal("25.00")),
+        })
+
+    def test_new_order_below_the_watermark(self):
+        # An order committed after a refresh read its id or a higher one
+        with self.captureOnCommitCallbacks(execute=True):
+            late = self.create_order(self.yesterday, self.mouse)
+        SalesRollupState.objects.create(last_order_id=late.pk)
+        self.assertEqual(list(StaleSalesDay.objects.values_list("date", flat=True)), [self.yesterday])
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(self.rollup()[(self.yesterday, self.mouse.pk)], (1, 1, Decimal("25.00")))
+
+    def test_deleted_items_and_products_mark_their_days(self):
+        order = self.create_order(self.yesterday, self.laptop, self.mouse)
+        refresh_sales_rollup()
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.filter(order=order, product=self.mouse).delete()
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(self.rollup()[(self.yesterday, None)][0], 1)
+
+        OrderItem.objects.get(order=order).delete()
+        self.assertEqual(refresh_sales_rollup(), [self.yesterday])
+        self.assertEqual(set(self.rollup()), {(self.yesterday, None)})
+
+        other = self.create_order(self.today, self.mouse)
+        refresh_sales_rollup()
+        self.mouse.delete()
+        self.assertEqual(refresh_sales_rollup(), [self.today])
+        self.assertEqual(self.rollup()[(self.today, None)][0], 0)
+        self.assertFalse(OrderItem.objects.filter(order=other).exists())
+
+    def test_removed_products_mark_the_day_stale(self):
+        order = self.create_order(self.yesterday, self.laptop, self.mouse)
+        refresh_sales_rollup()
+        self.mouse.orders.remove(order)
+        refresh_sales_rollup()
+        self.assertNotIn((self.yesterday, self.mouse.pk), self.rollup())
+
+    def test_full_refresh_command(self):
+        self.create_order(self.yesterday, self.laptop)
+        refresh_sales_rollup()
+        DailySalesRollup.objects.update(units=99)
+        call_command("refresh_sales_rollup", "--full", stdout=StringIO())
+        self.assertEqual(self.rollup()[(self.yesterday, None)], (1, 1, Decimal("900.00")))
+
+    def test_queries_read_the_rollup(self):
+        self.create_order(self.yesterday, self.laptop, self.mouse)
+        self.create_order(self.today, self.mouse)
+        self.create_order(self.today, self.mouse)
+        refresh_sales_rollup()
+
+        query = """
+            query ($start: Date) {
+                salesByDay(startDate: $start) { date units orderCount revenue }
+                mouse: salesByDay(productId: %d) { date units }
+                byUnits: topProducts(orderBy: "units") { product { name } units orderCount revenue }
+                byRevenue: topProducts(first: 1) { product { name } revenue }
+            }
+        """ % self.mouse.pk
+        # One query per list, plus the products of each topProducts
+        with self.assertNumQueries(6):
+            response = self.query(query, variables={"start": self.today.isoformat()})
+        self.assertResponseNoErrors(response)
+        data = response.json()["data"]
+        self.assertEqual(data["salesByDay"], [
+            {"date": self.today.isoformat(), "units": 2, "orderCount": 2, "revenue": "50.00"},
+        ])
+        self.assertEqual([day["units"] for day in data["mouse"]], [1, 2])
+        self.assertEqual(data["byUnits"], [
+            {"product": {"name": "Mouse"}, "units": 3, "orderCount": 3, "revenue": "75.00"},
+            {"product": {"name": "Laptop"}, "units": 1, "orderCount": 1, "revenue": "900.00"},
+        ])
+        self.assertEqual(data["byRevenue"], [{"product": {"name": "Laptop"}, "revenue": "900.00"}])
+
+        response = self.query('query { topProducts(orderBy: "price") { units } }')
+        self.assertResponseHasErrors(response)
+
+
+class ImportOrdersTests(CRMGraphQLTestCase):
+    """bulkCreateOrders and import_orders insert orders per chunk and report the bad rows"""
+
+    MUTATION = """
+        mutation ($input: [BulkCreateOrdersInput]!) {
+            bulkCreateOrders(input: $input) {
+                orders { orderDate totalAmount customer { name } items { product { name } quantity unitPrice } }
+                errors
+            }
+        }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal("900.00"), stock=1)
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("25.00"), stock=1)
+
+    def test_mutation_keeps_dates_and_prices(self):
+        response = self.query(self.MUTATION, variables={"input": [
+            {
+                "customerId": self.customer.id, "orderDate": "2024-03-01T10:00:00+00:00",
+                "items": [{"productId": self.laptop.id, "unitPrice": "850.00"}, {"productId": self.mouse.id, "quantity": 2}],
+            },
+            {"customerId": 999, "productIds": [self.mouse.id]},
+            {"customerId": self.customer.id, "productIds": [self.mouse.id, 999]},
+            {"customerId": self.customer.id, "productIds": [self.mouse.id]},
+        ]})
+        self.assertResponseNoErrors(response)
+        data = response.json()["data"]["bulkCreateOrders"]
+        self.assertEqual(data["errors"], ["Order 2: Invalid customer ID 999", "Order 3: Invalid product ID 999"])
+        self.assertEqual(len(data["orders"]), 2)
+        first = data["orders"][0]
+        self.assertEqual((first["orderDate"], first["totalAmount"]), ("2024-03-01T10:00:00+00:00", "900.00"))
+        self.assertEqual(first["items"], [
+            {"product": {"name": "Laptop"}, "quantity": 1, "unitPrice": "850.00"},
+            {"product": {"name": "Mouse"}, "quantity": 2, "unitPrice": "25.00"},
+        ])
+
+        # Past sales take no stock, the customer stats follow
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 1)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.order_count, self.customer.lifetime_revenue), (2, Decimal("925.00")))
+
+    def test_queries_per_chunk(self):
+        rows = [(n, {"customer_id": self.customer.id, "product_ids": [self.mouse.id]}) for n in range(10)]
+        # Per chunk: orders, items, customer stats; the lookups happen once
+        with self.assertNumQueries(2 + 3 * 3 + 3 * 2):
+            result = import_orders(iter(rows), chunk_size=4)
+        self.assertEqual((result.rows, result.created, result.errors), (10, 10, []))
+
+    def test_command_reads_ndjson_and_csv(self):
+        directory = tempfile.mkdtemp()
+        ndjson = os.path.join(directory, "orders.ndjson")
+        with open(ndjson, "w") as f:
+            f.write(json.dumps({"customer_id": self.customer.id, "items": [{"product_id": self.laptop.id}]}) + "\n")
+            f.write("not json\n")
+            f.write(json.dumps({"customer_id": self.customer.id, "product_ids": []}) + "\n")
+        csv_path = os.path.join(directory, "orders.csv")
+        with open(csv_path, "w") as f:
+            f.write("customer_id,order_date,items,product_ids\n")
+            f.write(f"{self.customer.id},2024-01-02T08:00:00,{self.mouse.id}:3:20.00,\n")
+            f.write(f"{self.customer.id},,{self.mouse.id}:0,\n")
+
+        out, err = StringIO(), StringIO()
+        call_command("import_orders", ndjson, stdout=out, stderr=err)
+        self.assertIn("Imported 1 of 3 rows", out.getvalue())
+        self.assertIn("row 2: Invalid JSON", err.getvalue())
+        self.assertIn("row 3: At least one product must be selected", err.getvalue())
+
+        err = StringIO()
+        call_command("import_orders", csv_path, stdout=StringIO(), stderr=err)
+        self.assertIn("row 3: Quantities must be positive", err.getvalue())
+        item = OrderItem.objects.get(product=self.mouse)
+        self.assertEqual((item.quantity, item.unit_price, item.order.total_amount), (3, Decimal("20.00"), Decimal("60.00")))
+        self.assertEqual(timezone.localtime(item.order.order_date).date().isoformat(), "2024-01-02")
+
+
+class ExportTests(CRMGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_orders(3, orders_per_customer=2)
+        Order.objects.filter(customer__name="Customer 0").update(order_date=timezone.now() - timedelta(days=30))
+
+    def get_lines(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode().splitlines()
+
+    def test_orders_csv_with_filters(self):
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response, lines = self.get_lines(f"/export/orders?format=csv&orderDateAfter={since}&customerName=customer 1")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="orders.csv"')
+        self.assertEqual(lines[0], "id,order_date,total_amount,customer_id,customer_name,customer_email")
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all(",20.00," in line and "customer1@example.com" in line for line in lines[1:]))
+        # Dates in ISO 8601
+        self.assertRegex(lines[1], r"^\d+,\d{4}-\d\d-\d\dT\d\d:\d\d:")
+
+    def test_customers_ndjson(self):
+        _, lines = self.get_lines("/export/customers?orderCountGte=2")
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row["name"] for row in rows], ["Customer 0", "Customer 1", "Customer 2"])
+        self.assertEqual((rows[0]["order_count"], rows[0]["lifetime_revenue"]), (2, "40.00"))
+
+    def test_one_query_whatever_the_size(self):
+        # Chunks of 2 rows: the six orders take three chunks, still read by a single query
+        with mock.patch.object(exports, "CHUNK_SIZE", 2), self.assertNumQueries(1):
+            _, lines = self.get_lines("/export/orders")
+        self.assertEqual(len(lines), 6)
+
+    def test_invalid_requests(self):
+        response = self.client.get("/export/orders?orderDateAfter=yesterday")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("orderDateAfter", response.json()["errors"])
+        self.assertEqual(self.client.get("/export/orders?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/export/products").status_code, 404)
+        self.assertEqual(self.client.post("/export/orders").status_code, 405)
@@ -0,0 +1,289 @@
+"""Timing of the GraphQL requests: phases, resolvers and SQL
+
+Every request to the CRM views runs under a Tracer, which records
+    - the parse, validate, execute and encode phases (parse and validate only
+      happen when the document is not in the crm.persisted cache yet)
+    - the wall time of each field resolver (TracingMiddleware, plain attribute
+      reads are left out)
+    - the number and duration of the SQL queries sent under each field
+SQL queries are counted by an execute wrapper installed on every database
+connection. A query belongs to the field whose resolver started last in the
+same context: a queryset returned by a resolver and iterated by graphql-core
+is counted under its field. Under async execution every field awaiting the
+database runs in its own task, so concurrent fields are told apart.
+
+Requests sending the CRM_TRACING["HEADER"] header get the details back under
+extensions.tracing (milliseconds). All requests feed the process-wide
+Prometheus histograms served at /metrics.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    "ENABLED": True,
+    "HEADER": "X-CRM-Tracing",
+}
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+_tracer = ContextVar("crm_tracer", default=None)
+_field = ContextVar("crm_traced_field", default=None)
+
+
+def get_setting(name):
+    return getattr(settings, "CRM_TRACING", {}).get(name, DEFAULTS[name])
+
+
+def current():
+    """Tracer of the request being executed, None outside of the views"""
+    return _tracer.get()
+
+
+def requested(request):
+    """Whether the client asked for extensions.tracing"""
+    header = get_setting("HEADER")
+    return bool(header and request.headers.get(header))
+
+
+def for_request(request):
+    """Tracer to enter around a request, a no-op context when tracing is off"""
+    if not get_setting("ENABLED"):
+        return nullcontext()
+    return Tracer(detailed=requested(request))
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class FieldTrace:
+    __slots__ = ("info", "start", "duration", "sql_count", "sql_duration")
+
+    def __init__(self, info, start):
+        # Names and path are only read when reporting, keep the resolver path cheap
+        self.info = info
+        self.start = start
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_duration = 0.0
+
+    @property
+    def field(self):
+        return f"{self.info.parent_type.name}.{self.info.field_name}"
+
+    def finish(self):
+        self.duration = perf_counter() - self.start
+
+    async def wait(self, awaitable):
+        # Runs in its own task: the SQL awaited here is this field's
+        _field.set(self)
+        try:
+            return await awaitable
+        finally:
+            self.finish()
+
+
+class Tracer:
+    """Timings of one request, entered by the views around the whole response"""
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.start = perf_counter()
+        self.phases = {}
+        self.fields = []
+        self.sql_count = 0
+        self.sql_duration = 0.0
+        self._lock = threading.Lock()
+        self._tokens = None
+
+    def __enter__(self):
+        self._tokens = (_tracer.set(self), _field.set(None))
+        return self
+
+    def __exit__(self, *exc_info):
+        tracer_token, field_token = self._tokens
+        _field.reset(field_token)
+        _tracer.reset(tracer_token)
+        metrics.observe(self)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def start_field(self, info):
+        trace = FieldTrace(info, perf_counter())
+        self.fields.append(trace)
+        _field.set(trace)
+        return trace
+
+    def add_sql(self, seconds):
+        trace = _field.get()
+        with self._lock:
+            self.sql_count += 1
+            self.sql_duration += seconds
+            if trace is not None:
+                trace.sql_count += 1
+                trace.sql_duration += seconds
+
+    def by_field(self):
+        """{"Type.field": [seconds, sql count, sql seconds]} summed over the calls"""
+        totals = {}
+        for trace in self.fields:
+            key = (trace.info.parent_type.name, trace.info.field_name)
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = [0.0, 0, 0.0]
+            total[0] += trace.duration
+            total[1] += trace.sql_count
+            total[2] += trace.sql_duration
+        return {f"{parent}.{field}": total for (parent, field), total in totals.items()}
+
+    def as_dict(self):
+        """extensions.tracing"""
+        return {
+            "duration": _ms(perf_counter() - self.start),
+            "phases": {name: _ms(seconds) for name, seconds in self.phases.items()},
+            "sql": {"count": self.sql_count, "duration": _ms(self.sql_duration)},
+            "resolvers": [
+                {
+                    "path": trace.info.path.as_list(),
+                    "field": trace.field,
+                    "returnType": str(trace.info.return_type),
+                    "startOffset": _ms(trace.start - self.start),
+                    "duration": _ms(trace.duration),
+                    "sqlCount": trace.sql_count,
+                    "sqlDuration": _ms(trace.sql_duration),
+                }
+                for trace in self.fields
+            ],
+        }
+
+
+@contextmanager
+def phase(name):
+    """Times a phase of the current request, does nothing outside of one"""
+    tracer = _tracer.get()
+    if tracer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add_phase(name, perf_counter() - start)
+
+
+def record_sql(execute, sql, params, many, context):
+    """Database execute wrapper counting the queries of the current request"""
+    tracer = _tracer.get()
+    if tracer is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        tracer.add_sql(perf_counter() - start)
+
+
+def install(connection, **kwargs):
+    """connection_created receiver adding record_sql to every connection"""
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+# ────────────── METRICS ──────────────
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Prometheus histogram kept in this process"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per bucket counts (the last one is +Inf), then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            names = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = f"{names}," if names else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f"{{{names}}}" if names else ""
+            lines.append(f"{self.name}_sum{suffix} {values[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+
+class Metrics:
+    """The histograms fed by the tracers"""
+
+    def __init__(self):
+        self.request_seconds = Histogram(
+            "crm_graphql_request_seconds", "Duration of the GraphQL requests.")
+        self.phase_seconds = Histogram(
+            "crm_graphql_phase_seconds", "Duration of the request phases.", ("phase",))
+        self.request_sql_queries = Histogram(
+            "crm_graphql_request_sql_queries", "SQL queries sent per request.", buckets=QUERY_BUCKETS)
+        self.resolver_seconds = Histogram(
+            "crm_graphql_resolver_seconds", "Resolver time of a field per request.", ("field",))
+        self.resolver_sql_queries = Histogram(
+            "crm_graphql_resolver_sql_queries", "SQL queries sent under a field per request.", ("field",),
+            buckets=QUERY_BUCKETS)
+        self.resolver_sql_seconds = Histogram(
+            "crm_graphql_resolver_sql_seconds", "SQL time under a field per request.", ("field",))
+        self.histograms = [
+            self.request_seconds, self.phase_seconds, self.request_sql_queries,
+            self.resolver_seconds, self.resolver_sql_queries, self.resolver_sql_seconds,
+        ]
+
+    def observe(self, tracer):
+        self.request_seconds.observe(perf_counter() - tracer.start)
+        self.request_sql_queries.observe(tracer.sql_count)
+        for name, seconds in tracer.phases.items():
+            self.phase_seconds.observe(seconds, name)
+        for field, (seconds, sql_count, sql_seconds) in tracer.by_field().items():
+            self.resolver_seconds.observe(seconds, field)
+            self.resolver_sql_queries.observe(sql_count, field)
+            self.resolver_sql_seconds.observe(sql_seconds, field)
+
+    def reset(self):
+        for histogram in self.histograms:
+            histogram.reset()
+
+    def exposition(self):
+        """The Prometheus text format"""
+        return "\n".join(histogram.exposition() for histogram in self.histograms) + "\n"
+
+
+metrics = Metrics()
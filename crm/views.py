@@ -1,3 +1,349 @@
-from django.shortcuts import render
+import json
+from collections import namedtuple
+from inspect import isawaitable
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBadRequest
+from django.views.generic import View
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, validate_schema
+
+from . import exports, response_cache, tracing
+from .cost import get_cost, validation_rules
+from .middleware import SyncResolverMiddleware, TracingMiddleware
+from .persisted import get_persisted_queries
+
+
+# What execute_graphql_request runs once the document is known to be valid
+Execution = namedtuple("Execution", "schema document operation cache_plan options")
+
+
+class CRMGraphQLView(GraphQLView):
+    """GraphQLView that executes documents from the persisted query cache
+        Same request handling as GraphQLView, but the parse/validate step goes
+        through crm.persisted, so a known document (sent as text or as its
+        sha256 hash) is never parsed or validated twice.
+        Query results are served from crm.response_cache when still current.
+        Documents over the crm.cost depth/cost budget are rejected, the cost of
+        the others is reported in the "extensions" of the response.
+        Every request is timed by crm.tracing.
+    """
+    validation_rules = validation_rules
+
+    def get_response(self, request, data, show_graphiql=False):
+        # Set by execute_graphql_request, read back by json_encode
+        self.extensions = None
+        with tracing.for_request(request):
+            return super().get_response(request, data, show_graphiql)
+
+    def json_encode(self, request, d, pretty=False):
+        extensions = dict(getattr(self, "extensions", None) or {})
+        tracer = tracing.current()
+        if tracer is not None and tracer.detailed:
+            extensions["tracing"] = tracer.as_dict()
+        if extensions:
+            d = {**d, "extensions": extensions}
+        with tracing.phase("encode"):
+            return super().json_encode(request, d, pretty)
+
+    def get_middleware(self, request):
+        middleware = list(super().get_middleware(request) or [])
+        if tracing.get_setting("ENABLED"):
+            # Last is outermost: times everything the resolver does
+            middleware.append(TracingMiddleware())
+        return middleware
+
+    @staticmethod
+    def get_persisted_hash(request, data):
+        """sha256Hash of the persistedQuery extension, None for plain requests"""
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted = (extensions or {}).get("persistedQuery")
+        return persisted.get("sha256Hash") if persisted else None
+
+    def prepare_execution(self, request, data, query, variables, operation_name, show_graphiql=False):
+        """Everything before execution: the document, the checks and the execute() options
+        Returns an Execution, or the ExecutionResult (None for GraphiQL) to answer with."""
+        sha256 = self.get_persisted_hash(request, data)
+        if not query and not sha256:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            prepared = get_persisted_queries().get_document(
+                schema,
+                query=query or None,
+                sha256=sha256,
+                validation_rules=self.validation_rules,
+                max_errors=graphene_settings.MAX_VALIDATION_ERRORS,
+            )
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+        document = prepared.document
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if prepared.errors:
+            return ExecutionResult(data=None, errors=prepared.errors)
+
+        self.extensions = {"cost": get_cost(prepared, schema, operation_name)}
+
+        operation = operation_ast.operation if operation_ast is not None else None
+        cache_plan = None
+        if response_cache.is_enabled() and operation == OperationType.QUERY:
+            cache_plan = response_cache.get_plan(prepared, schema)
+
+        options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            options["execution_context_class"] = self.execution_context_class
+
+        return Execution(schema, document, operation, cache_plan, options)
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        execution = self.prepare_execution(request, data, query, variables, operation_name, show_graphiql)
+        if not isinstance(execution, Execution):
+            return execution
+        return self.run_execution(request, execution)
+
+    def run_execution(self, request, execution):
+        with tracing.phase("execute"):
+            return self._run_execution(request, execution)
+
+    def _run_execution(self, request, execution):
+        try:
+            if (
+                execution.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(execution.schema, execution.document, **execution.options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            if execution.cache_plan is not None:
+                return self.execute_cached(execution)
+            return execute(execution.schema, execution.document, **execution.options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    @staticmethod
+    def cache_key(execution):
+        return response_cache.response_key(
+            execution.cache_plan,
+            execution.options["variable_values"],
+            execution.options["operation_name"],
+        )
+
+    def execute_cached(self, execution):
+        """Serves the query from the response cache, executes and stores it on a miss"""
+        cache = response_cache.get_cache()
+        key = self.cache_key(execution)
+        data = cache.get(key)
+        response_cache.stats.record(hit=data is not None)
+        if data is not None:
+            return ExecutionResult(data=data)
+
+        result = execute(execution.schema, execution.document, **execution.options)
+        if not result.errors:
+            cache.set(key, result.data, timeout=response_cache.get_setting("TIMEOUT"))
+        return result
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """CRMGraphQLView for ASGI, executing alx_backend_graphql.schema.async_schema
+        Queries run on the event loop: the async resolvers await the async ORM
+        and SyncResolverMiddleware moves the sync ones to a thread, so a request
+        waiting on the database does not hold a worker thread. Mutations run
+        in a thread on the sync path, inside their transaction.
+    """
+    # Route to get()/post() instead of the sync GraphQLView.dispatch
+    dispatch = View.dispatch
+
+    def __init__(self, schema=None, **kwargs):
+        if schema is None:
+            from alx_backend_graphql.schema import async_schema as schema
+        super().__init__(schema=schema, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        return await self.handle(request)
+
+    async def post(self, request, *args, **kwargs):
+        return await self.handle(request)
+
+    async def handle(self, request):
+        try:
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                # Only renders the GraphiQL page, nothing is executed
+                return GraphQLView.dispatch(self, request)
+
+            if self.batch:
+                responses = [await self.get_response_async(request, entry) for entry in data]
+                result = "[{}]".format(",".join([response[0] for response in responses]))
+                status_code = max((response[1] for response in responses), default=200)
+            else:
+                result, status_code = await self.get_response_async(request, data)
+
+            return HttpResponse(status=status_code, content=result, content_type="application/json")
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+            return response
+
+    async def get_response_async(self, request, data):
+        """GraphQLView.get_response, awaiting the execution"""
+        with tracing.for_request(request):
+            return await self._get_response_async(request, data)
+
+    async def _get_response_async(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        self.extensions = None
+
+        execution_result = await self.execute_graphql_request_async(
+            request, data, query, variables, operation_name
+        )
+
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(
+            not getattr(e, "path", None) for e in execution_result.errors
+        ):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        return self.json_encode(request, response), status_code
+
+    def get_middleware(self, request):
+        middleware = super().get_middleware(request)
+        if middleware and isinstance(middleware[-1], TracingMiddleware):
+            # Inside the tracing, so a resolver retried in a thread is timed once
+            return [*middleware[:-1], SyncResolverMiddleware(), middleware[-1]]
+        return [*middleware, SyncResolverMiddleware()]
+
+    async def execute_graphql_request_async(self, request, data, query, variables, operation_name):
+        execution = self.prepare_execution(request, data, query, variables, operation_name)
+        if not isinstance(execution, Execution):
+            return execution
+
+        if execution.operation == OperationType.MUTATION:
+            # Sync resolvers, no thread hops: the whole mutation runs in one thread
+            options = {**execution.options, "middleware": super().get_middleware(request)}
+            return await sync_to_async(self.run_execution)(request, execution._replace(options=options))
+
+        try:
+            with tracing.phase("execute"):
+                if execution.cache_plan is not None:
+                    return await self.execute_cached_async(execution)
+                return await self.execute_async(execution)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    @staticmethod
+    async def execute_async(execution):
+        result = execute(execution.schema, execution.document, **execution.options)
+        if isawaitable(result):
+            result = await result
+        return result
+
+    async def execute_cached_async(self, execution):
+        cache = response_cache.get_cache()
+        key = await sync_to_async(self.cache_key)(execution)
+        data = await cache.aget(key)
+        response_cache.stats.record(hit=data is not None)
+        if data is not None:
+            return ExecutionResult(data=data)
+
+        result = await self.execute_async(execution)
+        if not result.errors:
+            await cache.aset(key, result.data, timeout=response_cache.get_setting("TIMEOUT"))
+        return result
+
+
+def metrics(request):
+    """Tracing histograms of this process in the Prometheus text format"""
+    return HttpResponse(tracing.metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def response_cache_stats(request):
+    """Hit/miss counters of the GraphQL response cache (for this process)"""
+    return JsonResponse({
+        "enabled": response_cache.is_enabled(),
+        "backend": response_cache.get_setting("ALIAS"),
+        **response_cache.stats.as_dict(),
+    })
+
+
+def export(request, resource):
+    """Streams a table filtered like its GraphQL connection, see crm.exports
+        GET /export/orders?format=csv&orderDateAfter=2024-01-01
+        format is ndjson (the default) or csv.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    table = exports.EXPORTS.get(resource)
+    if table is None:
+        raise Http404(f"No export named {resource}")
+    format = request.GET.get("format", "ndjson")
+    if format not in exports.FORMATS:
+        return JsonResponse({"errors": {"format": [f"Must be one of {', '.join(exports.FORMATS)}"]}}, status=400)
+    filterset = table.filterset(request.GET)
+    if not filterset.is_valid():
+        return JsonResponse({"errors": filterset.errors}, status=400)
+
+    response = StreamingHttpResponse(exports.stream(table, filterset.qs, format), content_type=exports.FORMATS[format])
+    response["Content-Disposition"] = f'attachment; filename="{resource}.{format}"'
+    return response
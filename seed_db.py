@@ -8,7 +8,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql.settings")
 django.setup()
 
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderItem
 
 
 # ───── Customers ─────
@@ -48,9 +48,13 @@ orders_data = [
 ]
 
 for o in orders_data:
-    order = Order.objects.create(customer=o["customer"], order_date=timezone.now())
-    order.products.add(*[products[i] for i in o["product_indices"]])
-    order.total_amount = sum(products[i].price for i in o["product_indices"])
-    order.save()
+    order = Order.objects.create(
+        customer=o["customer"],
+        order_date=timezone.now(),
+        total_amount=sum(products[i].price for i in o["product_indices"]),
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=products[i], unit_price=products[i].price) for i in o["product_indices"]
+    )
 
 print("Seeding completed successfully")
\ No newline at end of file